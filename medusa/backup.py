@@ -15,10 +15,13 @@
 
 
 import base64
+import collections
+import concurrent.futures
 import datetime
 import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import pathlib
 import psutil
@@ -29,61 +32,113 @@ import traceback
 from libcloud.storage.providers import Provider
 from retrying import retry
 
+import medusa.page_cache
+import medusa.rate_limiter
+import medusa.storage.checksum
+
+from medusa.backup_journal import backup_journal, continuous_journal
+from medusa.backup_scope import BackupScope
 from medusa.cassandra_utils import Cassandra
-from medusa.index import add_backup_start_to_index, add_backup_finish_to_index, set_latest_backup_in_index
+from medusa.checksum_cache import load_checksum_cache
+from medusa.index import add_backup_start_to_index, backup_finish_index_blobs, backup_finished_index_blobs, \
+    get_backup_finished_from_index, latest_backup_index_blobs, upload_index_blobs
+from medusa.manifest import Manifest, ManifestWriter, object_key
 from medusa.monitoring import Monitoring
-from medusa.storage import Storage, format_bytes_str, ManifestObject
+from medusa.page_cache import SequentialReader
+from medusa.storage import Storage, format_bytes_str, CachedObject, ManifestObject
+from medusa.storage.abstract_storage import key_shard
+from medusa.storage.packing import pack_small_files
 
 
 BLOCK_SIZE_BYTES = 65536
+# Staggered backups check whether the previous node finished after this many seconds, doubled after each check
+STAGGER_MIN_DELAY_SECONDS = 10
+STAGGER_MAX_DELAY_SECONDS = 300
 
 
 def generate_md5_hash(src, block_size=BLOCK_SIZE_BYTES):
+    return generate_checksum(src, block_size=block_size)
+
+
+def generate_checksum(src, checksum=None, block_size=BLOCK_SIZE_BYTES):
+    """
+    :param checksum: The name of the checksum to hash the file with, MD5 by default
+    :return: The base64 encoded digest of the file
+    """
+    checksum = medusa.storage.checksum.get_checksum(checksum)
+    encode = checksum.encode
+    checksum = checksum.new()
+    with SequentialReader(src) as f:
+        if block_size < 0:
+            checksum.update(f.read())
+        else:
+            # Incrementally read data into a single reusable buffer and update the digest
+            buffer = bytearray(min(block_size, f.size))
+            view = memoryview(buffer)
+            while True:
+                read_size = f.readinto(buffer)
+                if not read_size:
+                    break
+                checksum.update(view[:read_size])
+
+    # Once we have all the data, compute checksum and convert it into base64
+    return encode(checksum.digest())
+
 
-    checksum = hashlib.md5()
-    with open(str(src), 'rb') as f:
-        # Incrementally read data and update the digest
-        while True:
-            read_data = f.read(block_size)
-            if not read_data:
-                break
-            checksum.update(read_data)
+def generate_md5_hashes(srcs, block_size=BLOCK_SIZE_BYTES, max_workers=None):
+    srcs = list(srcs)
+    return generate_checksums(srcs, [None] * len(srcs), block_size, max_workers)
 
-    # Once we have all the data, compute checksum
-    checksum = checksum.digest()
-    # Convert into a bytes type that can be base64 encoded
-    base64_md5 = base64.encodebytes(checksum).decode('UTF-8').strip()
-    # Print the Base64 encoded CRC32C
-    return base64_md5
+
+def generate_checksums(srcs, checksums, block_size=BLOCK_SIZE_BYTES, max_workers=None):
+    """
+    Hashes several files concurrently. hashlib releases the GIL while digesting large buffers, so worker threads are
+    enough to spread the hashing over all the cores of the host.
+
+    :param checksums: the name of the checksum to hash each file with, None for MD5
+    :return: the digests of the files, in the same order as srcs
+    """
+    srcs = list(srcs)
+    if len(srcs) == 0:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers or multiprocessing.cpu_count()) as executor:
+        return list(executor.map(lambda src, checksum: generate_checksum(src, checksum, block_size), srcs, checksums))
+
+
+def is_base64_md5(value):
+    try:
+        return len(base64.b64decode(str(value), validate=True)) == hashlib.md5().digest_size
+    except ValueError:
+        return False
 
 
 class NodeBackupCache(object):
     NEVER_BACKED_UP = ['manifest.json']
 
-    def __init__(self, *, node_backup, differential_mode, storage_driver, storage_provider):
+    def __init__(self, *, node_backup, differential_mode, storage_driver, storage_provider, checksum_cache=None,
+                 hash_workers=None, hash_block_size=BLOCK_SIZE_BYTES):
         if node_backup:
             self._node_backup_cache_is_differential = node_backup.is_differential
             self._backup_name = node_backup.name
             self._bucket_name = node_backup.storage.config.bucket_name
             self._data_path = node_backup.data_path
-            self._cached_objects = {
-                (section['keyspace'], section['columnfamily']): {
-                    pathlib.Path(object['path']).name: object
-                    for object in section['objects']
-                }
-                for section in json.loads(node_backup.manifest)
-            }
+            self._cached_manifest = node_backup.load_manifest()
             self._differential_mode = differential_mode
         else:
             self._node_backup_cache_is_differential = False
             self._backup_name = None
             self._bucket_name = None
             self._data_path = ''
-            self._cached_objects = {}
+            self._cached_manifest = Manifest([])
             self._differential_mode = False
         self._replaced = 0
         self._storage_driver = storage_driver
         self._storage_provider = storage_provider
+        self._checksum_cache = checksum_cache
+        self._hash_workers = hash_workers
+        self._hash_block_size = hash_block_size
+        # Digests computed ahead of the comparisons, by file and checksum
+        self._digests = {}
 
     @property
     def replaced(self):
@@ -97,22 +152,34 @@ class NodeBackupCache(object):
         retained = list()
         skipped = list()
         path_prefix = self._storage_driver.get_path_prefix(self._data_path)
+        cached_items = {
+            src.name: self._cached_manifest.get(keyspace, columnfamily, src.name)
+            for src in srcs
+        }
+        # Files get compared with the checksum they were hashed with in the previous backup
+        self.hash_files(
+            (src, medusa.storage.checksum.recorded_name(cached_items[src.name].get('checksum'))) for src in srcs
+            if cached_items[src.name] is not None and src.stat().st_size == cached_items[src.name]['size']
+        )
         for src in srcs:
             if src.name in self.NEVER_BACKED_UP:
                 pass
             else:
-                fqtn = (keyspace, columnfamily)
-                cached_item = self._cached_objects.get(fqtn, {}).get(src.name)
+                cached_item = cached_items[src.name]
+                copy_from_cache = self._differential_mode is False or self._node_backup_cache_is_differential is False
                 if cached_item is None or self.files_are_different(src, cached_item):
                     # We have no matching object in the cache matching the file
                     retained.append(src)
+                elif copy_from_cache and 'archive' in cached_item:
+                    # Packed files are not objects of their own which could be copied, they get packed again
+                    retained.append(src)
                 else:
                     # File was already present in the previous backup
                     # In case the backup isn't differential or the cache backup isn't differential, copy from cache
-                    if self._differential_mode is False or self._node_backup_cache_is_differential is False:
-                        prefixed_path = '{}{}'.format(path_prefix, cached_item['path'])
+                    if copy_from_cache:
+                        prefixed_path = '{}{}'.format(path_prefix, object_key(cached_item))
                         cached_item_path = self._storage_driver.get_cache_path(prefixed_path)
-                        retained.append(cached_item_path)
+                        retained.append(CachedObject(cached_item_path, cached_item))
                     else:
                         # in case the backup is differential, we want to rule out files, not copy them from cache
                         manifest_object = self._make_manifest_object(path_prefix, cached_item)
@@ -122,11 +189,79 @@ class NodeBackupCache(object):
         return retained, skipped
 
     def _make_manifest_object(self, path_prefix, cached_item):
-        return ManifestObject('{}{}'.format(path_prefix, cached_item['path']), cached_item['size'], cached_item['MD5'])
+        # The object keeps the key it is stored under, packed files the one of their archive
+        archive = cached_item.get('archive')
+        path = cached_item['path'] if archive is not None else object_key(cached_item)
+        return ManifestObject('{}{}'.format(path_prefix, path), cached_item['size'], cached_item['MD5'],
+                              cached_item.get('part_size'), cached_item.get('etag'), cached_item.get('codec'),
+                              cached_item.get('stored_size'),
+                              '{}{}'.format(path_prefix, object_key(cached_item)) if archive is not None else None,
+                              cached_item.get('offset'), cached_item.get('checksum'))
 
     def files_are_different(self, src, cached_item):
         return (src.stat().st_size != cached_item['size']
-                or (generate_md5_hash(src) != cached_item['MD5'] and self._storage_provider != Provider.LOCAL))
+                or (self._storage_provider != Provider.LOCAL
+                    and self.get_digest(src, medusa.storage.checksum.recorded_name(cached_item.get('checksum')))
+                    != cached_item['MD5']))
+
+    def hash_files(self, files):
+        """
+        Computes the digests of the files which need to be compared to the previous backup all at once, using
+        several threads, instead of hashing them one by one as they get compared.
+
+        :param files: (file, checksum name) pairs
+        """
+        if self._storage_provider == Provider.LOCAL:
+            return
+        missing = list()
+        for src, checksum in files:
+            digest = self._checksum_cache.get(src, checksum) if self._checksum_cache is not None else None
+            if digest is None:
+                if medusa.storage.checksum.is_available(checksum):
+                    missing.append((src, checksum))
+            else:
+                self._digests[(src, checksum)] = digest
+        digests = generate_checksums([src for src, _ in missing], [checksum for _, checksum in missing],
+                                     self._hash_block_size, self._hash_workers)
+        for (src, checksum), digest in zip(missing, digests):
+            self._digests[(src, checksum)] = digest
+            if self._checksum_cache is not None:
+                self._checksum_cache.put(src, digest, checksum)
+
+    def add_uploaded_files(self, srcs, manifest_objects):
+        """
+        Keeps the digests of files which got computed while uploading them, so the next backup does not read them
+        again. Files uploaded without being hashed have the hash the storage provider gave to their object instead.
+        """
+        if self._checksum_cache is None:
+            return
+        digests = {
+            pathlib.PurePath(manifest_object.path).name: (manifest_object.MD5, manifest_object.checksum)
+            for manifest_object in manifest_objects
+            if manifest_object.checksum is not None or is_base64_md5(manifest_object.MD5)
+        }
+        for src in srcs:
+            if isinstance(src, pathlib.Path) and src.name in digests:
+                self._checksum_cache.put(src, *digests[src.name])
+
+    def get_digest(self, src, checksum=None):
+        """
+        :param checksum: The name of the checksum to hash the file with, MD5 by default
+        :return: The digest of the file, or None if it was not cached and the checksum is not available here
+        """
+        if (src, checksum) in self._digests:
+            return self._digests.pop((src, checksum))
+        # SSTables are immutable, so the digest computed during a previous backup can be reused as is
+        digest = self._checksum_cache.get(src, checksum) if self._checksum_cache is not None else None
+        if digest is None:
+            if not medusa.storage.checksum.is_available(checksum):
+                # Like GCS composite objects recorded with their CRC32C, the file gets uploaded again
+                logging.debug('Cannot compute the {} checksum of {}, considering it changed'.format(checksum, src))
+                return None
+            digest = generate_checksum(src, checksum)
+            if self._checksum_cache is not None:
+                self._checksum_cache.put(src, digest, checksum)
+        return digest
 
 
 def throttle_backup():
@@ -149,8 +284,7 @@ def stagger(fqdn, storage, tokenmap):
     :return: True if this host has sufficiently been staggered, False otherwise.
     """
     # If we already have a backup for ourselves, bail early.
-    previous_backups = storage.list_node_backups(fqdn=fqdn)
-    if any(backup.finished for backup in previous_backups):
+    if has_finished_backup(storage, fqdn):
         return True
 
     ordered_tokenmap = sorted(tokenmap.items(), key=lambda item: item[1]['tokens'])
@@ -159,22 +293,38 @@ def stagger(fqdn, storage, tokenmap):
         return True
 
     previous_host = ordered_tokenmap[index - 1][0]
-    previous_host_backups = storage.list_node_backups(fqdn=previous_host)
-    has_backup = any(backup.finished for backup in previous_host_backups)
+    has_backup = has_finished_backup(storage, previous_host)
     if not has_backup:
         logging.info('Still waiting for {} to finish a backup.'.format(previous_host))
 
     return has_backup
 
 
-def main(config, backup_name_arg, stagger_time, mode):
+def has_finished_backup(storage, fqdn):
+    """
+    Checks whether a node finished a backup with a couple of reads of its markers in the index, without listing it
+    """
+    if get_backup_finished_from_index(storage, fqdn) is not None:
+        return True
+    # Backups which finished before the marker existed only left the one of the latest backup
+    return storage.storage_driver.get_blob('index/latest_backup/{}/backup_name.txt'.format(fqdn)) is not None
+
+
+def main(config, backup_name_arg, stagger_time, mode, resume=False, keyspaces=(), tables=(), snapshot_only=False,
+         keep_snapshot=False):
 
     start = datetime.datetime.now()
     backup_name = backup_name_arg or start.strftime('%Y%m%d%H')
     monitoring = Monitoring(config=config.monitoring)
 
     try:
+        if resume and not backup_name_arg:
+            raise IOError('Error: The name of the backup to resume is required')
+        scope = BackupScope(keyspaces, tables)
+
         storage = Storage(config=config.storage)
+        medusa.rate_limiter.configure(config.storage, 'backup')
+        medusa.page_cache.configure(config.storage)
         cassandra = Cassandra(config.cassandra)
 
         differential_mode = False
@@ -187,8 +337,18 @@ def main(config, backup_name_arg, stagger_time, mode):
             differential_mode=differential_mode
         )
 
+        resuming = False
         if node_backup.exists():
-            raise IOError('Error: Backup {} already exists'.format(backup_name))
+            if not resume:
+                raise IOError('Error: Backup {} already exists'.format(backup_name))
+            if node_backup.finished is not None:
+                raise IOError('Error: Backup {} is already complete'.format(backup_name))
+            logging.info('Resuming backup {}'.format(backup_name))
+            resuming = True
+            # The backup keeps the tables it started with
+            scope = node_backup.scope
+        if scope.is_partial:
+            logging.info('Backing up {}'.format(scope))
 
         # Make sure that priority remains to Cassandra/limiting backups resource usage
         try:
@@ -199,21 +359,38 @@ def main(config, backup_name_arg, stagger_time, mode):
         logging.info('Creating snapshot')
         logging.info('Saving tokenmap and schema')
 
-        schema, tokenmap = get_schema_and_tokenmap(cassandra)
-
-        node_backup.schema = schema
-        node_backup.tokenmap = json.dumps(tokenmap)
-        if differential_mode is True:
-            node_backup.differential = mode
-        add_backup_start_to_index(storage, node_backup)
-
-        if stagger_time:
+        if resuming:
+            # The backup keeps the schema and tokenmap it started with
+            tokenmap = json.loads(node_backup.tokenmap)
+        else:
+            schema, tokenmap = get_schema_and_tokenmap(cassandra)
+
+            node_backup.schema = schema
+            node_backup.tokenmap = json.dumps(tokenmap)
+            if differential_mode is True:
+                node_backup.differential = mode
+            node_backup.scope = scope
+            add_backup_start_to_index(storage, node_backup)
+
+        if snapshot_only:
+            # backup-cluster snapshots every node at once, then uploads the snapshots by resuming their backups
+            tag = snapshot_tag(node_backup)
+            if cassandra.snapshot_exists(tag):
+                cassandra.delete_snapshot(tag)
+            cassandra.create_snapshot(tag, scope)
+            logging.info('Took snapshot {}, resume backup {} to upload it'.format(tag, backup_name))
+            return
+
+        if stagger_time and not resuming:
             stagger_end = start + stagger_time
             logging.info('Staggering backup run, trying until {}'.format(stagger_end))
+            delay = STAGGER_MIN_DELAY_SECONDS
             while not stagger(config.storage.fqdn, storage, tokenmap):
-                if datetime.datetime.now() < stagger_end:
-                    logging.info('Staggering this backup run...')
-                    time.sleep(60)
+                remaining = (stagger_end - datetime.datetime.now()).total_seconds()
+                if remaining > 0:
+                    logging.info('Staggering this backup run, checking again in {} seconds'.format(delay))
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 2, STAGGER_MAX_DELAY_SECONDS)
                 else:
                     raise IOError('Backups on previous nodes did not complete'
                                   ' within our stagger time.'.format(backup_name))
@@ -221,7 +398,7 @@ def main(config, backup_name_arg, stagger_time, mode):
         actual_start = datetime.datetime.now()
 
         num_files, node_backup_cache = do_backup(
-            cassandra, node_backup, storage, differential_mode, config.storage.fqdn)
+            cassandra, node_backup, storage, differential_mode, config.storage.fqdn, resuming, scope, keep_snapshot)
 
         end = datetime.datetime.now()
         actual_backup_duration = end - actual_start
@@ -248,33 +425,105 @@ def get_schema_and_tokenmap(cassandra):
     return schema, tokenmap
 
 
-def do_backup(cassandra, node_backup, storage, differential_mode, fqdn):
+def do_backup(cassandra, node_backup, storage, differential_mode, fqdn, resume=False, scope=None,
+              keep_snapshot=False):
+    """
+    :param keep_snapshot: Whether to keep the snapshot when the backup fails, for resuming it to upload the same one.
+    Its hardlinks hold on to SSTables Cassandra compacts away in the meantime, so it is cleared otherwise.
+    """
+    scope = scope or BackupScope()
+
+    # Load the digests of the files hashed during previous backups
+    checksum_cache = load_checksum_cache(storage.config, cassandra.root)
 
     # Load last backup as a cache
     node_backup_cache = NodeBackupCache(
-        node_backup=storage.latest_node_backup(fqdn=fqdn),
+        node_backup=storage.latest_node_backup_covering(fqdn=fqdn, scope=scope),
         differential_mode=differential_mode,
         storage_driver=storage.storage_driver,
-        storage_provider=storage.storage_provider
+        storage_provider=storage.storage_provider,
+        checksum_cache=checksum_cache,
+        hash_workers=int(storage.config.hash_workers) if storage.config.hash_workers else None,
+        hash_block_size=int(storage.config.hash_block_size or BLOCK_SIZE_BYTES)
     )
 
+    # Files uploaded before an interruption are not uploaded again when resuming
+    journal = backup_journal(storage.config, cassandra.root, node_backup.name)
+    if resume:
+        journal.load()
+    else:
+        journal.reset()
+
+    shipped = None
+    if differential_mode:
+        shipped = continuous_journal(storage.config, cassandra.root)
+        shipped = shipped.load() if shipped.path.exists() else None
+
     logging.info('Starting backup')
 
-    # the cassandra snapshot we use defines __exit__ that cleans up the snapshot
-    # so even if exception is thrown, a new snapshot will be created on the next run
-    # this is not too good and we will use just one snapshot in the future
-    with cassandra.create_snapshot() as snapshot:
-        manifest = []
-        num_files = backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot)
+    # The snapshot is named after the backup, so resuming the backup can pick it up again. If it's gone, a new one
+    # gets taken and only the files of the journal which are still part of it make it to the manifest.
+    tag = snapshot_tag(node_backup)
+    rolling_snapshot_tables = int(storage.config.rolling_snapshot_tables or 0)
+    snapshot, snapshot_time = None, None
+    if resume and not rolling_snapshot_tables and cassandra.snapshot_exists(tag):
+        logging.info('Reusing snapshot {}'.format(tag))
+        snapshot = cassandra.get_snapshot(tag)
+    else:
+        if cassandra.snapshot_exists(tag):
+            cassandra.delete_snapshot(tag)
+        if not rolling_snapshot_tables:
+            snapshot_time = int(time.time())
+            snapshot = cassandra.create_snapshot(tag, scope)
+
+    # Sections of the manifest get written out as the tables complete, next to the journal
+    manifest = ManifestWriter(journal.path.with_name(journal.path.name + '.manifest'))
+    try:
+        if rolling_snapshot_tables:
+            num_files = backup_rolling_snapshots(cassandra, storage, manifest, node_backup, node_backup_cache, tag,
+                                                 scope, rolling_snapshot_tables, journal, shipped)
+        else:
+            num_files = backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot, journal,
+                                         shipped, snapshot_time)
+    except Exception:
+        manifest.remove()
+        if snapshot is not None and keep_snapshot:
+            logging.warning('Keeping snapshot {} and backup journal {}, run the backup again with --resume to pick '
+                            'it up where it stopped'.format(tag, journal.path))
+        else:
+            if snapshot is not None:
+                snapshot.delete()
+            logging.warning('Keeping backup journal {}, run the backup again with --resume to pick it up where it '
+                            'stopped'.format(journal.path))
+        raise
+    finally:
+        journal.close()
+    if snapshot is not None:
+        snapshot.delete()
+
+    if checksum_cache is not None:
+        logging.info('Checksum cache: {} hits, {} misses'.format(checksum_cache.hits, checksum_cache.misses))
+        checksum_cache.save()
 
     logging.info('Updating backup index')
-    node_backup.manifest = json.dumps(manifest)
-    add_backup_finish_to_index(storage, node_backup)
-    set_latest_backup_in_index(storage, node_backup)
+    summary = manifest.close()
+    node_backup.upload_manifest(manifest.path, summary)
+    index_blobs = backup_finish_index_blobs(node_backup, manifest.path)
+    # Restores, the next backups and the staggered backups of the next node rely on the latest backup holding every
+    # table
+    if not scope.is_partial:
+        index_blobs += latest_backup_index_blobs(node_backup) + backup_finished_index_blobs(node_backup)
+    upload_index_blobs(storage, index_blobs)
+    manifest.remove()
+    journal.remove()
 
     return num_files, node_backup_cache
 
 
+def snapshot_tag(node_backup):
+    return 'medusa-{}'.format(node_backup.name)
+
+
 def print_backup_stats(actual_backup_duration, actual_start, end, node_backup, node_backup_cache, num_files, start):
     logging.info('Backup done')
 
@@ -316,50 +565,173 @@ def update_monitoring(actual_backup_duration, backup_name, monitoring, node_back
     logging.debug('Done emitting metrics')
 
 
-def backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot):
+def backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot, journal=None, shipped=None,
+                     snapshot_time=None):
+    """
+    Uploads the files of a snapshot, and appends a section per table to the manifest
+
+    :param manifest: A list or a ManifestWriter
+    :param snapshot_time: When the snapshot was taken, recorded in its sections when known
+    :return: The number of files backed up
+    """
 
     num_files = 0
+    sections = collections.OrderedDict()
+    # The number of files of each table still uploading. A table gets its section appended to the manifest as soon
+    # as its last file is uploaded, once all the tables got listed: its files can come from several data directories.
+    outstanding = collections.Counter()
+    uploaded = collections.defaultdict(list)
+    listed = False
+
+    def append_section(dst_path):
+        snapshot_path, needs_backup, already_backed_up = sections.pop(dst_path)
+        manifest_objects = uploaded.pop(dst_path, [])
+        node_backup_cache.add_uploaded_files(needs_backup, manifest_objects)
 
-    for snapshot_path in snapshot.find_dirs():
+        # Reintroducing already backed up objects in the manifest in differential
+        manifest_objects.extend(already_backed_up)
 
-        (needs_backup, already_backed_up) = node_backup_cache.replace_or_remove_if_cached(
-            keyspace=snapshot_path.keyspace,
-            columnfamily=snapshot_path.columnfamily,
-            srcs=list(snapshot_path.path.glob('*')))
+        manifest.append(make_manifest_object(node_backup.fqdn, snapshot_path, manifest_objects, snapshot_time))
 
-        num_files += len(needs_backup) + len(already_backed_up)
+    def transfers():
+        nonlocal num_files, listed
+        for snapshot_path in snapshot.find_dirs():
 
-        dst_path = str(node_backup.datapath(keyspace=snapshot_path.keyspace, columnfamily=snapshot_path.columnfamily))
+            (needs_backup, already_backed_up) = node_backup_cache.replace_or_remove_if_cached(
+                keyspace=snapshot_path.keyspace,
+                columnfamily=snapshot_path.columnfamily,
+                srcs=list(snapshot_path.path.glob('*')))
 
-        manifest_objects = list()
-        if len(needs_backup) > 0:
-            manifest_objects = storage.storage_driver.upload_blobs(needs_backup, dst_path)
+            num_files += len(needs_backup) + len(already_backed_up)
 
-        # Reintroducing already backed up objects in the manifest in differential
-        for obj in already_backed_up:
-            manifest_objects.append(obj)
+            dst_path = str(node_backup.datapath(keyspace=snapshot_path.keyspace,
+                                                columnfamily=snapshot_path.columnfamily))
+            if dst_path in sections:
+                # The table has SSTables in several data directories, which all go to the same section
+                sections[dst_path][1].extend(needs_backup)
+                sections[dst_path][2].extend(already_backed_up)
+            else:
+                sections[dst_path] = (snapshot_path, list(needs_backup), list(already_backed_up))
+
+            srcs = list()
+            for src in needs_backup:
+                uploaded_object = journal.get(dst_path, *source_name_and_size(src)) if journal is not None else None
+                if uploaded_object is None and shipped is not None:
+                    # Files shipped by medusa continuous are in the differential data folder already
+                    uploaded_object = shipped.get(dst_path, *source_name_and_size(src))
+                if uploaded_object is not None:
+                    uploaded[dst_path].append(uploaded_object)
+                else:
+                    srcs.append(src)
+            # Packed files come back with a ManifestObject each
+            outstanding[dst_path] += len(srcs)
+            if storage.storage_driver.pack_max_file_size:
+                srcs = pack_small_files(srcs, storage.storage_driver.pack_max_file_size)
+
+            for src in srcs:
+                yield src, dst_path
+
+        listed = True
+        for dst_path in [dst_path for dst_path in sections if outstanding[dst_path] == 0]:
+            append_section(dst_path)
+
+    # Files from all the tables go through the same upload queue, so workers don't wait for a table to finish
+    # before starting on the next one. Sections of the manifest are written as the tables complete, so only the
+    # ManifestObjects of the tables still uploading are kept in memory.
+    for dst_path, manifest_object in storage.storage_driver.upload_files(transfers()):
+        uploaded[dst_path].append(manifest_object)
+        if journal is not None:
+            journal.add(dst_path, manifest_object)
+        outstanding[dst_path] -= 1
+        if listed and outstanding[dst_path] == 0:
+            append_section(dst_path)
+
+    for dst_path in list(sections):
+        append_section(dst_path)
+
+    return num_files
+
+
+def backup_rolling_snapshots(cassandra, storage, manifest, node_backup, node_backup_cache, tag, scope, batch_size,
+                             journal=None, shipped=None):
+    """
+    Snapshots the tables a batch at a time, and clears the snapshot of a batch once it is uploaded, before taking the
+    next one. SSTables compacted away during the backup stay hardlinked only while their batch uploads.
 
-        manifest.append(make_manifest_object(node_backup.fqdn, snapshot_path, manifest_objects))
+    :param batch_size: The number of tables snapshotted at once
+    :return: The number of files backed up
+    """
+    with cassandra.new_session() as cql_session:
+        tables = [table for table in cql_session.tables() if scope.covers(*table.split('.'))]
 
+    num_files = 0
+    for i in range(0, len(tables), batch_size):
+        batch = tables[i:i + batch_size]
+        snapshot_time = int(time.time())
+        with cassandra.create_snapshot(tag, BackupScope(tables=batch)) as snapshot:
+            num_files += backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot, journal,
+                                          shipped, snapshot_time)
+        logging.info('Backed up {} of {} tables'.format(i + len(batch), len(tables)))
     return num_files
 
 
-def make_manifest_object(fqdn, snapshot_path, manifest_objects):
-    return {
+def source_name_and_size(src):
+    if isinstance(src, CachedObject):
+        return pathlib.PurePath(src.path).name, src.manifest_item['size']
+    return src.name, src.stat().st_size
+
+
+def make_manifest_object(fqdn, snapshot_path, manifest_objects, snapshot_time=None):
+    section = {
         'keyspace': snapshot_path.keyspace,
         'columnfamily': snapshot_path.columnfamily,
-        'objects': [{
-            'path': url_to_path(manifest_object.path, fqdn),
-            'MD5': manifest_object.MD5,
-            'size': manifest_object.size,
-        } for manifest_object in manifest_objects]
+        'objects': [make_manifest_item(manifest_object, fqdn) for manifest_object in manifest_objects]
+    }
+    # Tables of a rolling backup get snapshotted one batch after the other. Snapshots picked up by a resumed backup
+    # have no known time.
+    if snapshot_time is not None:
+        section['snapshot_time'] = snapshot_time
+    return section
+
+
+def make_manifest_item(manifest_object, fqdn):
+    item = {
+        'path': url_to_path(manifest_object.path, fqdn),
+        'MD5': manifest_object.MD5,
+        'size': manifest_object.size,
     }
+    # Objects uploaded in several parts or compressed also keep what is needed to check the stored object, and files
+    # hashed with another checksum than MD5 the name of that checksum
+    for key in ['part_size', 'etag', 'codec', 'stored_size', 'offset', 'checksum']:
+        value = getattr(manifest_object, key)
+        if value is not None:
+            item[key] = value
+    if manifest_object.archive is not None:
+        item['archive'] = url_to_path(manifest_object.archive, fqdn)
+    # The manifest keeps the path of the files, objects of the hashed key layout also need the shard they are under
+    shard = url_to_shard(manifest_object.archive or manifest_object.path, fqdn)
+    if shard is not None:
+        item['shard'] = shard
+    return item
 
 
 def url_to_path(url, fqdn):
     # the path with store in the manifest starts with the fqdn, but we can get longer urls
-    # depending on the storage provider and type of backup
+    # depending on the storage provider, type of backup and key layout
     # Full backup path is : <fqdn>/<backup_name>/data/<keyspace>/<table>/...
     # Differential backup path is : <fqdn>/data/<keyspace>/<table>/...
+    # Objects of the hashed key layout are under a shard : <shard>/<fqdn>/...
     url_parts = url.split('/')
     return '/'.join(url_parts[url_parts.index(fqdn):])
+
+
+def url_to_shard(url, fqdn):
+    """
+    :return: The shard the object of the url is stored under in the hashed key layout, None in the flat one
+    """
+    url_parts = url.split('/')
+    index = url_parts.index(fqdn)
+    # The shard derives from the path, which tells it apart from the bucket of URLs of flat objects
+    if index > 0 and url_parts[index - 1] == key_shard('/'.join(url_parts[index:])):
+        return url_parts[index - 1]
+    return None
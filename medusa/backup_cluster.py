@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import datetime
+import logging
+import sys
+import time
+import traceback
+
+from medusa.cassandra_utils import CqlSessionProvider
+from medusa.monitoring import Monitoring
+from medusa.orchestration import POLL_INTERVAL_SECONDS, RemoteJob
+from medusa.restore_cluster import expand_repeatable_option
+from medusa.storage import Storage, format_bytes_str
+
+
+def orchestrate(config, backup_name, seed_target, mode, temp_dir, max_per_rack=0, max_per_dc=0, keyspaces=(),
+                tables=()):
+    monitoring = Monitoring(config=config.monitoring)
+    backup_name = backup_name or datetime.datetime.now().strftime('%Y%m%d%H')
+    try:
+        backup_start_time = datetime.datetime.now()
+        if not temp_dir.is_dir():
+            err_msg = '{} is not a directory'.format(temp_dir)
+            logging.error(err_msg)
+            raise Exception(err_msg)
+
+        session_provider = CqlSessionProvider([seed_target],
+                                              username=config.cassandra.cql_username,
+                                              password=config.cassandra.cql_password)
+        with session_provider.new_session() as session:
+            placement = session.placement()
+
+        backup = BackupJob(config, backup_name, mode, temp_dir, placement, max_per_rack, max_per_dc, keyspaces,
+                           tables)
+        backup.execute()
+
+        backup_duration = datetime.datetime.now() - backup_start_time
+        cluster_backup = Storage(config=config.storage).get_cluster_backup(backup_name)
+        size = cluster_backup.size()
+        logging.info('Backed up {} nodes, {} in {} ({}/s)'.format(
+            len(placement), format_bytes_str(size), backup_duration,
+            format_bytes_str(int(size / max(1, backup_duration.total_seconds())))))
+
+        logging.debug('Emitting metrics')
+        tags = ['medusa-cluster-backup', 'backup-duration', backup_name]
+        monitoring.send(tags, backup_duration.seconds)
+
+        tags = ['medusa-cluster-backup', 'backup-size', backup_name]
+        monitoring.send(tags, size)
+
+        tags = ['medusa-cluster-backup', 'backup-error', backup_name]
+        monitoring.send(tags, 0)
+        logging.debug('Done emitting metrics')
+        logging.info('Successfully backed up the cluster')
+
+    except Exception as e:
+        tags = ['medusa-cluster-backup', 'backup-error', backup_name]
+        monitoring.send(tags, 1)
+
+        logging.error('This error happened during the cluster backup: {}'.format(str(e)))
+        traceback.print_exc()
+        sys.exit(1)
+
+
+def hosts_to_start(pending, running, placement, max_per_rack=0, max_per_dc=0):
+    """
+    Picks the nodes which can start uploading their backup without going over the number of nodes allowed to upload
+    at once in a rack or in a datacenter. Racks take turns, so the nodes starting first are spread over all of them.
+
+    :param pending: The nodes waiting to upload, in the order to start them
+    :param running: The nodes uploading
+    :param placement: The datacenter and rack of each node
+    :param max_per_rack: How many nodes of a rack can upload at once, 0 for no limit
+    :param max_per_dc: How many nodes of a datacenter can upload at once, 0 for no limit
+    :return: The list of the nodes to start
+    """
+    def rack(host):
+        return placement[host]['datacenter'], placement[host]['rack']
+
+    per_rack = collections.Counter(rack(host) for host in running)
+    per_dc = collections.Counter(placement[host]['datacenter'] for host in running)
+    started = []
+    for host in pending:
+        if max_per_rack and per_rack[rack(host)] >= max_per_rack:
+            continue
+        if max_per_dc and per_dc[placement[host]['datacenter']] >= max_per_dc:
+            continue
+        per_rack[rack(host)] += 1
+        per_dc[placement[host]['datacenter']] += 1
+        started.append(host)
+    return started
+
+
+def interleave_racks(placement):
+    """
+    Orders the nodes so that consecutive ones are in different racks
+    """
+    racks = collections.OrderedDict()
+    for host in sorted(placement):
+        racks.setdefault((placement[host]['datacenter'], placement[host]['rack']), []).append(host)
+    ordered = []
+    while any(racks.values()):
+        for hosts in racks.values():
+            if hosts:
+                ordered.append(hosts.pop(0))
+    return ordered
+
+
+class BackupJob(RemoteJob):
+    """
+    Backs up all the nodes of a cluster. Every node takes its snapshot at about the same time, then they upload it a
+    few at a time in each rack and datacenter, instead of all at once or one after the other along the ring.
+    """
+
+    def __init__(self, config, backup_name, mode, temp_dir, placement, max_per_rack=0, max_per_dc=0, keyspaces=(),
+                 tables=()):
+        super(BackupJob, self).__init__(config, temp_dir)
+        self.backup_name = backup_name
+        self.mode = mode
+        self.placement = placement
+        self.max_per_rack = max_per_rack
+        self.max_per_dc = max_per_dc
+        self.keyspaces = keyspaces
+        self.tables = tables
+
+    def execute(self):
+        down = [host for host, node in self.placement.items() if not node.get('is_up')]
+        if down:
+            raise Exception('Nodes {} are not up!'.format(', '.join(sorted(down))))
+        if int(self.config.storage.rolling_snapshot_tables or 0):
+            # Rolling backups snapshot their tables as they upload them, not when the snapshots of the nodes are taken
+            raise Exception('rolling_snapshot_tables is not supported by backup-cluster, which snapshots all the nodes '
+                            'at once before uploading their backups')
+
+        try:
+            logging.info('Working directory for this execution: {}'.format(self.work_dir))
+            logging.info('Taking snapshot {} on all the nodes: {}'.format(self.backup_name,
+                                                                          ', '.join(self.placement)))
+            remotes = [self._trigger_backup(host, snapshot_only=True) for host in self.placement]
+            finished, broken = self._wait_for(remotes)
+            if len(broken) > 0:
+                err_msg = 'Some nodes failed to take their snapshot. Exiting'
+                logging.error(err_msg)
+                raise Exception(err_msg)
+
+            broken = self._upload_snapshots()
+        finally:
+            if self._ssh_agent_started is True:
+                self.ssh_cleanup()
+        if len(broken) > 0:
+            err_msg = 'Some nodes failed to upload their backup: {}'.format(', '.join(broken))
+            logging.error(err_msg)
+            raise Exception(err_msg)
+
+    def _upload_snapshots(self):
+        pending = interleave_racks(self.placement)
+        running = {}
+        broken = []
+        while pending or running:
+            for host in hosts_to_start(pending, running, self.placement, self.max_per_rack, self.max_per_dc):
+                logging.info('Uploading the backup of {} ({}/{})'.format(
+                    host, self.placement[host]['datacenter'], self.placement[host]['rack']))
+                running[host] = self._trigger_backup(host, snapshot_only=False)
+                pending.remove(host)
+
+            time.sleep(POLL_INTERVAL_SECONDS)
+            for host, remote in list(running.items()):
+                remote, succeeded = self._poll(remote)
+                if succeeded is None:
+                    running[host] = remote
+                    continue
+                del running[host]
+                if not succeeded:
+                    broken.append(host)
+            logging.debug('{} nodes uploading, {} waiting'.format(len(running), len(pending)))
+        return broken
+
+    def _trigger_backup(self, target, snapshot_only):
+        # The snapshot is uploaded by resuming the backup which took it. medusa-wrapper leaves the status of a command
+        # in the directory it ran in, and hands it out to the next command run there: each step needs its own.
+        step_option = '--snapshot-only' if snapshot_only else '--resume'
+        step_dir = self.work_dir / ('snapshot' if snapshot_only else 'upload')
+        client, connect_args = self._connect(target, step_dir)
+        command = 'nohup sh -c "cd {work} && medusa-wrapper sudo medusa -vvv backup --backup-name {backup} ' \
+                  '--mode {mode} {step} {keyspaces} {tables}"' \
+            .format(work=step_dir,
+                    backup=self.backup_name,
+                    mode=self.mode,
+                    step=step_option,
+                    keyspaces=expand_repeatable_option('keyspace', self.keyspaces),
+                    tables=expand_repeatable_option('table', self.tables))
+
+        logging.debug('Backing up node {} with the following command {}'.format(target, command))
+        return self._run(target, client, connect_args, command, step_dir)
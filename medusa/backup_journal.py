@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import pathlib
+import threading
+
+from medusa.storage import ManifestObject
+
+
+BACKUP_JOURNAL_FILE_NAME = 'medusa_backup_journal_{}.jsonl'
+CONTINUOUS_JOURNAL_FILE_NAME = 'medusa_continuous_journal.jsonl'
+
+
+class BackupJournal(object):
+    """
+    Local journal of the files a node backup finished uploading, so a backup which got interrupted can be resumed
+    without uploading them again. Each line holds the location a file got uploaded to and its ManifestObject.
+    """
+
+    def __init__(self, path):
+        self._path = pathlib.Path(path)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        if not self._path.exists():
+            logging.info('No backup journal found at {}, nothing to resume'.format(self._path))
+            return self
+        with open(str(self._path), 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line might have been cut short by whatever stopped the backup
+                    logging.debug('Ignoring truncated backup journal entry {}'.format(line))
+                    continue
+                manifest_object = ManifestObject(*entry['object'])
+                self._entries[(entry['dest'], pathlib.PurePath(manifest_object.path).name)] = manifest_object
+        logging.info('Loaded {} uploaded files from backup journal {}'.format(len(self._entries), self._path))
+        return self
+
+    def get(self, dest, name, size):
+        """
+        Returns the ManifestObject of a file uploaded to dest before the backup got interrupted, or None if the file
+        still has to be uploaded. SSTables are immutable, so a file with the same name and size is the same file.
+        """
+        manifest_object = self._entries.get((str(dest), name))
+        if manifest_object is None or manifest_object.size != size:
+            return None
+        return manifest_object
+
+    def items(self):
+        """
+        Returns the (location, ManifestObject) pairs of the files in the journal
+        """
+        return [(dest, manifest_object) for (dest, _), manifest_object in self._entries.items()]
+
+    def add(self, dest, manifest_object):
+        with self._lock:
+            if self._file is None:
+                self._file = open(str(self._path), 'a+')
+                # Entries written after a truncated one start on a line of their own
+                if self._file.tell() > 0:
+                    self._file.seek(self._file.tell() - 1)
+                    if self._file.read(1) != '\n':
+                        self._file.write('\n')
+            self._file.write(json.dumps({'dest': str(dest), 'object': list(manifest_object)}) + '\n')
+            self._file.flush()
+        self._entries[(str(dest), pathlib.PurePath(manifest_object.path).name)] = manifest_object
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def compact(self, keep):
+        """
+        Rewrites the journal with the entries for which keep(location, ManifestObject) is true. The new journal
+        replaces the old one at once, so processes reading it never see it half written.
+        """
+        self.close()
+        with self._lock:
+            self._entries = {key: manifest_object for key, manifest_object in self._entries.items()
+                             if keep(key[0], manifest_object)}
+            tmp_path = self._path.with_name('{}.compacting'.format(self._path.name))
+            with open(str(tmp_path), 'w') as f:
+                for (dest, _), manifest_object in self._entries.items():
+                    f.write(json.dumps({'dest': dest, 'object': list(manifest_object)}) + '\n')
+            os.replace(str(tmp_path), str(self._path))
+        return self
+
+    def reset(self):
+        self.close()
+        self._entries = {}
+        if self._path.exists():
+            os.remove(str(self._path))
+        return self
+
+    def remove(self):
+        self.reset()
+
+
+def backup_journal(storage_config, data_directory, backup_name):
+    """
+    Returns the journal of a backup. Unless configured otherwise, journals live next to the Cassandra data directory.
+    """
+    directory = storage_config.backup_journal_dir or pathlib.Path(data_directory).parent
+    return BackupJournal(pathlib.Path(directory) / BACKUP_JOURNAL_FILE_NAME.format(backup_name))
+
+
+def pending_backup_journals(storage_config, data_directory):
+    """
+    Returns the journals of the backups which got interrupted, the ones of backups which completed being removed
+    """
+    directory = pathlib.Path(storage_config.backup_journal_dir or pathlib.Path(data_directory).parent)
+    return [BackupJournal(path) for path in sorted(directory.glob(BACKUP_JOURNAL_FILE_NAME.format('*')))]
+
+
+def continuous_journal(storage_config, data_directory):
+    """
+    Returns the journal of the files shipped by medusa continuous, which live in the differential data folder of the
+    node until a backup references them.
+    """
+    directory = storage_config.backup_journal_dir or pathlib.Path(data_directory).parent
+    return BackupJournal(pathlib.Path(directory) / CONTINUOUS_JOURNAL_FILE_NAME)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+
+class BackupScope(object):
+    """
+    The keyspaces and tables a backup is restricted to. A backup with no keyspace nor table in its scope holds every
+    table of the node. Tables are given as keyspace.table, without the id Cassandra appends to their directories.
+    """
+
+    def __init__(self, keyspaces=(), tables=()):
+        for table in tables:
+            if len(table.split('.')) != 2:
+                raise ValueError('Tables must be given as keyspace.table, got {}'.format(table))
+        self._keyspaces = frozenset(keyspaces)
+        # Tables of keyspaces which are backed up entirely are in the scope already
+        self._tables = frozenset(table for table in tables if table.split('.')[0] not in self._keyspaces)
+
+    @property
+    def keyspaces(self):
+        return sorted(self._keyspaces)
+
+    @property
+    def tables(self):
+        return sorted(self._tables)
+
+    @property
+    def is_partial(self):
+        return bool(self._keyspaces or self._tables)
+
+    def covers(self, keyspace, columnfamily):
+        """
+        Tells whether a table is part of the scope. The column family can come with its id, as in the manifests.
+        """
+        if not self.is_partial or keyspace in self._keyspaces:
+            return True
+        return '{}.{}'.format(keyspace, columnfamily.split('-')[0]) in self._tables
+
+    def covers_scope(self, other):
+        """
+        Tells whether every table of the other scope is part of this one
+        """
+        if not self.is_partial:
+            return True
+        if not other.is_partial:
+            return False
+        return other._keyspaces <= self._keyspaces \
+            and all(self.covers(*table.split('.')) for table in other._tables)
+
+    def to_json(self):
+        return json.dumps({'keyspaces': self.keyspaces, 'tables': self.tables})
+
+    @staticmethod
+    def from_json(scope_json):
+        scope = json.loads(scope_json)
+        return BackupScope(scope.get('keyspaces', []), scope.get('tables', []))
+
+    def __eq__(self, other):
+        return isinstance(other, BackupScope) and (self._keyspaces, self._tables) == (other._keyspaces, other._tables)
+
+    def __hash__(self):
+        return hash((self._keyspaces, self._tables))
+
+    def __str__(self):
+        if not self.is_partial:
+            return 'all tables'
+        return ', '.join(self.keyspaces + self.tables)
+
+    def __repr__(self):
+        return 'BackupScope(keyspaces={}, tables={})'.format(self.keyspaces, self.tables)
@@ -156,12 +156,35 @@ class CqlSession(object):
             if host.datacenter == datacenter
         }
 
+    def placement(self):
+        """
+        The datacenter and rack of every node of the cluster
+        """
+        return {
+            socket.gethostbyaddr(host.address)[0]: {
+                'datacenter': host.datacenter,
+                'rack': host.rack,
+                'is_up': host.is_up
+            }
+            for host in self.cluster.metadata.all_hosts()
+        }
+
     def dump_schema(self):
         keyspaces = self.session.cluster.metadata.keyspaces
         return '\n\n'.join(metadata.export_as_string()
                            for keyspace, metadata in keyspaces.items()
                            if keyspace not in self.EXCLUDED_KEYSPACES)
 
+    def tables(self):
+        """
+        The tables of the node, as keyspace.table, materialized views included as they have SSTables of their own
+        """
+        keyspaces = self.session.cluster.metadata.keyspaces
+        return ['{}.{}'.format(keyspace, table)
+                for keyspace, metadata in keyspaces.items()
+                if keyspace not in self.EXCLUDED_KEYSPACES
+                for table in list(metadata.tables) + list(metadata.views)]
+
     def schema_path_mapping(self):
         query = 'SELECT keyspace_name, columnfamily_name, cf_id FROM system.schema_columnfamilies'
 
@@ -184,12 +207,14 @@ class CassandraConfigReader(object):
 
     @property
     def root(self):
+        return self.data_file_directories[0]
+
+    @property
+    def data_file_directories(self):
         data_file_directories = self._config.get('data_file_directories')
         if not data_file_directories:
             raise RuntimeError('data_file_directories must be properly configured')
-        if len(data_file_directories) > 1:
-            raise RuntimeError('Medusa only supports one data directory')
-        return pathlib.Path(data_file_directories[0])
+        return [pathlib.Path(data_file_directory) for data_file_directory in data_file_directories]
 
     @property
     def commitlog_directory(self):
@@ -228,7 +253,8 @@ class Cassandra(object):
         logging.warning('is ccm : {}'.format(self._is_ccm))
 
         config_reader = CassandraConfigReader(cassandra_config.config_file)
-        self._root = config_reader.root
+        self._roots = config_reader.data_file_directories
+        self._root = self._roots[0]
         self._commitlog_path = config_reader.commitlog_directory
         self._saved_caches_path = config_reader.saved_caches_directory
         self._hostname = contact_point if contact_point is not None else config_reader.listen_address
@@ -256,6 +282,13 @@ class Cassandra(object):
     def root(self):
         return self._root
 
+    @property
+    def roots(self):
+        """
+        Every data directory of the node, a table having SSTables in any of them
+        """
+        return self._roots
+
     @property
     def commit_logs_path(self):
         return self._commitlog_path
@@ -288,13 +321,18 @@ class Cassandra(object):
         def root(self):
             return self._parent.root
 
+        @property
+        def roots(self):
+            return self._parent.roots
+
         def find_dirs(self):
             return [
                 SnapshotPath(
                     pathlib.Path(snapshot_dir),
-                    *snapshot_dir.relative_to(self.root).parts[:2]
+                    *snapshot_dir.relative_to(root).parts[:2]
                 )
-                for snapshot_dir in self.root.glob(
+                for root in self.roots
+                for snapshot_dir in root.glob(
                     Cassandra.SNAPSHOT_PATTERN.format(self._tag)
                 )
                 if (snapshot_dir.is_dir() and snapshot_dir.parts[-4]
@@ -307,15 +345,27 @@ class Cassandra(object):
         def __repr__(self):
             return '{}<{}>'.format(self.__class__.__qualname__, self._tag)
 
-    def create_snapshot(self):
-        tag = 'medusa-{}'.format(uuid.uuid4())
-        cmd = ['nodetool', 'snapshot', '-t', tag]
-
-        if self._is_ccm == 1:
-            os.popen('ccm node1 nodetool \"snapshot -t {}\"'.format(tag)).read()
-        else:
-            logging.debug('Executing: {}'.format(' '.join(cmd)))
-            subprocess.check_call(cmd, stdout=subprocess.DEVNULL, universal_newlines=True)
+    def create_snapshot(self, tag=None, scope=None):
+        """
+        Snapshots every table of the node, or only the ones of a partial BackupScope
+        """
+        if tag is None:
+            tag = 'medusa-{}'.format(uuid.uuid4())
+
+        # nodetool snapshots either whole keyspaces or a list of tables, so a scope with both takes two calls
+        targets = []
+        if scope is not None and scope.keyspaces:
+            targets.append(scope.keyspaces)
+        if scope is not None and scope.tables:
+            targets.append(['-kt', ','.join(scope.tables)])
+
+        for target in targets or [[]]:
+            cmd = ['nodetool', 'snapshot', '-t', tag] + target
+            if self._is_ccm == 1:
+                os.popen('ccm node1 nodetool \"{}\"'.format(' '.join(cmd[1:]))).read()
+            else:
+                logging.debug('Executing: {}'.format(' '.join(cmd)))
+                subprocess.check_call(cmd, stdout=subprocess.DEVNULL, universal_newlines=True)
 
         return Cassandra.Snapshot(self, tag)
 
@@ -331,21 +381,19 @@ class Cassandra(object):
     def list_snapshotnames(self):
         return {
             snapshot.name
-            for snapshot in self.root.glob(self.SNAPSHOT_PATTERN.format('*'))
+            for root in self.roots
+            for snapshot in root.glob(self.SNAPSHOT_PATTERN.format('*'))
             if snapshot.is_dir()
         }
 
     def get_snapshot(self, tag):
-        if any(self.root.glob(self.SNAPSHOT_PATTERN.format(tag))):
+        if any(any(root.glob(self.SNAPSHOT_PATTERN.format(tag))) for root in self.roots):
             return Cassandra.Snapshot(self, tag)
 
         raise KeyError('Snapshot {} does not exist'.format(tag))
 
     def snapshot_exists(self, tag):
-        for snapshot in self.root.glob(self.SNAPSHOT_PATTERN.format('*')):
-            if snapshot.is_dir() and snapshot.name == tag:
-                return True
-        return False
+        return tag in self.list_snapshotnames()
 
     def _columnfamily_path(self, keyspace_name, columnfamily_name, cf_id):
         root = pathlib.Path(self._root)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import logging
+import os
+import pathlib
+
+
+CHECKSUM_CACHE_FILE_NAME = 'medusa_checksum_cache.json'
+DEFAULT_MAX_ENTRIES = 500000
+
+
+class ChecksumCache(object):
+    """
+    Persistent cache of the digests computed for SSTable files on this node.
+
+    SSTables are immutable, so once a file has been hashed its digest stays valid for as long as the file keeps the
+    same inode, size and modification time. A file has a digest computed with a single checksum, the one it is
+    compared with at the next backup. Snapshot files are hardlinks to the live SSTables, so entries are keyed
+    by the live path of the file (without the snapshots/<tag> part) which stays stable from one backup to the next.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self._path = pathlib.Path(path)
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._seen = set()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def live_path(src):
+        # <table>/snapshots/<tag>/<file> is a hardlink to <table>/<file>
+        src = pathlib.Path(src)
+        if src.parent.parent.name == 'snapshots':
+            return src.parent.parent.parent / src.name
+        return src
+
+    @staticmethod
+    def _fingerprint(stat):
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def get(self, src, checksum=None):
+        """
+        Returns the cached digest of src, or None if the file was never hashed with that checksum or has changed since.
+
+        :param checksum: The name of the checksum of the digest, None for MD5
+        """
+        key = str(self.live_path(src))
+        self._seen.add(key)
+        entry = self._entries.get(key)
+        if entry is not None and self._checksum(entry) != checksum:
+            self._misses += 1
+            return None
+        if entry is not None:
+            if entry[:3] == self._fingerprint(os.stat(str(src))):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[3]
+            logging.debug('Checksum cache entry for {} is stale, invalidating it'.format(key))
+            del self._entries[key]
+        self._misses += 1
+        return None
+
+    def put(self, src, digest, checksum=None):
+        key = str(self.live_path(src))
+        self._seen.add(key)
+        # Entries of MD5 digests keep the format of the previous versions
+        self._entries[key] = self._fingerprint(os.stat(str(src))) + [digest] + ([checksum] if checksum else [])
+        self._entries.move_to_end(key)
+
+    @staticmethod
+    def _checksum(entry):
+        return entry[4] if len(entry) > 4 else None
+
+    def load(self):
+        if not self._path.exists():
+            logging.debug('No checksum cache found at {}'.format(self._path))
+            return self
+        try:
+            with open(str(self._path), 'r') as f:
+                self._entries = collections.OrderedDict(json.load(f))
+            logging.debug('Loaded {} entries from checksum cache {}'.format(len(self._entries), self._path))
+        except (OSError, ValueError) as e:
+            logging.warning('Ignoring unreadable checksum cache {}: {}'.format(self._path, e))
+            self._entries = collections.OrderedDict()
+        return self
+
+    def evict(self):
+        """
+        Drops the entries of SSTables which have been deleted since they were hashed, then the least recently used
+        entries until the cache fits in its maximum size.
+        """
+        for key in [key for key in self._entries if key not in self._seen and not os.path.exists(key)]:
+            del self._entries[key]
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self):
+        self.evict()
+        tmp_path = self._path.with_name('{}.tmp'.format(self._path.name))
+        try:
+            with open(str(tmp_path), 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(str(tmp_path), str(self._path))
+            logging.debug('Saved {} entries to checksum cache {}'.format(len(self._entries), self._path))
+        except OSError as e:
+            logging.warning('Could not save checksum cache {}: {}'.format(self._path, e))
+
+
+def load_checksum_cache(storage_config, data_directory):
+    """
+    Loads the checksum cache configured in the storage section. Unless configured otherwise, the cache lives next to
+    the Cassandra data directory. Setting checksum_cache_max_entries to 0 disables the cache.
+    """
+    max_entries = int(storage_config.checksum_cache_max_entries or DEFAULT_MAX_ENTRIES)
+    if max_entries == 0:
+        return None
+    path = storage_config.checksum_cache_file or pathlib.Path(data_directory).parent / CHECKSUM_CACHE_FILE_NAME
+    return ChecksumCache(path, max_entries).load()
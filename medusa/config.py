@@ -26,7 +26,14 @@ import medusa.cassandra_utils
 StorageConfig = collections.namedtuple(
     'StorageConfig',
     ['bucket_name', 'key_file', 'prefix', 'fqdn', 'host_file_separator', 'storage_provider', 'api_key_or_username',
-     'api_secret_or_password', 'base_path', 'max_backup_age', 'max_backup_count', 'api_profile']
+     'api_secret_or_password', 'base_path', 'max_backup_age', 'max_backup_count', 'api_profile',
+     'checksum_cache_file', 'checksum_cache_max_entries', 'hash_workers', 'hash_block_size', 'single_pass_upload',
+     'multipart_threshold', 'multipart_part_size', 'multipart_max_workers', 'backup_max_bandwidth',
+     'backup_max_requests', 'restore_max_bandwidth', 'restore_max_requests', 'purge_max_requests',
+     'rate_limit_control_file', 'connection_pool_size', 'connection_max_idle_seconds',
+     'compression_codec', 'backup_journal_dir', 'snapshot_read_mode',
+     'transfer_processes', 'pack_max_file_size', 'rolling_snapshot_tables',
+     'key_layout', 'checksum_algorithm']
 )
 
 CassandraConfig = collections.namedtuple(
@@ -67,7 +74,13 @@ def load_config(args, config_file):
         'host_file_separator': ',',
         'max_backup_age': 0,
         'max_backup_count': 0,
-        'api_profile': 'default'
+        'api_profile': 'default',
+        'checksum_cache_max_entries': 500000,
+        'hash_block_size': 1048576,
+        'single_pass_upload': 'False',
+        'multipart_threshold': 0,
+        'multipart_part_size': 33554432,
+        'multipart_max_workers': 4
     }
 
     config['cassandra'] = {
@@ -144,6 +157,13 @@ def load_config(args, config_file):
             logging.error('Required configuration "{}" is missing in [storage] section.'.format(field))
             sys.exit(2)
 
+    for field in ['hash_block_size']:
+        value = getattr(medusa_config.storage, field)
+        if value is not None and (not str(value).isdigit() or int(value) <= 0):
+            logging.error('Configuration "{}" of the [storage] section must be a positive number of bytes, got {}.'
+                          .format(field, value))
+            sys.exit(2)
+
     for field in ['start_cmd', 'stop_cmd']:
         if getattr(medusa_config.cassandra, field) is None:
             logging.error('Required configuration "{}" is missing in [cassandra] section.'.format(field))
@@ -157,6 +177,11 @@ def load_config(args, config_file):
     return medusa_config
 
 
+def evaluate_boolean(value):
+    # Same semantics as configparser's getboolean, with unset values being False
+    return str(value).lower() in ('1', 'yes', 'true', 'on')
+
+
 def _zip_fields_with_arg_values(fields, args):
     return [(field, args[field]) for field in fields]
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import pathlib
+import sys
+import time
+import traceback
+
+import medusa.page_cache
+import medusa.rate_limiter
+
+from medusa.backup_journal import continuous_journal
+from medusa.cassandra_utils import Cassandra, CqlSession
+from medusa.monitoring import Monitoring
+from medusa.storage import Storage
+
+
+INCREMENTAL_BACKUPS_PATTERN = '*/*/backups'
+DEFAULT_INTERVAL_SECONDS = 10
+JOURNAL_COMPACTION_INTERVAL_SECONDS = 3600
+# Shipped files go to the differential data folder of the node, which does not depend on the name of a backup
+CONTINUOUS_BACKUP_NAME = 'continuous'
+
+
+def main(config, interval=DEFAULT_INTERVAL_SECONDS):
+    """
+    Uploads the SSTables Cassandra hardlinks in the backups folder of each table when incremental_backups is enabled,
+    as soon as they get flushed or streamed. The next differential backups reference them instead of uploading them.
+    """
+    monitoring = Monitoring(config=config.monitoring)
+    try:
+        storage = Storage(config=config.storage)
+        medusa.rate_limiter.configure(config.storage, 'backup')
+        medusa.page_cache.configure(config.storage)
+        cassandra = Cassandra(config.cassandra)
+        node_backup = storage.get_node_backup(fqdn=config.storage.fqdn, name=CONTINUOUS_BACKUP_NAME,
+                                              differential_mode=True)
+        journal = continuous_journal(config.storage, cassandra.root).load()
+
+        logging.info('Shipping incremental backups of {} every {} seconds'.format(
+            ', '.join(str(root) for root in cassandra.roots), interval))
+        compacted = None
+        while True:
+            if compacted is None or time.monotonic() - compacted >= JOURNAL_COMPACTION_INTERVAL_SECONDS:
+                compact_journal(journal, cassandra.roots)
+                compacted = time.monotonic()
+            ship_incremental_backups(storage, node_backup, cassandra.roots, journal)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logging.info('Stopped shipping incremental backups')
+    except Exception as e:
+        traceback.print_exc()
+        tags = ['medusa-node-backup', 'continuous-error', 'CONTINUOUS-ERROR']
+        monitoring.send(tags, 1)
+        logging.error('This error happened while shipping incremental backups: {}'.format(str(e)))
+        sys.exit(1)
+
+
+def ship_incremental_backups(storage, node_backup, roots, journal):
+    """
+    Uploads the files found in the backups folders of the tables, and removes their hardlinks once they are stored
+    and journaled.
+
+    :param roots: The data directories of the node
+    :return: the number of files shipped
+    """
+    srcs = dict()
+    for root, backups_dir in ((root, backups_dir) for root in roots
+                              for backups_dir in root.glob(INCREMENTAL_BACKUPS_PATTERN)):
+        keyspace, columnfamily = backups_dir.relative_to(root).parts[:2]
+        if not backups_dir.is_dir() or keyspace in CqlSession.EXCLUDED_KEYSPACES:
+            continue
+        dst_path = str(node_backup.datapath(keyspace=keyspace, columnfamily=columnfamily))
+        for src in backups_dir.iterdir():
+            if not src.is_file():
+                continue
+            if journal.get(dst_path, src.name, src.stat().st_size) is not None:
+                # Shipped already, the hardlink outlived a previous run
+                src.unlink()
+                continue
+            srcs[(dst_path, src.name)] = src
+
+    shipped = 0
+    transfers = [(src, dst_path) for (dst_path, _), src in srcs.items()]
+    for dst_path, manifest_object in storage.storage_driver.upload_files(transfers):
+        journal.add(dst_path, manifest_object)
+        srcs[(dst_path, pathlib.PurePath(manifest_object.path).name)].unlink()
+        shipped += 1
+    if shipped:
+        logging.info('Shipped {} files'.format(shipped))
+    return shipped
+
+
+def compact_journal(journal, roots):
+    """
+    Forgets the shipped files which are not in the data folder anymore, as compactions removed them. No backup will
+    reference them, so purges can delete them.
+    """
+    def is_live(dest, manifest_object):
+        keyspace, columnfamily = pathlib.PurePath(dest).parts[-2:]
+        name = pathlib.PurePath(manifest_object.path).name
+        return any((root / keyspace / columnfamily / name).exists() for root in roots)
+
+    if journal.path.exists():
+        journal.compact(is_live)
@@ -13,29 +13,53 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import logging
-import json
+import pathlib
 import sys
 
+import medusa.rate_limiter
+
+from medusa.manifest import object_key
 from medusa.storage import Storage
+from medusa.storage.packing import archive_range, unpack
 
 
 def download_data(storageconfig, backup, fqtns_to_restore, destination):
     storage = Storage(config=storageconfig)
-    manifest = json.loads(backup.manifest)
-
-    for section in manifest:
+    for section in backup.sections():
 
         fqtn = "{}.{}".format(section['keyspace'], section['columnfamily'])
         dst = destination / section['keyspace'] / section['columnfamily']
-        srcs = ['{}{}'.format(storage.storage_driver.get_path_prefix(backup.data_path), obj['path'])
-                for obj in section['objects']]
+        path_prefix = storage.storage_driver.get_path_prefix(backup.data_path)
+        # Packed files come out of their archive. Only the part of it holding the files of the section gets
+        # downloaded, once for all of them.
+        objects = [obj for obj in section['objects'] if 'archive' not in obj]
+        archives = collections.OrderedDict()
+        for obj in section['objects']:
+            if 'archive' in obj:
+                archives.setdefault(object_key(obj), []).append(obj)
+        srcs = ['{}{}'.format(path_prefix, object_key(obj)) for obj in objects]
+        archive_ranges = [
+            ('{}{}'.format(path_prefix, archive),) + archive_range(packed_objects)
+            for archive, packed_objects in archives.items()
+        ]
         dst.mkdir(parents=True)
 
-        if len(srcs) > 0 and fqtn in fqtns_to_restore:
+        if (srcs or archive_ranges) and fqtn in fqtns_to_restore:
             logging.info('Downloading backup data')
-            storage.storage_driver.download_blobs(srcs, dst)
-        elif len(srcs) == 0 and fqtn in fqtns_to_restore:
+            codecs = {
+                src: obj['codec']
+                for src, obj in zip(srcs, objects)
+                if obj.get('codec') is not None
+            }
+            if srcs:
+                storage.storage_driver.download_blobs(srcs, dst, codecs=codecs)
+            if archive_ranges:
+                storage.storage_driver.download_blob_ranges(archive_ranges, dst)
+            for (archive, packed_objects), (_, start, _) in zip(archives.items(), archive_ranges):
+                unpack(dst / pathlib.PurePath(archive).name, packed_objects, dst, start)
+        elif fqtn in fqtns_to_restore:
             logging.debug('There is nothing to download for {}'.format(fqtn))
         else:
             logging.debug('Download of {} was not requested, skipping'.format(fqtn))
@@ -52,6 +76,7 @@ def download_data(storageconfig, backup, fqtns_to_restore, destination):
 
 def download_cmd(config, backup_name, download_destination):
     storage = Storage(config=config.storage)
+    medusa.rate_limiter.configure(config.storage, 'restore')
 
     if not download_destination.is_dir():
         logging.error('{} is not a directory'.format(download_destination))
@@ -28,9 +28,10 @@ def update_backup_index(storage, node_backup):
     Called when a backup happens, this method adds an entry about this backup to the backup index
     and sets this backups as the latest backup.
     """
-    add_backup_start_to_index(storage, node_backup)
-    add_backup_finish_to_index(storage, node_backup)
-    set_latest_backup_in_index(storage, node_backup)
+    blobs = backup_start_index_blobs(node_backup) + backup_finish_index_blobs(node_backup)
+    if not node_backup.scope.is_partial:
+        blobs += latest_backup_index_blobs(node_backup) + backup_finished_index_blobs(node_backup)
+    upload_index_blobs(storage, blobs)
 
 
 def build_indices(config, noop):
@@ -62,57 +63,116 @@ def build_indices(config, noop):
         for node_backup in all_backups:
             # if we are dealing with a complete backup
             if node_backup.finished is not None:
-                # check if this backup is newer than what was seen so far
+                # check if this backup is newer than what was seen so far, partial backups never being the latest
                 latest = latest_node_backups.get(node_backup.fqdn, node_backup)
-                if node_backup.finished >= latest.finished:
+                if node_backup.finished >= latest.finished and not node_backup.scope.is_partial:
                     latest_node_backups[node_backup.fqdn] = node_backup
                 # if requested, add the node backup to the index
                 logging.debug('Found backup {} from {}'.format(node_backup.name, node_backup.fqdn))
                 if not noop:
-                    add_backup_start_to_index(storage, node_backup)
-                    add_backup_finish_to_index(storage, node_backup)
+                    upload_index_blobs(storage, backup_start_index_blobs(node_backup)
+                                       + backup_finish_index_blobs(node_backup))
 
         # once we have seen all backups, we can set the latest ones as well
         for fqdn, node_backup in latest_node_backups.items():
             logging.debug('Latest backup {} is {}'.format(fqdn, node_backup.name))
             if not noop:
                 set_latest_backup_in_index(storage, node_backup)
+                set_backup_finished_in_index(storage, node_backup)
 
     except Exception:
         traceback.print_exc()
         sys.exit(1)
 
 
-def add_backup_start_to_index(storage, node_backup):
-    dst = 'index/backup_index/{}/tokenmap_{}.json'.format(node_backup.name, node_backup.fqdn)
-    storage.storage_driver.upload_blob_from_string(dst, node_backup.tokenmap)
-    dst = 'index/backup_index/{}/schema_{}.cql'.format(node_backup.name, node_backup.fqdn)
-    storage.storage_driver.upload_blob_from_string(dst, node_backup.schema)
-    dst = 'index/backup_index/{}/started_{}_{}.timestamp'.format(
-        node_backup.name, node_backup.fqdn, node_backup.started
-    )
+def upload_index_blobs(storage, blobs):
+    """
+    Writes the (path, content) pairs built by the functions below in one concurrent batch
+    """
+    storage.storage_driver.upload_blobs_from_contents(blobs)
+
 
-    storage.storage_driver.upload_blob_from_string(dst, str(node_backup.started))
+def backup_start_index_blobs(node_backup):
+    blobs = [
+        ('index/backup_index/{}/tokenmap_{}.json'.format(node_backup.name, node_backup.fqdn), node_backup.tokenmap),
+        ('index/backup_index/{}/schema_{}.cql'.format(node_backup.name, node_backup.fqdn), node_backup.schema),
+        ('index/backup_index/{}/started_{}_{}.timestamp'.format(node_backup.name, node_backup.fqdn,
+                                                                node_backup.started),
+         str(node_backup.started)),
+    ]
 
     if node_backup.is_differential is True:
-        dst = 'index/backup_index/{}/differential_{}'.format(node_backup.name, node_backup.fqdn)
-        storage.storage_driver.upload_blob_from_string(dst, 'differential')
+        blobs.append(('index/backup_index/{}/differential_{}'.format(node_backup.name, node_backup.fqdn),
+                      'differential'))
+
+    if node_backup.scope.is_partial:
+        blobs.append(('index/backup_index/{}/scope_{}.json'.format(node_backup.name, node_backup.fqdn),
+                      node_backup.scope.to_json()))
+
+    return blobs
+
 
+def backup_finish_index_blobs(node_backup, manifest_file=None):
+    # The manifest the backup just wrote is uploaded from its file rather than read back from the storage
+    manifest = manifest_file if manifest_file is not None else node_backup.manifest
+    return [
+        ('index/backup_index/{}/manifest_{}.json'.format(node_backup.name, node_backup.fqdn), manifest),
+        ('index/backup_index/{}/finished_{}_{}.timestamp'.format(node_backup.name, node_backup.fqdn,
+                                                                 node_backup.finished),
+         str(node_backup.finished)),
+    ]
 
-def add_backup_finish_to_index(storage, node_backup):
-    dst = 'index/backup_index/{}/manifest_{}.json'.format(node_backup.name, node_backup.fqdn)
-    storage.storage_driver.upload_blob_from_string(dst, node_backup.manifest)
-    dst = 'index/backup_index/{}/finished_{}_{}.timestamp'.format(
-        node_backup.name, node_backup.fqdn, node_backup.finished
-    )
-    storage.storage_driver.upload_blob_from_string(dst, str(node_backup.finished))
+
+def latest_backup_index_blobs(node_backup):
+    return [
+        ('index/latest_backup/{}/tokenmap.json'.format(node_backup.fqdn), node_backup.tokenmap),
+        ('index/latest_backup/{}/backup_name.txt'.format(node_backup.fqdn), node_backup.name),
+    ]
+
+
+def backup_finished_index_blobs(node_backup):
+    """
+    Records when the node last finished a full backup in a single object. Staggered backups of the next node wait on it
+    rather than listing the backup index, partial backups not counting as they leave tables out.
+    """
+    return [('index/backup_finished/{}.timestamp'.format(node_backup.fqdn), str(node_backup.finished))]
+
+
+def add_backup_start_to_index(storage, node_backup):
+    upload_index_blobs(storage, backup_start_index_blobs(node_backup))
+
+
+def add_backup_finish_to_index(storage, node_backup, manifest_file=None):
+    upload_index_blobs(storage, backup_finish_index_blobs(node_backup, manifest_file))
 
 
 def set_latest_backup_in_index(storage, node_backup):
-    dst = 'index/latest_backup/{}/tokenmap.json'.format(node_backup.fqdn)
-    storage.storage_driver.upload_blob_from_string(dst, node_backup.tokenmap)
-    dst = 'index/latest_backup/{}/backup_name.txt'.format(node_backup.fqdn)
-    storage.storage_driver.upload_blob_from_string(dst, node_backup.name)
+    upload_index_blobs(storage, latest_backup_index_blobs(node_backup))
+
+
+def set_backup_finished_in_index(storage, node_backup):
+    upload_index_blobs(storage, backup_finished_index_blobs(node_backup))
+
+
+def get_backup_finished_from_index(storage, fqdn):
+    """
+    :return: When the node last finished a backup, or None if it never did or the index predates this marker
+    """
+    finished = storage.storage_driver.get_blob_content_as_string('index/backup_finished/{}.timestamp'.format(fqdn))
+    return int(finished) if finished is not None else None
+
+
+def clean_latest_backup_from_index(storage, fqdn):
+    """
+    Removes the markers of the latest backup of a node, once it has no full backup left
+    """
+    for path in ['index/backup_finished/{}.timestamp'.format(fqdn),
+                 'index/latest_backup/{}/tokenmap.json'.format(fqdn),
+                 'index/latest_backup/{}/backup_name.txt'.format(fqdn)]:
+        blob = storage.storage_driver.get_blob(path)
+        if blob is not None:
+            logging.debug("Cleaning from backup index: {}".format(blob.name))
+            storage.storage_driver.delete_object(blob)
 
 
 def clean_backup_from_index(storage, node_backup):
@@ -48,7 +48,8 @@ def list_backups(config, show_all):
                 total_nodes
             )
         started = datetime.fromtimestamp(cluster_backup.started).strftime(TIMESTAMP_FORMAT)
-        print('{} (started: {}, finished: {})'.format(cluster_backup.name, started, finished))
+        scope = ', partial: {}'.format(cluster_backup.scope) if cluster_backup.scope.is_partial else ''
+        print('{} (started: {}, finished: {}{})'.format(cluster_backup.name, started, finished, scope))
 
     if seen_incomplete_backup:
         print('')
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import collections
+import json
+import os
+import shutil
+import sys
+
+# Manifests are JSON Lines: a summary of the backup, then one line per section, that is per table. Manifests of
+# previous versions are a single JSON list of sections, and are still read.
+MANIFEST_FORMAT = 'jsonl'
+# Parsed manifests are shared by everything reading them in a process, up to this many
+MAX_LOADED_MANIFESTS = 16
+
+_loaded_manifests = collections.OrderedDict()
+
+
+def is_summary(line):
+    return line.lstrip().startswith('{')
+
+
+def parse_summary(line):
+    summary = json.loads(line)
+    if summary.get('format') != MANIFEST_FORMAT:
+        raise ValueError('Unknown manifest format {}'.format(summary.get('format')))
+    return summary
+
+
+def make_summary(num_sections, num_objects, size):
+    return {'format': MANIFEST_FORMAT, 'sections': num_sections, 'objects': num_objects, 'size': size}
+
+
+def summarize(sections):
+    num_sections, num_objects, size = 0, 0, 0
+    for section in sections:
+        num_sections += 1
+        num_objects += len(section['objects'])
+        size += sum(obj['size'] for obj in section['objects'])
+    return make_summary(num_sections, num_objects, size)
+
+
+def lines(manifest):
+    """
+    Iterates over the lines of a string without copying all of it, as io.StringIO does
+    """
+    start = 0
+    while start < len(manifest):
+        end = manifest.find('\n', start)
+        end = len(manifest) if end < 0 else end + 1
+        yield manifest[start:end]
+        start = end
+
+
+def iter_sections(manifest):
+    """
+    Parses the sections of a manifest one at a time
+
+    :param manifest: The manifest, as a string or a file object
+    :return: A generator of sections
+    """
+    if isinstance(manifest, str):
+        if not is_summary(manifest[:1]):
+            # A manifest written as a single JSON list
+            yield from json.loads(manifest)
+            return
+        manifest = lines(manifest)
+    first_line = next(manifest, '')
+    if not is_summary(first_line):
+        yield from json.loads(first_line + manifest.read())
+        return
+    parse_summary(first_line)
+    for line in manifest:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_summary(manifest):
+    """
+    Reads the summary of a manifest. Only the manifests of previous versions get parsed entirely.
+    """
+    if isinstance(manifest, str):
+        if is_summary(manifest[:1]):
+            return parse_summary(next(lines(manifest)))
+        return summarize(json.loads(manifest))
+    first_line = next(manifest, '')
+    if is_summary(first_line):
+        return parse_summary(first_line)
+    return summarize(json.loads(first_line + manifest.read()))
+
+
+def dumps(sections):
+    sections = list(sections)
+    return '\n'.join([json.dumps(summarize(sections))] + [json.dumps(section) for section in sections]) + '\n'
+
+
+class ManifestWriter(object):
+    """
+    Writes the sections of a manifest to a local file as they get completed, rather than keeping all of them in
+    memory until the end of the backup. Closing the writer puts the summary in front of the sections.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._sections_path = path.with_name(path.name + '.sections')
+        self._sections_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self._sections_path.open('w')
+        self._num_sections = 0
+        self._num_objects = 0
+        self._size = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def append(self, section):
+        self._file.write(json.dumps(section) + '\n')
+        self._num_sections += 1
+        self._num_objects += len(section['objects'])
+        self._size += sum(obj['size'] for obj in section['objects'])
+
+    def __len__(self):
+        return self._num_sections
+
+    def close(self):
+        """
+        Writes the manifest file
+
+        :return: The summary of the manifest
+        """
+        self._file.close()
+        summary = make_summary(self._num_sections, self._num_objects, self._size)
+        with self._path.open('w') as manifest, self._sections_path.open() as sections:
+            manifest.write(json.dumps(summary) + '\n')
+            shutil.copyfileobj(sections, manifest)
+        os.remove(str(self._sections_path))
+        return summary
+
+    def remove(self):
+        if not self._file.closed:
+            self._file.close()
+        for path in [self._path, self._sections_path]:
+            if path.exists():
+                path.unlink()
+
+
+def object_key(item):
+    """
+    The key of the object storing the file of a manifest item, which is the archive of packed files. Objects stored
+    with the hashed key layout are under the shard recorded in the item.
+    """
+    path = item.get('archive', item['path'])
+    shard = item.get('shard')
+    return '{}/{}'.format(shard, path) if shard else path
+
+
+def has_shards(sections):
+    """
+    Whether any file of the sections is stored with the hashed key layout
+    """
+    return any(
+        section.has_shards if isinstance(section, ManifestSection)
+        else any(obj.get('shard') for obj in section['objects'])
+        for section in sections
+    )
+
+
+class ManifestRecord(object):
+    """
+    A record of the parsed manifest which reads like the dict it got parsed from, missing fields raising KeyError
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self else default
+
+    def __contains__(self, key):
+        return key in self.FIELDS and getattr(self, key) is not None
+
+    def keys(self):
+        return [key for key in self.FIELDS if key in self]
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def __eq__(self, other):
+        return isinstance(other, ManifestRecord) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.to_dict())
+
+
+class ManifestItem(ManifestRecord):
+    """
+    A file of a backup. Files of a table share their directory, and packed files the name of their archive, so the
+    path of a file only takes the room of its name. Files stored with the hashed key layout also have the shard their
+    object key starts with, and files hashed with another checksum than MD5 the name of that checksum.
+    """
+    FIELDS = ('path', 'MD5', 'size', 'part_size', 'etag', 'codec', 'stored_size', 'archive', 'offset', 'shard',
+              'checksum')
+    __slots__ = ('directory', 'name', 'MD5', 'size', 'part_size', 'etag', 'codec', 'stored_size', 'archive', 'offset',
+                 'shard', 'checksum')
+
+    def __init__(self, path, MD5, size, part_size=None, etag=None, codec=None, stored_size=None, archive=None,
+                 offset=None, shard=None, checksum=None):
+        directory, _, self.name = path.rpartition('/')
+        self.directory = sys.intern(directory)
+        self.MD5 = MD5
+        self.size = size
+        self.part_size = part_size
+        self.etag = etag
+        self.codec = codec
+        self.stored_size = stored_size
+        self.archive = sys.intern(archive) if archive is not None else None
+        self.offset = offset
+        self.shard = sys.intern(shard) if shard is not None else None
+        self.checksum = sys.intern(checksum) if checksum is not None else None
+
+    @property
+    def path(self):
+        return '{}/{}'.format(self.directory, self.name) if self.directory else self.name
+
+
+class StringColumn(object):
+    """
+    Strings stored end to end in a single one, rather than as an object each
+    """
+    __slots__ = ('_data', '_ends')
+
+    def __init__(self, strings):
+        self._data = ''.join(strings)
+        self._ends = array.array('I')
+        end = 0
+        for string in strings:
+            end += len(string)
+            self._ends.append(end)
+
+    def __getitem__(self, row):
+        start = self._ends[row - 1] if row > 0 else 0
+        return self._data[start:self._ends[row]]
+
+    def __len__(self):
+        return len(self._ends)
+
+
+class ManifestSection(ManifestRecord):
+    """
+    The files of a table, kept in columns. Their ManifestItems get created when they are accessed.
+    """
+    FIELDS = ('keyspace', 'columnfamily', 'objects', 'snapshot_time')
+    # Fields which all the files of a backup usually have or don't have, kept in a column when any file has them
+    COLUMN_FIELDS = ('shard', 'checksum')
+    __slots__ = ('keyspace', 'columnfamily', 'snapshot_time', '_directory', '_names', '_md5s', '_sizes', '_columns',
+                 '_extras', '_rows_by_name')
+
+    def __init__(self, keyspace, columnfamily, objects, snapshot_time=None):
+        self.keyspace = sys.intern(keyspace)
+        self.columnfamily = sys.intern(columnfamily)
+        self.snapshot_time = snapshot_time
+        # Files of a table are all in the same directory, the path of the ones which are not is kept in full
+        self._directory = objects[0]['path'].rpartition('/')[0] if objects else ''
+        names, md5s = [], []
+        columns = {field: [] for field in self.COLUMN_FIELDS}
+        self._sizes = array.array('q')
+        self._extras = {}
+        for row, obj in enumerate(objects):
+            directory, _, name = obj['path'].rpartition('/')
+            names.append(name)
+            md5s.append(obj['MD5'])
+            self._sizes.append(obj['size'])
+            for field, values in columns.items():
+                values.append(obj.get(field) or '')
+            extra = {key: value for key, value in obj.items()
+                     if key not in ('path', 'MD5', 'size') and key not in columns}
+            if directory != self._directory:
+                extra['path'] = obj['path']
+            if extra:
+                self._extras[row] = extra
+        self._names = StringColumn(names)
+        self._md5s = StringColumn(md5s)
+        self._columns = {field: StringColumn(values) for field, values in columns.items() if any(values)}
+        self._rows_by_name = array.array('I', sorted(range(len(names)), key=names.__getitem__))
+
+    @property
+    def objects(self):
+        return [self._item(row) for row in range(len(self._sizes))]
+
+    @property
+    def has_shards(self):
+        return 'shard' in self._columns
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def _item(self, row):
+        extra = dict(self._extras.get(row, ()))
+        path = extra.pop('path', None) or '{}/{}'.format(self._directory, self._names[row])
+        for field, column in self._columns.items():
+            if column[row]:
+                extra[field] = column[row]
+        return ManifestItem(path, self._md5s[row], self._sizes[row], **extra)
+
+    def find(self, name):
+        """
+        The ManifestItem of a file, or None if the table has no file of that name
+        """
+        low, high = 0, len(self._rows_by_name)
+        while low < high:
+            middle = (low + high) // 2
+            if self._names[self._rows_by_name[middle]] < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._rows_by_name) and self._names[self._rows_by_name[low]] == name:
+            return self._item(self._rows_by_name[low])
+        return None
+
+    def to_dict(self):
+        section = super(ManifestSection, self).to_dict()
+        section['objects'] = [obj.to_dict() for obj in self.objects]
+        return section
+
+
+class Manifest(object):
+    """
+    A parsed manifest, with its files indexed by table and name
+    """
+
+    def __init__(self, sections):
+        self._sections = [ManifestSection(**section) for section in sections]
+        self._index = {(section.keyspace, section.columnfamily): section for section in self._sections}
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __len__(self):
+        return len(self._sections)
+
+    @property
+    def sections(self):
+        return self._sections
+
+    def section(self, keyspace, columnfamily):
+        return self._index.get((keyspace, columnfamily))
+
+    def get(self, keyspace, columnfamily, name):
+        """
+        The ManifestItem of a file of a table, or None if the backup does not have it
+        """
+        section = self.section(keyspace, columnfamily)
+        return section.find(name) if section is not None else None
+
+    @staticmethod
+    def parse(manifest):
+        return Manifest(iter_sections(manifest))
+
+
+def load(key, read):
+    """
+    Returns the parsed manifest of a backup, which gets read and parsed once for the whole process
+
+    :param key: What identifies the manifest
+    :param read: Returns the manifest, when it is not loaded yet
+    """
+    manifest = _loaded_manifests.pop(key, None)
+    if manifest is None:
+        manifest = Manifest.parse(read())
+    _loaded_manifests[key] = manifest
+    while len(_loaded_manifests) > MAX_LOADED_MANIFESTS:
+        _loaded_manifests.popitem(last=False)
+    return manifest
+
+
+def forget(key):
+    _loaded_manifests.pop(key, None)
@@ -23,7 +23,9 @@ from collections import defaultdict
 from pathlib import Path
 
 import medusa.backup
+import medusa.backup_cluster
 import medusa.config
+import medusa.continuous
 import medusa.download
 import medusa.index
 import medusa.listing
@@ -82,13 +84,54 @@ def cli(ctx, verbosity, without_log_timestamp, config_file, **kwargs):
 @click.option('--backup-name', help='Custom name for the backup')
 @click.option('--stagger', default=None, type=int, help='Check for staggering initial backups for duration seconds')
 @click.option('--mode', default="differential", type=click.Choice(['full', 'differential']))
+@click.option('--resume', default=False, is_flag=True,
+              help='Resume an interrupted backup, only uploading the files it did not upload yet')
+@click.option('--keyspace', 'keyspaces', help="Backup tables from this keyspace", multiple=True, default={})
+@click.option('--table', 'tables', help="Backup only this table, given as keyspace.table", multiple=True, default={})
+@click.option('--snapshot-only', default=False, is_flag=True,
+              help='Only take the snapshot of the backup, which gets uploaded when resuming it')
+@click.option('--keep-snapshot', default=False, is_flag=True,
+              help='Keep the snapshot if the backup fails, for --resume to upload it instead of taking a new one')
 @pass_MedusaConfig
-def backup(medusaconfig, backup_name, stagger, mode):
+def backup(medusaconfig, backup_name, stagger, mode, resume, keyspaces, tables, snapshot_only, keep_snapshot):
     """
     Backup Cassandra
     """
     stagger_time = datetime.timedelta(seconds=stagger) if stagger else None
-    medusa.backup.main(medusaconfig, backup_name, stagger_time, mode)
+    medusa.backup.main(medusaconfig, backup_name, stagger_time, mode, resume, set(keyspaces), set(tables),
+                       snapshot_only, keep_snapshot)
+
+
+@cli.command(name='backup-cluster')
+@click.option('--backup-name', help='Custom name for the backup')
+@click.option('--seed-target', help='Seed of the cluster to back up', required=True)
+@click.option('--mode', default="differential", type=click.Choice(['full', 'differential']))
+@click.option('--temp-dir', help='Directory for temporary storage', default="/tmp")
+@click.option('--max-per-rack', default=0, type=int,
+              help='Maximum number of nodes of a rack uploading their backup at once, 0 for no limit')
+@click.option('--max-per-dc', default=0, type=int,
+              help='Maximum number of nodes of a datacenter uploading their backup at once, 0 for no limit')
+@click.option('--keyspace', 'keyspaces', help="Backup tables from this keyspace", multiple=True, default={})
+@click.option('--table', 'tables', help="Backup only this table, given as keyspace.table", multiple=True, default={})
+@pass_MedusaConfig
+def backup_cluster(medusaconfig, backup_name, seed_target, mode, temp_dir, max_per_rack, max_per_dc, keyspaces,
+                   tables):
+    """
+    Backup all the nodes of a Cassandra cluster over SSH
+    """
+    medusa.backup_cluster.orchestrate(medusaconfig, backup_name, seed_target, mode, Path(temp_dir),
+                                      max_per_rack, max_per_dc, keyspaces, tables)
+
+
+@cli.command(name='continuous')
+@click.option('--interval', default=medusa.continuous.DEFAULT_INTERVAL_SECONDS, type=int,
+              help='Seconds to wait between two looks at the incremental backups of the tables')
+@pass_MedusaConfig
+def continuous(medusaconfig, interval):
+    """
+    Ship the SSTables Cassandra hardlinks to the backups folders when incremental_backups is enabled
+    """
+    medusa.continuous.main(medusaconfig, interval)
 
 
 @cli.command(name='fetch-tokenmap')
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import os
+import subprocess
+import time
+import uuid
+
+import paramiko
+
+
+Remote = collections.namedtuple('Remote', ['target', 'connect_args', 'client', 'channel', 'stdout', 'stderr',
+                                           'work_dir'])
+# Commands of a job run in its working directory, unless they need a directory of their own for medusa-wrapper
+Remote.__new__.__defaults__ = (None,)
+SSH_ADD_KEYS_CMD = 'ssh-add'
+SSH_AGENT_CREATE_CMD = 'ssh-agent'
+SSH_AGENT_KILL_CMD = 'ssh-agent -k'
+SSH_AUTH_SOCK_ENVVAR = 'SSH_AUTH_SOCK'
+SSH_AGENT_PID_ENVVAR = 'SSH_AGENT_PID'
+POLL_INTERVAL_SECONDS = 5
+
+
+class RemoteJob(object):
+    """
+    Runs medusa commands on the nodes of a cluster over SSH, through medusa-wrapper so they survive a lost connection
+    """
+
+    def __init__(self, config, temp_dir):
+        self.id = uuid.uuid4()
+        self.config = config
+        self.temp_dir = temp_dir  # temporary files
+        self.work_dir = self.temp_dir / 'medusa-job-{id}'.format(id=self.id)
+        self._ssh_agent_started = False
+
+    def _wait_for(self, remotes):
+        finished, broken = [], []
+        running = list(remotes)
+
+        while running:
+            time.sleep(POLL_INTERVAL_SECONDS)
+            still_running = []
+            for remote in running:
+                remote, succeeded = self._poll(remote)
+                if succeeded is None:
+                    still_running.append(remote)
+                elif succeeded:
+                    finished.append(remote)
+                else:
+                    broken.append(remote)
+            running = still_running
+
+        logging.info('Exiting because all jobs are done.')
+        if len(broken) > 0:
+            logging.info('Command failed on the following nodes:')
+            for remote in broken:
+                logging.info(remote.target)
+        else:
+            logging.info('Commands succeeded on all nodes')
+
+        return finished, broken
+
+    def _poll(self, remote):
+        """
+        Checks on a command started with _run
+
+        :return: The remote to keep polling, which is a new one if the connection had to be opened again, and whether
+        the command succeeded, or None while it is running
+        """
+        # If the remote does not set an exit status and the channel closes
+        # the exit_status is negative.
+        logging.debug('remote.channel.exit_status: {}'.format(remote.channel.exit_status))
+        if remote.channel.exit_status_ready and remote.channel.exit_status >= 0:
+            succeeded = remote.channel.exit_status == 0
+            if succeeded:
+                logging.info('Command succeeded on {}'.format(remote.target))
+            else:
+                logging.error('Command failed on {} : '.format(remote.target))
+                logging.error('Output : {}'.format(remote.stdout.readlines()))
+                logging.error('Err output : {}'.format(remote.stderr.readlines()))
+                try:
+                    stderr = self.read_file(remote, (remote.work_dir or self.work_dir) / 'stderr')
+                except IOError:
+                    stderr = 'There was no stderr file'
+                logging.error(stderr)
+            # We got an exit code that does not indicate an error, but not necessarily
+            # success. Cleanup channel and move to next remote.
+            remote.channel.close()
+            # also close the client. this will free file descriptors
+            # in case we start re-using remotes this close will need to go away
+            remote.client.close()
+            return remote, succeeded
+
+        if remote.client.get_transport().is_alive() and not remote.channel.closed:
+            # Send an ignored packet for keep alive and later noticing a broken connection
+            logging.debug('Keeping {} alive.'.format(remote.target))
+            remote.client.get_transport().send_ignore()
+            return remote, None
+
+        client = paramiko.client.SSHClient()
+        client.load_system_host_keys()
+        client.connect(**remote.connect_args)
+
+        # TODO: check pid to exist before assuming medusa-wrapper to pick it up
+        command = 'cd {work}; medusa-wrapper'.format(work=remote.work_dir or self.work_dir)
+        return self._run(remote.target, client, remote.connect_args, command, remote.work_dir), None
+
+    def _connect(self, target, work_dir=None):
+        logging.debug('Connecting to {}'.format(target))
+
+        pkey = None
+        if self.config.ssh.key_file is not None and self.config.ssh.key_file != '':
+            pkey = paramiko.RSAKey.from_private_key_file(self.config.ssh.key_file, None)
+            if self._ssh_agent_started is False:
+                self.create_agent()
+                add_key_cmd = '{} {}'.format(SSH_ADD_KEYS_CMD, self.config.ssh.key_file)
+                subprocess.check_output(add_key_cmd, universal_newlines=True, shell=True)
+                self._ssh_agent_started = True
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
+        connect_args = {
+            'hostname': target,
+            'username': self.config.ssh.username,
+            'pkey': pkey,
+            'compress': True,
+            'password': None
+        }
+        client.connect(**connect_args)
+
+        logging.debug('Successfully connected to {}'.format(target))
+        sftp = client.open_sftp()
+        try:
+            # A command running in a directory of its own gets it created under the working directory of the job
+            for directory in [self.work_dir] + ([work_dir] if work_dir is not None else []):
+                try:
+                    sftp.mkdir(str(directory))
+                except OSError:
+                    err_msg = 'Working directory {} on {} failed.' \
+                              'Folder might exist already, ignoring exception'.format(str(directory), target)
+                    logging.debug(err_msg)
+        except Exception as ex:
+            err_msg = 'Creating working directory on {} failed: {}'.format(target, str(ex))
+            logging.error(err_msg)
+            raise Exception(err_msg)
+        finally:
+            sftp.close()
+
+        return client, connect_args
+
+    def _run(self, target, client, connect_args, command, work_dir=None):
+        transport = client.get_transport()
+        session = transport.open_session()
+        session.get_pty()
+        paramiko.agent.AgentRequestHandler(session)
+        session.exec_command(command.replace('sudo', 'sudo -S'))
+        bufsize = -1
+        stdout = session.makefile('r', bufsize)
+        stderr = session.makefile_stderr('r', bufsize)
+        logging.debug('Running \'{}\' remotely on {}'.format(command, connect_args['hostname']))
+        return Remote(target, connect_args, client, stdout.channel, stdout, stderr, work_dir)
+
+    def read_file(self, remote, remotepath):
+        with remote.client.open_sftp() as ftp_client:
+            with ftp_client.file(remotepath.as_posix(), 'r') as f:
+                return str(f.read(), 'utf-8')
+
+    def create_agent(self):
+        """
+        Function that creates the agent and sets the environment variables.
+        """
+        output = subprocess.check_output(SSH_AGENT_CREATE_CMD, universal_newlines=True, shell=True)
+        if output:
+            output = output.strip().split('\n')
+            for item in output[0:2]:
+                envvar, val = item.split(';')[0].split('=')
+                logging.debug('Setting environment variable: {}={}'.format(envvar, val))
+                os.environ[envvar] = val
+
+    def ssh_cleanup(self):
+        """
+        Function that kills the agents created so that there aren't too many agents lying around eating up resources.
+        """
+        # Kill the agent
+        subprocess.check_output(SSH_AGENT_KILL_CMD, universal_newlines=True, shell=True)
+        # Reset these values so that other function
+        os.environ[SSH_AUTH_SOCK_ENVVAR] = ''
+        os.environ[SSH_AGENT_PID_ENVVAR] = ''
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import mmap
+import os
+
+
+# cached: read files like any other program, leaving them in the page cache
+# dontneed: tell the kernel files are read sequentially, and drop their pages from the page cache once read
+# direct: bypass the page cache entirely with O_DIRECT, falling back to dontneed where it is not supported
+MODES = ['cached', 'dontneed', 'direct']
+DEFAULT_MODE = 'dontneed'
+
+DIRECT_READ_SIZE = 1024 * 1024
+DROP_INTERVAL_BYTES = 8 * 1024 * 1024
+
+_mode = DEFAULT_MODE
+
+
+def get_mode():
+    return _mode
+
+
+def configure(storage_config):
+    """
+    Sets how the files of snapshots get read by all the threads of the process
+    """
+    global _mode
+    mode = storage_config.snapshot_read_mode or DEFAULT_MODE
+    if mode not in MODES:
+        raise ValueError('Unknown snapshot read mode {}, expected one of {}'.format(mode, ', '.join(MODES)))
+    _mode = mode
+    return _mode
+
+
+def _fadvise(fd, offset, length, advice):
+    # posix_fadvise is only a hint, and is not available everywhere
+    if advice is None:
+        return
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError as e:
+            logging.debug('posix_fadvise failed: {}'.format(e))
+
+
+def drop_cache(path, mode=None):
+    """
+    Drops the pages of a file which got read by another program, like the storage driver or gsutil
+    """
+    if (mode or get_mode()) == 'cached' or not hasattr(os, 'POSIX_FADV_DONTNEED'):
+        return
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        _fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+class SequentialReader(object):
+    """
+    Reads a file from start to end without polluting the page cache, so the data Cassandra serves stays cached while
+    snapshots get hashed and uploaded.
+    """
+
+    def __init__(self, path, mode=None):
+        self._path = str(path)
+        self._mode = mode or get_mode()
+        self._fd = None
+        self._offset = 0
+        self._dropped = 0
+        self._buffer = None
+        self._pending = memoryview(b'')
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def size(self):
+        return os.fstat(self._fd).st_size
+
+    def __enter__(self):
+        if self._mode == 'direct':
+            try:
+                self._fd = os.open(self._path, os.O_RDONLY | os.O_DIRECT)
+                # O_DIRECT needs page aligned buffers, which anonymous maps are
+                self._buffer = mmap.mmap(-1, DIRECT_READ_SIZE)
+            except (AttributeError, OSError) as e:
+                logging.debug('Cannot read {} with O_DIRECT, dropping its pages instead: {}'.format(self._path, e))
+                self._mode = 'dontneed'
+        if self._fd is None:
+            self._fd = os.open(self._path, os.O_RDONLY)
+        if self._mode == 'dontneed':
+            _fadvise(self._fd, 0, 0, getattr(os, 'POSIX_FADV_SEQUENTIAL', None))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._mode == 'dontneed':
+            _fadvise(self._fd, 0, 0, getattr(os, 'POSIX_FADV_DONTNEED', None))
+        os.close(self._fd)
+        self._pending = memoryview(b'')
+        self._buffer = None
+        return False
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        if self._buffer is None:
+            read_size = os.readv(self._fd, [view])
+            self._offset += read_size
+            if self._mode == 'dontneed' and self._offset - self._dropped >= DROP_INTERVAL_BYTES:
+                _fadvise(self._fd, self._dropped, self._offset - self._dropped,
+                         getattr(os, 'POSIX_FADV_DONTNEED', None))
+                self._dropped = self._offset
+            return read_size
+
+        # O_DIRECT reads go through the aligned buffer, the caller gets what it asked for out of it
+        if not self._pending:
+            read_size = os.readv(self._fd, [self._buffer])
+            self._pending = memoryview(self._buffer)[:read_size]
+        read_size = min(len(view), len(self._pending))
+        view[:read_size] = self._pending[:read_size]
+        self._pending = self._pending[read_size:]
+        return read_size
+
+    def read(self, size=-1):
+        if size < 0:
+            return b''.join(iter(lambda: self.read(DIRECT_READ_SIZE), b''))
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        read_size = 0
+        while read_size < size:
+            chunk_size = self.readinto(view[read_size:])
+            if not chunk_size:
+                break
+            read_size += chunk_size
+        del view
+        del buffer[read_size:]
+        return bytes(buffer)
@@ -14,7 +14,7 @@
 # limitations under the License.
 
 
-import json
+import collections
 import logging
 import sys
 import traceback
@@ -22,7 +22,14 @@ import os
 
 from datetime import datetime, timedelta
 
-from medusa.index import clean_backup_from_index
+import medusa.manifest
+import medusa.rate_limiter
+
+from medusa.backup import make_manifest_item
+from medusa.backup_journal import continuous_journal, pending_backup_journals
+from medusa.cassandra_utils import CassandraConfigReader
+from medusa.index import clean_backup_from_index, clean_latest_backup_from_index
+from medusa.manifest import object_key
 from medusa.monitoring import Monitoring
 from medusa.storage import Storage, format_bytes_str
 
@@ -34,16 +41,23 @@ def main(config, max_backup_age=0, max_backup_count=0):
     try:
         logging.info('Starting purge')
         storage = Storage(config=config.storage)
+        medusa.rate_limiter.configure(config.storage, 'purge')
         # Get all backups for the local node
         logging.info('Listing backups for {}'.format(config.storage.fqdn))
         backup_index = storage.list_backup_index_blobs()
         backups = list(storage.list_node_backups(fqdn=config.storage.fqdn, backup_index_blobs=backup_index))
         # list all backups to purge based on date conditions
         backups_to_purge += backups_to_purge_by_age(backups, max_backup_age)
-        # list all backups to purge based on count conditions
-        backups_to_purge += backups_to_purge_by_count(backups, max_backup_count)
-        # purge all candidate backups
-        purge_backups(storage, backups_to_purge, config.storage.fqdn)
+        # list all backups to purge based on count conditions, partial backups being counted along with the backups
+        # of the same tables only, so frequent backups of a few tables do not push the others out
+        for scope_backups in group_backups_by_scope(backups).values():
+            backups_to_purge += backups_to_purge_by_count(scope_backups, max_backup_count)
+        # purge all candidate backups, keeping the files shipped by medusa continuous for the next backups and the
+        # ones uploaded by interrupted backups for resuming them
+        purge_backups(storage, backups_to_purge, config.storage.fqdn, journaled_paths(config))
+        # the next node does not wait on a node which has no backup left when staggering its backups
+        if not remaining_full_backups(backups, backups_to_purge):
+            clean_latest_backup_from_index(storage, config.storage.fqdn)
 
         logging.debug('Emitting metrics')
         tags = ['medusa-node-backup', 'purge-error', 'PURGE-ERROR']
@@ -63,6 +77,13 @@ def backups_to_purge_by_age(backups, max_backup_age):
     return list()
 
 
+def group_backups_by_scope(backups):
+    backups_by_scope = collections.OrderedDict()
+    for backup in backups:
+        backups_by_scope.setdefault(backup.scope, []).append(backup)
+    return backups_by_scope
+
+
 def backups_to_purge_by_count(backups, max_backup_count):
     if max_backup_count > 0 and len(backups) > max_backup_count:
         # once we have all the backups, we sort them by their start time. we get oldest ones first
@@ -76,7 +97,40 @@ def backups_to_purge_by_count(backups, max_backup_count):
     return list()
 
 
-def purge_backups(storage, backups, fqdn):
+def remaining_full_backups(backups, purged_backups):
+    purged_names = {backup.name for backup in purged_backups}
+    return [
+        backup
+        for backup in backups
+        if backup.name not in purged_names and backup.finished is not None and not backup.scope.is_partial
+    ]
+
+
+def journaled_paths(config):
+    """
+    Returns the paths of the files shipped by medusa continuous on this node, which the next backups will reference,
+    and of the files uploaded by its interrupted backups, which resuming them will reference. Only the journals of
+    the node know about them until then.
+    """
+    data_directory = None
+    if not config.storage.backup_journal_dir:
+        try:
+            data_directory = CassandraConfigReader(config.cassandra.config_file).root
+        except (AttributeError, RuntimeError) as e:
+            logging.debug('No journal of shipped or uploaded files to look for: {}'.format(e))
+            return set()
+    journals = [continuous_journal(config.storage, data_directory)] \
+        + pending_backup_journals(config.storage, data_directory)
+    # Journals hold the paths the storage gave, gsutil's being gs:// URLs. They are turned into the keys of the
+    # objects, which are the ones of the archives of packed files.
+    return {
+        object_key(make_manifest_item(manifest_object, config.storage.fqdn))
+        for journal in journals if journal.path.exists()
+        for _, manifest_object in journal.load().items()
+    }
+
+
+def purge_backups(storage, backups, fqdn, protected_paths=frozenset()):
     logging.info("{} backups are candidate to be purged".format(len(backups)))
     nb_objects_purged = 0
     total_purged_size = 0
@@ -86,7 +140,7 @@ def purge_backups(storage, backups, fqdn):
         nb_objects_purged += purged_objects
         total_purged_size += purged_size
 
-    (cleaned_objects_count, cleaned_objects_size) = cleanup_obsolete_files(storage, fqdn)
+    (cleaned_objects_count, cleaned_objects_size) = cleanup_obsolete_files(storage, fqdn, protected_paths)
     nb_objects_purged += cleaned_objects_count
     total_purged_size += cleaned_objects_size
 
@@ -102,7 +156,8 @@ def purge_backup(storage, backup):
     clean_backup_from_index(storage, backup)
 
     logging.info("Purging backup {}...".format(backup.name))
-    objects = storage.storage_driver.list_objects(backup.backup_path)
+    hashed = storage.storage_driver.hashed_keys or medusa.manifest.has_shards(backup.sections())
+    objects = storage.storage_driver.list_data_objects(backup.backup_path, hashed=hashed)
 
     for obj in objects:
         logging.debug("Purging {}".format(obj.name))
@@ -113,16 +168,18 @@ def purge_backup(storage, backup):
     return (purged_objects, purged_size)
 
 
-def cleanup_obsolete_files(storage, fqdn):
+def cleanup_obsolete_files(storage, fqdn, protected_paths=frozenset()):
     logging.info("Cleaning up orphaned files...")
     nb_objects_purged = 0
     total_purged_size = 0
 
     backups = storage.list_node_backups(fqdn=fqdn)
-    paths_in_manifest = get_file_paths_from_manifests_for_differential_backups(backups)
-    paths_in_storage = get_file_paths_from_storage(storage, fqdn)
+    differential_backups = filter_differential_backups(backups)
+    paths_in_manifest, sharded = get_file_paths_from_manifests_for_differential_backups(differential_backups)
+    hashed = storage.storage_driver.hashed_keys or sharded
+    paths_in_storage = get_file_paths_from_storage(storage, fqdn, hashed)
 
-    for path in paths_in_storage - paths_in_manifest:
+    for path in paths_in_storage - paths_in_manifest - set(protected_paths):
         logging.debug("  - [{}] exists in storage, but not in manifest".format(path))
         obj = storage.storage_driver.get_blob(path)
         nb_objects_purged += 1
@@ -132,34 +189,37 @@ def cleanup_obsolete_files(storage, fqdn):
     return nb_objects_purged, total_purged_size
 
 
-def get_file_paths_from_storage(storage, fqdn):
+def get_file_paths_from_storage(storage, fqdn, hashed=None):
     data_directory = "{}/data".format(fqdn)
     data_files = {
         blob.name: blob
-        for blob in storage.storage_driver.list_objects(os.fspath(data_directory))
+        for blob in storage.storage_driver.list_data_objects(os.fspath(data_directory), hashed=hashed)
     }
 
     return set(data_files.keys())
 
 
 def get_file_paths_from_manifests_for_differential_backups(backups):
-    differential_backups = filter_differential_backups(backups)
-
-    manifests = list(map(lambda backup: json.loads(backup.manifest), differential_backups))
+    """
+    Reads each manifest once, as they may not all stay loaded at the same time
 
-    objects_in_manifests = [
-        obj
-        for manifest in manifests
-        for columnfamily_manifest in manifest
-        for obj in columnfamily_manifest['objects']
-    ]
+    :return: The paths of the objects of the backups, and whether any is stored with the hashed key layout
+    """
+    differential_backups = filter_differential_backups(backups)
 
-    paths_in_manifest = {
-        "{}".format(obj['path'])
-        for obj in objects_in_manifests
-    }
+    paths_in_manifest = set()
+    hashed = False
+    for backup in differential_backups:
+        sections = backup.sections()
+        # Packed files are stored in the archive of their SSTable
+        paths_in_manifest.update(
+            "{}".format(object_key(obj))
+            for columnfamily_manifest in sections
+            for obj in columnfamily_manifest['objects']
+        )
+        hashed = hashed or medusa.manifest.has_shards(sections)
 
-    return paths_in_manifest
+    return paths_in_manifest, hashed
 
 
 def filter_differential_backups(backups):
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import configparser
+import logging
+import os
+import threading
+import time
+
+
+OPERATIONS = ['backup', 'restore', 'purge']
+CONTROL_FILE_CHECK_INTERVAL_SECONDS = 1
+
+
+class TokenBucket(object):
+    """
+    Token bucket letting through rate tokens per second on average, with bursts of up to one second worth of tokens.
+
+    Callers can take more tokens than the bucket holds, for instance to send a whole file at once. The bucket then
+    goes into debt, and the following callers wait until it is paid back.
+    """
+
+    def __init__(self, rate=0, clock=time.monotonic, sleep=time.sleep):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._sleep = sleep
+        self._rate = rate
+        self._tokens = rate
+        self._last = clock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self._rate = rate
+            self._tokens = min(self._tokens, rate)
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._rate, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def acquire(self, amount=1):
+        """
+        Takes amount tokens from the bucket, waiting for them to be available. A rate of 0 means no limit.
+
+        :return: the time spent waiting, in seconds
+        """
+        with self._lock:
+            if self._rate <= 0:
+                return 0
+            self._refill()
+            # Tokens are reserved right away, so concurrent callers queue up behind each other
+            self._tokens -= amount
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class RateLimiter(object):
+    """
+    Limits the bandwidth and the number of requests of all the storage transfers of the process. When several worker
+    processes share the limits, each of them gets an even share of the configured ones and of the control file's.
+
+    The limits can be changed while Medusa runs by writing them in the control file, for instance:
+
+        bytes_per_second = 52428800
+        requests_per_second = 100
+    """
+
+    def __init__(self, bytes_per_second=0, requests_per_second=0, control_file=None, clock=time.monotonic,
+                 sleep=time.sleep, workers=1):
+        self._workers = workers
+        self._bytes = TokenBucket(bytes_per_second // workers, clock, sleep)
+        self._requests = TokenBucket(requests_per_second // workers, clock, sleep)
+        self._control_file = control_file
+        self._control_file_mtime = None
+        self._control_file_checked = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_per_second(self):
+        return self._bytes.rate
+
+    @property
+    def requests_per_second(self):
+        return self._requests.rate
+
+    def consume(self, size):
+        """
+        Waits for size bytes to be allowed through
+        """
+        self._check_control_file()
+        return self._bytes.acquire(size)
+
+    def request(self):
+        """
+        Waits for one more request to be allowed through
+        """
+        self._check_control_file()
+        return self._requests.acquire()
+
+    def throttle(self, chunks):
+        """
+        Lets the chunks of a stream through at the allowed bandwidth
+        """
+        for chunk in chunks:
+            self.consume(len(chunk))
+            yield chunk
+
+    def _check_control_file(self):
+        if self._control_file is None:
+            return
+        with self._lock:
+            now = self._clock()
+            if self._control_file_checked is not None \
+                    and now - self._control_file_checked < CONTROL_FILE_CHECK_INTERVAL_SECONDS:
+                return
+            self._control_file_checked = now
+            try:
+                mtime = os.stat(self._control_file).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self._control_file_mtime:
+                return
+            self._control_file_mtime = mtime
+        self.reload()
+
+    def reload(self):
+        """
+        Applies the limits found in the control file
+        """
+        control = configparser.ConfigParser(interpolation=None)
+        try:
+            with open(self._control_file, 'r') as f:
+                control.read_string('[limits]\n' + f.read())
+            limits = control['limits']
+            if 'bytes_per_second' in limits:
+                self._bytes.set_rate(int(limits['bytes_per_second']) // self._workers)
+            if 'requests_per_second' in limits:
+                self._requests.set_rate(int(limits['requests_per_second']) // self._workers)
+        except (OSError, ValueError, configparser.Error) as e:
+            logging.warning('Ignoring unreadable rate limiter control file {}: {}'.format(self._control_file, e))
+            return
+        logging.info('Storage transfers limited to {} bytes and {} requests per second (0 means unlimited)'.format(
+            self.bytes_per_second, self.requests_per_second))
+
+
+_limiter = RateLimiter()
+
+
+def get_limiter():
+    return _limiter
+
+
+def configure(storage_config, operation, workers=1):
+    """
+    Sets up the rate limiter shared by all the storage transfers of the process, with the limits configured for the
+    operation (backup, restore or purge) it runs.
+
+    :param workers: The number of processes sharing the limits, each of them getting an even share
+    """
+    global _limiter
+    if operation not in OPERATIONS:
+        raise ValueError('Unknown operation {}'.format(operation))
+    limits = storage_config._asdict()
+    _limiter = RateLimiter(
+        bytes_per_second=int(limits.get('{}_max_bandwidth'.format(operation)) or 0),
+        requests_per_second=int(limits.get('{}_max_requests'.format(operation)) or 0),
+        control_file=storage_config.rate_limit_control_file,
+        workers=workers
+    )
+    if _limiter.bytes_per_second or _limiter.requests_per_second:
+        logging.info('{} transfers limited to {} bytes and {} requests per second (0 means unlimited)'.format(
+            operation.capitalize(), _limiter.bytes_per_second, _limiter.requests_per_second))
+    return _limiter
@@ -16,30 +16,18 @@
 import collections
 import logging
 import sys
-import time
-import uuid
 import datetime
 import traceback
-import paramiko
-import subprocess
-import os
 
 from medusa.monitoring import Monitoring
 
 from medusa.cassandra_utils import CqlSessionProvider
+from medusa.orchestration import RemoteJob
 from medusa.schema import parse_schema
 from medusa.storage import Storage
 from medusa.verify_restore import verify_restore
 
 
-Remote = collections.namedtuple('Remote', ['target', 'connect_args', 'client', 'channel', 'stdout', 'stderr'])
-SSH_ADD_KEYS_CMD = 'ssh-add'
-SSH_AGENT_CREATE_CMD = 'ssh-agent'
-SSH_AGENT_KILL_CMD = 'ssh-agent -k'
-SSH_AUTH_SOCK_ENVVAR = 'SSH_AUTH_SOCK'
-SSH_AGENT_PID_ENVVAR = 'SSH_AGENT_PID'
-
-
 def orchestrate(config, backup_name, seed_target, temp_dir, host_list, keep_auth, bypass_checks,
                 verify, keyspaces, tables, use_sstableloader=False):
     monitoring = Monitoring(config=config.monitoring)
@@ -109,26 +97,22 @@ def expand_repeatable_option(option, values):
     return ' '.join(['--{} {}'.format(option, value) for value in values])
 
 
-class RestoreJob(object):
+class RestoreJob(RemoteJob):
     def __init__(self, cluster_backup, config, temp_dir, host_list, seed_target, keep_auth, verify,
                  keyspaces={}, tables={}, bypass_checks=False, use_sstableloader=False):
-        self.id = uuid.uuid4()
+        super(RestoreJob, self).__init__(config, temp_dir)
         self.ringmap = None
         self.cluster_backup = cluster_backup
         self.session_provider = None
-        self.config = config
         self.host_list = host_list
         self.seed_target = seed_target
         self.keep_auth = keep_auth
         self.verify = verify
         self.in_place = None
-        self.temp_dir = temp_dir  # temporary files
-        self.work_dir = self.temp_dir / 'medusa-job-{id}'.format(id=self.id)
         self.host_map = {}  # Map of backup host/target host for the restore process
         self.keyspaces = keyspaces
         self.tables = tables
         self.bypass_checks = bypass_checks
-        self._ssh_agent_started = False
         self.use_sstableloader = use_sstableloader
 
     def execute(self):
@@ -390,149 +374,7 @@ class RestoreJob(object):
         logging.debug('Restoring on node {} with the following command {}'.format(target, command))
         return self._run(target, client, connect_args, command)
 
-    def _wait_for(self, remotes):
-        finished, broken = [], []
-
-        while True:
-            time.sleep(5)  # TODO: configure sleep
-
-            if len(remotes) == len(finished) + len(broken):
-                # TODO: make a nicer exit condition
-                logging.info('Exiting because all jobs are done.')
-                break
-
-            for i, remote in enumerate(remotes):
-
-                if remote in broken or remote in finished:
-                    continue
-
-                # If the remote does not set an exit status and the channel closes
-                # the exit_status is negative.
-                logging.debug('remote.channel.exit_status: {}'.format(remote.channel.exit_status))
-                if remote.channel.exit_status_ready and remote.channel.exit_status >= 0:
-                    if remote.channel.exit_status == 0:
-                        finished.append(remote)
-                        logging.info('Command succeeded on {}'.format(remote.target))
-                    else:
-                        broken.append(remote)
-                        logging.error('Command failed on {} : '.format(remote.target))
-                        logging.error('Output : {}'.format(remote.stdout.readlines()))
-                        logging.error('Err output : {}'.format(remote.stderr.readlines()))
-                        try:
-                            stderr = self.read_file(remote, self.work_dir / 'stderr')
-                        except IOError:
-                            stderr = 'There was no stderr file'
-                        logging.error(stderr)
-                    # We got an exit code that does not indicate an error, but not necessarily
-                    # success. Cleanup channel and move to next remote.
-                    remote.channel.close()
-                    # also close the client. this will free file descriptors
-                    # in case we start re-using remotes this close will need to go away
-                    remote.client.close()
-                    continue
-
-                if remote.client.get_transport().is_alive() and not remote.channel.closed:
-                    # Send an ignored packet for keep alive and later noticing a broken connection
-                    logging.debug('Keeping {} alive.'.format(remote.target))
-                    remote.client.get_transport().send_ignore()
-                else:
-                    client = paramiko.client.SSHClient()
-                    client.load_system_host_keys()
-                    client.connect(**remote.connect_args)
-
-                    # TODO: check pid to exist before assuming medusa-wrapper to pick it up
-                    command = 'cd {work}; medusa-wrapper'.format(work=self.work_dir)
-                    remotes[i] = self._run(remote.target, client, remote.connect_args, command)
-
-        if len(broken) > 0:
-            logging.info('Command failed on the following nodes:')
-            for remote in broken:
-                logging.info(remote.target)
-        else:
-            logging.info('Commands succeeded on all nodes')
-
-        return finished, broken
-
-    def _connect(self, target):
-        logging.debug('Connecting to {}'.format(target))
-
-        pkey = None
-        if self.config.ssh.key_file is not None and self.config.ssh.key_file != '':
-            pkey = paramiko.RSAKey.from_private_key_file(self.config.ssh.key_file, None)
-            if self._ssh_agent_started is False:
-                self.create_agent()
-                add_key_cmd = '{} {}'.format(SSH_ADD_KEYS_CMD, self.config.ssh.key_file)
-                subprocess.check_output(add_key_cmd, universal_newlines=True, shell=True)
-                self._ssh_agent_started = True
-
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
-        connect_args = {
-            'hostname': target,
-            'username': self.config.ssh.username,
-            'pkey': pkey,
-            'compress': True,
-            'password': None
-        }
-        client.connect(**connect_args)
-
-        logging.debug('Successfully connected to {}'.format(target))
-        sftp = client.open_sftp()
-        try:
-            sftp.mkdir(str(self.work_dir))
-        except OSError:
-            err_msg = 'Working directory {} on {} failed.' \
-                      'Folder might exist already, ignoring exception'.format(str(self.work_dir), target)
-            logging.debug(err_msg)
-        except Exception as ex:
-            err_msg = 'Creating working directory on {} failed: {}'.format(target, str(ex))
-            logging.error(err_msg)
-            raise Exception(err_msg)
-        finally:
-            sftp.close()
-
-        return client, connect_args
-
-    def _run(self, target, client, connect_args, command):
-        transport = client.get_transport()
-        session = transport.open_session()
-        session.get_pty()
-        paramiko.agent.AgentRequestHandler(session)
-        session.exec_command(command.replace('sudo', 'sudo -S'))
-        bufsize = -1
-        stdout = session.makefile('r', bufsize)
-        stderr = session.makefile_stderr('r', bufsize)
-        logging.debug('Running \'{}\' remotely on {}'.format(command, connect_args['hostname']))
-        return Remote(target, connect_args, client, stdout.channel, stdout, stderr)
-
-    def read_file(self, remote, remotepath):
-        with remote.client.open_sftp() as ftp_client:
-            with ftp_client.file(remotepath.as_posix(), 'r') as f:
-                return str(f.read(), 'utf-8')
-
     def check_cassandra_running(self, host, client, connect_args):
         command = 'sh -c "{}"'.format(self.config.cassandra.check_running)
         remote = self._run(host, client, connect_args, command)
         return remote.channel.recv_exit_status() == 0
-
-    def create_agent(self):
-        """
-        Function that creates the agent and sets the environment variables.
-        """
-        output = subprocess.check_output(SSH_AGENT_CREATE_CMD, universal_newlines=True, shell=True)
-        if output:
-            output = output.strip().split('\n')
-            for item in output[0:2]:
-                envvar, val = item.split(';')[0].split('=')
-                logging.debug('Setting environment variable: {}={}'.format(envvar, val))
-                os.environ[envvar] = val
-
-    def ssh_cleanup(self):
-        """
-        Function that kills the agents created so that there aren't too many agents lying around eating up resources.
-        """
-        # Kill the agent
-        subprocess.check_output(SSH_AGENT_KILL_CMD, universal_newlines=True, shell=True)
-        # Reset these values so that other function
-        os.environ[SSH_AUTH_SOCK_ENVVAR] = ''
-        os.environ[SSH_AGENT_PID_ENVVAR] = ''
@@ -24,14 +24,19 @@ import sys
 import time
 import uuid
 
+import medusa.rate_limiter
+
 from medusa.cassandra_utils import Cassandra, is_node_up
 from medusa.download import download_data
 from medusa.storage import Storage
+from medusa.storage.packing import sstable_generation
 from medusa.verify_restore import verify_restore
 
 
 A_MINUTE = 60
 MAX_ATTEMPTS = 60
+# Files moved by each mv command, keeping the command line of tables with many SSTables under the system limit
+MOVE_BATCH_SIZE = 1000
 
 
 def restore_node(config, temp_dir, backup_name, in_place, keep_auth, seeds, verify, keyspaces, tables,
@@ -42,6 +47,7 @@ def restore_node(config, temp_dir, backup_name, in_place, keep_auth, seeds, veri
         sys.exit(1)
 
     storage = Storage(config=config.storage)
+    medusa.rate_limiter.configure(config.storage, 'restore')
 
     if not use_sstableloader:
         restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, seeds, storage,
@@ -68,7 +74,10 @@ def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, see
         logging.error('No such backup')
         sys.exit(1)
 
-    fqtns_to_restore = get_fqtns_to_restore(keyspaces, tables, node_backup.manifest)
+    if node_backup.scope.is_partial:
+        logging.info('Backup {} only holds {}, the other tables are left as they are'.format(
+            backup_name, node_backup.scope))
+    fqtns_to_restore = get_fqtns_to_restore(keyspaces, tables, node_backup.sections())
     if len(fqtns_to_restore) == 0:
         logging.error('There is nothing to restore')
         sys.exit(0)
@@ -90,13 +99,15 @@ def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, see
 
     # move backup data to Cassandra data directory according to system table
     logging.info('Moving backup data to Cassandra data directory')
-    manifest = json.loads(node_backup.manifest)
-    for section in manifest:
+    # the restored data gets spread over all the data directories
+    restored_sizes = collections.Counter()
+    for section in node_backup.sections():
         fqtn = "{}.{}".format(section['keyspace'], section['columnfamily'])
         if fqtn not in fqtns_to_restore:
             logging.debug('Skipping restore for {}'.format(fqtn))
             continue
-        maybe_restore_section(section, download_dir, cassandra.root, in_place, keep_auth)
+        maybe_restore_section(section, download_dir, cassandra.root, in_place, keep_auth,
+                              other_data_dirs=cassandra.roots[1:], restored_sizes=restored_sizes)
 
     node_fqdn = storage.config.fqdn
     token_map_file = download_dir / 'tokenmap.json'
@@ -138,7 +149,7 @@ def restore_node_sstableloader(config, temp_dir, backup_name, in_place, keep_aut
             logging.error('No such backup')
             sys.exit(1)
 
-        fqtns_to_restore = get_fqtns_to_restore(keyspaces, tables, node_backup.manifest)
+        fqtns_to_restore = get_fqtns_to_restore(keyspaces, tables, node_backup.sections())
 
         if len(fqtns_to_restore) == 0:
             logging.error('There is nothing to restore')
@@ -210,7 +221,8 @@ def clean_path(p):
         subprocess.check_output(['sudo', '-u', p.owner(), 'rm', '-rf', str(p)])
 
 
-def maybe_restore_section(section, download_dir, cassandra_data_dir, in_place, keep_auth):
+def maybe_restore_section(section, download_dir, cassandra_data_dir, in_place, keep_auth, other_data_dirs=(),
+                          restored_sizes=None):
 
     # decide whether to restore files for this table or not
 
@@ -234,6 +246,13 @@ def maybe_restore_section(section, download_dir, cassandra_data_dir, in_place, k
     # not appending the column family name because mv later on copies the whole folder
     dst = cassandra_data_dir / section['keyspace'] / section['columnfamily']
 
+    # the table may have SSTables in the other data directories too, which must not be loaded with the restored ones
+    for other_data_dir in other_data_dirs:
+        other_dst = other_data_dir / section['keyspace'] / section['columnfamily']
+        if other_dst.exists():
+            logging.debug('Cleaning directory {}'.format(other_dst))
+            subprocess.check_output(['sudo', '-u', other_data_dir.owner(), 'rm', '-rf', str(other_dst)])
+
     # prepare the destination folder
     if dst.exists():
         logging.debug('Cleaning directory {}'.format(dst))
@@ -248,11 +267,56 @@ def maybe_restore_section(section, download_dir, cassandra_data_dir, in_place, k
         logging.debug("Skipping the actual restore of {}".format(section['columnfamily']))
         return
 
-    # restore the table
-    logging.debug('Restoring {} -> {}'.format(src, dst))
-    subprocess.check_output(['sudo', 'mv', str(src), str(dst)])
-    file_ownership = '{}:{}'.format(cassandra_data_dir.owner(), cassandra_data_dir.group())
-    subprocess.check_output(['sudo', 'chown', '-R', file_ownership, str(dst)])
+    if not other_data_dirs:
+        # restore the table
+        logging.debug('Restoring {} -> {}'.format(src, dst))
+        subprocess.check_output(['sudo', 'mv', str(src), str(dst)])
+        file_ownership = '{}:{}'.format(cassandra_data_dir.owner(), cassandra_data_dir.group())
+        subprocess.check_output(['sudo', 'chown', '-R', file_ownership, str(dst)])
+        return
+
+    # restore the table over all the data directories, so a single disk doesn't get all of it
+    data_dirs = [cassandra_data_dir] + list(other_data_dirs)
+    for data_dir, paths in spread_sstables(src, data_dirs, restored_sizes).items():
+        dst = data_dir / section['keyspace'] / section['columnfamily']
+        logging.debug('Restoring {} files of {} -> {}'.format(len(paths), src, dst))
+        subprocess.check_output(['sudo', '-u', data_dir.owner(), 'mkdir', '-p', str(dst)])
+        for i in range(0, len(paths), MOVE_BATCH_SIZE):
+            subprocess.check_output(['sudo', 'mv', '-t', str(dst)] + list(map(str, paths[i:i + MOVE_BATCH_SIZE])))
+        file_ownership = '{}:{}'.format(data_dir.owner(), data_dir.group())
+        subprocess.check_output(['sudo', 'chown', '-R', file_ownership, str(dst)])
+
+
+def spread_sstables(table_dir, data_dirs, restored_sizes=None):
+    """
+    Spreads the downloaded files of a table over the data directories of the node. The components of an SSTable stay
+    together, and the largest SSTables get placed first, each in the data directory which got the least data so far.
+
+    :param table_dir: The directory the files of the table got downloaded to
+    :param data_dirs: The data directories of the node
+    :param restored_sizes: A Counter of the bytes placed in each data directory, shared by the tables of a restore
+    :return: An OrderedDict of the paths to move to each data directory which gets some
+    """
+    restored_sizes = restored_sizes if restored_sizes is not None else collections.Counter()
+    generations = collections.OrderedDict()
+    for path in sorted(table_dir.iterdir()):
+        generations.setdefault(sstable_generation(path.name), []).append(path)
+
+    def size(paths):
+        return sum(
+            f.stat().st_size
+            for path in paths
+            for f in (path.rglob('*') if path.is_dir() else [path])
+            if f.is_file()
+        )
+
+    placement = collections.OrderedDict()
+    for generation_size, paths in sorted(((size(paths), paths) for paths in generations.values()),
+                                         key=lambda sized_paths: -sized_paths[0]):
+        data_dir = min(data_dirs, key=lambda d: restored_sizes[d])
+        restored_sizes[data_dir] += generation_size
+        placement.setdefault(data_dir, []).extend(paths)
+    return placement
 
 
 def get_node_tokens(node_fqdn, token_map_file):
@@ -280,12 +344,10 @@ def wait_for_seeds(config, seeds):
     logging.info('At least one seed is now up')
 
 
-def get_fqtns_to_restore(keep_keyspaces, keep_tables, manifest_str):
+def get_fqtns_to_restore(keep_keyspaces, keep_tables, sections):
 
     fqtns = set()
-    manifest = json.loads(manifest_str)
-
-    for section in manifest:
+    for section in sections:
         ks = section['keyspace']
         # in manifest, the table names have cfids, but from CLI we get it without
         # we need to take care and use both
@@ -26,6 +26,7 @@ from retrying import retry
 
 import medusa.index
 
+from medusa.backup_scope import BackupScope
 from medusa.storage.cluster_backup import ClusterBackup
 from medusa.storage.node_backup import NodeBackup
 from medusa.storage.google_storage import GoogleStorage
@@ -33,7 +34,20 @@ from medusa.storage.local_storage import LocalStorage
 from medusa.storage.s3_storage import S3Storage
 
 
-ManifestObject = collections.namedtuple('ManifestObject', ['path', 'size', 'MD5'])
+ManifestObject = collections.namedtuple('ManifestObject',
+                                        ['path', 'size', 'MD5', 'part_size', 'etag', 'codec', 'stored_size',
+                                         'archive', 'offset', 'checksum'])
+# Only objects uploaded in several parts have a part size, only compressed ones have a codec and a stored size.
+# The size and MD5 are the ones of the file, the ETag is the hash the storage provider gave to the stored object.
+# Files packed with others are stored at an offset of an archive object, instead of at their path.
+# Files hashed with another checksum than MD5 have its name, the MD5 field holding their digest.
+ManifestObject.__new__.__defaults__ = (None, None, None, None, None, None, None)
+
+# A file of a previous backup, copied within the storage instead of being uploaded again
+CachedObject = collections.namedtuple('CachedObject', ['path', 'manifest_item'])
+
+# Small files uploaded together as a single archive object named name
+PackedFiles = collections.namedtuple('PackedFiles', ['name', 'srcs'])
 
 
 def format_bytes_str(value):
@@ -157,6 +171,7 @@ class Storage(object):
             manifest_blob, schema_blob, tokenmap_blob = None, None, None
             started_blob, finished_blob = None, None
             started_timestamp, finished_timestamp = None, None
+            scope_blob = None
             if tokenmap_fqdn in blobs_by_backup[backup_name]:
                 manifest_blob = self.lookup_blob(blobs_by_backup, backup_name, tokenmap_fqdn, 'manifest')
                 schema_blob = self.lookup_blob(blobs_by_backup, backup_name, tokenmap_fqdn, 'schema')
@@ -164,6 +179,7 @@ class Storage(object):
                 started_blob = self.lookup_blob(blobs_by_backup, backup_name, tokenmap_fqdn, 'started')
                 finished_blob = self.lookup_blob(blobs_by_backup, backup_name, tokenmap_fqdn, 'finished')
                 differential_blob = self.lookup_blob(blobs_by_backup, backup_name, tokenmap_fqdn, 'differential')
+                scope_blob = self.lookup_blob(blobs_by_backup, backup_name, tokenmap_fqdn, 'scope')
                 # Should be removed after while. Here for backwards compatibility.
                 incremental_blob = self.lookup_blob(blobs_by_backup, backup_name, tokenmap_fqdn, 'incremental')
                 if started_blob is not None:
@@ -179,7 +195,9 @@ class Storage(object):
                             manifest_blob=manifest_blob, schema_blob=schema_blob, tokenmap_blob=tokenmap_blob,
                             started_timestamp=started_timestamp, started_blob=started_blob,
                             finished_timestamp=finished_timestamp, finished_blob=finished_blob,
-                            differential_blob=differential_blob if differential_blob is not None else incremental_blob)
+                            differential_blob=differential_blob if differential_blob is not None else incremental_blob,
+                            # the index knows about the scope of partial backups, the others hold every table
+                            scope_blob=scope_blob, scope=None if scope_blob is not None else BackupScope())
             node_backups.append(nb)
 
         # once we have all the backups, we sort them by their start time. we get oldest ones first
@@ -318,6 +336,20 @@ class Storage(object):
             logging.info('Node {} does not have latest backup'.format(fqdn))
             return None
 
+    def latest_node_backup_covering(self, *, fqdn, scope):
+        """
+        Get the latest finished backup of a node holding every table of the given BackupScope. Partial backups do not
+        move the latest backup marker, so they look through the index for the previous backup of their tables.
+        """
+        if not scope.is_partial:
+            return self.latest_node_backup(fqdn=fqdn)
+        covering_backups = [
+            node_backup
+            for node_backup in self.list_node_backups(fqdn=fqdn)
+            if node_backup.finished is not None and node_backup.scope.covers_scope(scope)
+        ]
+        return covering_backups[-1] if covering_backups else None
+
     def latest_cluster_backup(self, backup_index=None):
         """
         Get the latest backup attempted (successful or not)
@@ -15,15 +15,40 @@
 
 import abc
 import base64
+import hashlib
 import io
 import logging
 
 from libcloud.storage.types import ObjectDoesNotExistError
 from retrying import retry
 
+import medusa.config
+import medusa.rate_limiter
 import medusa.storage
+import medusa.storage.checksum
+import medusa.storage.compression
 import medusa.storage.concurrent
 
+from medusa.storage.connection_pool import ConnectionPool, DEFAULT_MAX_IDLE_SECONDS
+
+
+DEFAULT_MULTIPART_PART_SIZE = 32 * 1024 * 1024
+DEFAULT_MULTIPART_MAX_WORKERS = 4
+KEY_LAYOUTS = ('flat', 'hashed')
+# Objects of the hashed key layout start with this many hex digits of the MD5 of their path, that is 256 prefixes
+HASHED_KEY_PREFIX_LENGTH = 2
+
+
+def key_shard(path):
+    """
+    The prefix of the key of the object storing the file of the given path, in the hashed key layout
+    """
+    return hashlib.md5(str(path).encode('utf-8')).hexdigest()[:HASHED_KEY_PREFIX_LENGTH]
+
+
+def key_shards():
+    return ['{:0{}x}'.format(shard, HASHED_KEY_PREFIX_LENGTH) for shard in range(16 ** HASHED_KEY_PREFIX_LENGTH)]
+
 
 class AbstractStorage(abc.ABC):
 
@@ -31,27 +56,55 @@ class AbstractStorage(abc.ABC):
         self.config = config
         self.driver = self.connect_storage()
         self.bucket = self.driver.get_container(container_name=config.bucket_name)
+        # Connections used by the workers of all the transfers of the command
+        self.connection_pool = ConnectionPool(
+            self.connect_storage,
+            check=self.check_connection,
+            max_size=int(config.connection_pool_size or 0),
+            max_idle_seconds=int(config.connection_max_idle_seconds or DEFAULT_MAX_IDLE_SECONDS)
+        )
 
     @abc.abstractmethod
     def connect_storage(self):
         # Override for each child class
         pass
 
+    def check_connection(self, connection):
+        # Called before reusing a connection which stayed idle for a while
+        connection.get_container(container_name=self.config.bucket_name)
+        return True
+
     @retry(stop_max_attempt_number=7, wait_exponential_multiplier=10000, wait_exponential_max=120000)
-    def list_objects(self, path=None):
+    def list_objects(self, path=None, connection=None):
         # List objects in the bucket/container that have the corresponding prefix (emtpy means all objects)
         logging.debug("[Storage] Listing objects in {}".format(path if path is not None else 'everywhere'))
+        medusa.rate_limiter.get_limiter().request()
+        driver = connection or self.driver
 
         if path is None:
-            objects = self.driver.list_container_objects(self.bucket)
+            objects = driver.list_container_objects(self.bucket)
         else:
-            objects = self.driver.list_container_objects(self.bucket, ex_prefix=path)
+            objects = driver.list_container_objects(self.bucket, ex_prefix=path)
+
+        return objects
 
+    def list_data_objects(self, path, hashed=None):
+        """
+        Lists the objects storing the files under a path of the backups, whatever key layout they got stored with
+        :param hashed: whether to look for objects of the hashed key layout, which takes a listing per prefix. Defaults
+                       to doing so when the storage uses that layout.
+        """
+        objects = list(self.list_objects(str(path)))
+        if self.hashed_keys if hashed is None else hashed:
+            prefixes = ['{}/{}'.format(shard, path) for shard in key_shards()]
+            for shard_objects in medusa.storage.concurrent.list_objects(self, prefixes):
+                objects.extend(shard_objects)
         return objects
 
     @retry(stop_max_attempt_number=7, wait_exponential_multiplier=10000, wait_exponential_max=120000)
     def upload_blob_from_string(self, path, content, encoding="utf-8"):
         # Upload a string content to the provided path in the bucket
+        medusa.rate_limiter.get_limiter().request()
         obj = self.driver.upload_object_via_stream(
             io.BytesIO(bytes(content, encoding)),
             container=self.bucket,
@@ -59,15 +112,41 @@ class AbstractStorage(abc.ABC):
         )
         return medusa.storage.ManifestObject(obj.name, obj.size, obj.hash)
 
-    def download_blobs(self, src, dest):
+    @retry(stop_max_attempt_number=7, wait_exponential_multiplier=10000, wait_exponential_max=120000)
+    def upload_blob_from_file(self, path, src):
+        # Upload a local file as is to the provided path in the bucket, without reading it in memory
+        medusa.rate_limiter.get_limiter().request()
+        obj = self.driver.upload_object(str(src), container=self.bucket, object_name=str(path))
+        return medusa.storage.ManifestObject(obj.name, obj.size, obj.hash)
+
+    def upload_blobs_from_contents(self, blobs):
+        """
+        Uploads several small objects at once
+        :param blobs: a list of (path, content) pairs, the content being a string or the pathlib.Path of a local file
+        :return: a list of ManifestObject describing the uploaded objects
+        """
+        return medusa.storage.concurrent.upload_contents(self, blobs, self.bucket)
+
+    def download_blobs(self, src, dest, codecs=None):
         """
         Downloads a list of files from the remote storage system to the local storage
 
         :param src: a list of files to download from the remote storage system
         :param dest: the path where to download the objects locally
+        :param codecs: the codecs compressed files were stored with, by file, as recorded in the manifest
         :return:
         """
-        medusa.storage.concurrent.download_blobs(self, src, dest, self.bucket.name)
+        medusa.storage.concurrent.download_blobs(self, src, dest, self.bucket.name, codecs=codecs)
+
+    def download_blob_ranges(self, ranges, dest):
+        """
+        Downloads parts of objects from the remote storage system to the local storage, each to a file named after its
+        object
+
+        :param ranges: a list of (object, start, end) tuples, end being the offset after the last byte to download
+        :param dest: the path where to download the parts locally
+        """
+        medusa.storage.concurrent.download_blob_ranges(self, ranges, dest, self.bucket.name)
 
     def upload_blobs(self, src, dest):
         """
@@ -76,11 +155,153 @@ class AbstractStorage(abc.ABC):
         :param dest: the location where to upload the files in the target bucket (doesn't contain the filename)
         :return: a list of ManifestObject describing all the uploaded files
         """
-        return medusa.storage.concurrent.upload_blobs(self, src, dest, self.bucket)
+        return medusa.storage.concurrent.upload_blobs(self, src, dest, self.bucket,
+                                                      single_pass=self.single_pass_upload)
+
+    def upload_files(self, transfers):
+        """
+        Uploads files going to different locations in the target bucket through a single pool of workers
+        :param transfers: an iterable of (file, location) pairs, the location not containing the file name
+        :return: a generator of (location, ManifestObject) pairs, in the order in which the uploads complete
+        """
+        return medusa.storage.concurrent.upload_files(self, transfers, self.bucket,
+                                                      single_pass=self.single_pass_upload,
+                                                      processes=self.transfer_processes)
+
+    @property
+    def key_layout(self):
+        layout = self.config.key_layout or 'flat'
+        if layout not in KEY_LAYOUTS:
+            raise ValueError('Unknown key layout {}, expected one of {}'.format(layout, ', '.join(KEY_LAYOUTS)))
+        return layout
+
+    @property
+    def hashed_keys(self):
+        return self.key_layout == 'hashed'
+
+    def object_key(self, dest, name):
+        """
+        The key of the object storing a file uploaded to dest. In the hashed key layout, it starts with a prefix derived
+        from the path of the file, so that the files of a table are not all stored under the same prefix.
+        """
+        path = '{}/{}'.format(dest, name)
+        if self.hashed_keys:
+            return '{}/{}'.format(key_shard(path), path)
+        return path
+
+    @property
+    def single_pass_upload(self):
+        return medusa.config.evaluate_boolean(self.config.single_pass_upload)
+
+    @property
+    def transfer_processes(self):
+        # 0 uploads files from threads of the main process
+        return int(self.config.transfer_processes or 0)
+
+    @property
+    def pack_max_file_size(self):
+        # 0 uploads every file as an object of its own
+        return int(self.config.pack_max_file_size or 0)
+
+    @property
+    def checksum(self):
+        # The checksum of the files getting uploaded, the ones already stored keep the one they got
+        return medusa.storage.checksum.get_checksum(self.config.checksum_algorithm)
+
+    @property
+    def compression_codec(self):
+        if not self.config.compression_codec or self.config.compression_codec == 'none':
+            return None
+        return medusa.storage.compression.get_codec(self.config.compression_codec)
+
+    def codec_for(self, src):
+        """
+        Returns the codec to compress a file with before storing it, or None to store it as is
+        """
+        codec = self.compression_codec
+        if codec is None or medusa.storage.compression.is_compressed(src):
+            return None
+        return codec
+
+    @property
+    def multipart_threshold(self):
+        # 0 disables multipart uploads
+        return int(self.config.multipart_threshold or 0)
+
+    @property
+    def multipart_part_size(self):
+        return int(self.config.multipart_part_size or DEFAULT_MULTIPART_PART_SIZE)
+
+    @property
+    def multipart_max_workers(self):
+        return int(self.config.multipart_max_workers or DEFAULT_MULTIPART_MAX_WORKERS)
+
+    @property
+    def supports_multipart(self):
+        # Backends able to upload a file in several parts override initiate_multipart() and the methods following it
+        return False
+
+    def uses_multipart(self, src):
+        return self.supports_multipart and 0 < self.multipart_threshold <= src.stat().st_size
+
+    def initiate_multipart(self, connection, bucket, object_name):
+        """
+        Starts the upload of an object in several parts
+        :return: the id of the upload
+        """
+        raise NotImplementedError()
+
+    def upload_part(self, connection, bucket, object_name, upload_id, part_number, offset, data, digest):
+        """
+        Uploads one part of an object. Parts are numbered from 1.
+        :param offset: the position of the part in the object
+        :param digest: the binary MD5 of the part
+        :return: the identifier of the part needed to complete the upload
+        """
+        raise NotImplementedError()
+
+    def complete_multipart(self, connection, bucket, object_name, upload_id, parts):
+        """
+        Assembles the uploaded parts into the object
+        :param parts: a list of (part number, part identifier) pairs, ordered by part number
+        :return: the uploaded object
+        """
+        raise NotImplementedError()
+
+    def abort_multipart(self, connection, bucket, object_name, upload_id):
+        raise NotImplementedError()
+
+    def copy_object(self, connection, bucket, src_path, object_name):
+        """
+        Copies an object within the storage, without downloading it
+        :param src_path: the path of the object to copy, as returned by get_cache_path()
+        :return: the new object
+        """
+        raise NotImplementedError()
+
+    @property
+    def supports_multipart_copy(self):
+        # Backends able to copy an object in several parts override upload_part_copy()
+        return False
+
+    def uses_multipart_copy(self, size):
+        return self.supports_multipart_copy and 0 < self.multipart_threshold <= size
+
+    def upload_part_copy(self, connection, bucket, object_name, upload_id, part_number, src_path, offset, length):
+        """
+        Copies length bytes of an object, from offset, into one part of a multipart upload
+        :return: the identifier of the part needed to complete the upload
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def is_multipart_etag(object_hash):
+        return '-' in str(object_hash)
 
     def get_blob(self, path):
         try:
             logging.debug("[Storage] Getting object {}".format(path))
+            medusa.rate_limiter.get_limiter().request()
             return self.driver.get_object(self.bucket.name, str(path))
         except ObjectDoesNotExistError:
             return None
@@ -110,14 +331,48 @@ class AbstractStorage(abc.ABC):
         buffer = io.BytesIO()
         stream = blob.as_stream()
 
-        for chunk in stream:
+        for chunk in medusa.rate_limiter.get_limiter().throttle(stream):
             buffer.write(chunk)
 
         return buffer.getvalue()
 
+    @staticmethod
+    def read_blob_first_line(blob, encoding="utf-8"):
+        """
+        Reads a blob until the end of its first line, leaving the rest of it on the storage
+        """
+        logging.debug("[Storage] Reading first line of blob {}...".format(blob.name))
+        buffer = io.BytesIO()
+        for chunk in medusa.rate_limiter.get_limiter().throttle(blob.as_stream()):
+            end = chunk.find(b'\n')
+            if end >= 0:
+                buffer.write(chunk[:end + 1])
+                break
+            buffer.write(chunk)
+        return buffer.getvalue().decode(encoding)
+
     @staticmethod
     def hashes_match(manifest_hash, object_hash):
-        return base64.b64decode(manifest_hash).hex() == str(object_hash) or manifest_hash == str(object_hash)
+        if manifest_hash == str(object_hash):
+            return True
+        try:
+            return base64.b64decode(manifest_hash).hex() == str(object_hash)
+        except ValueError:
+            return False
+
+    @classmethod
+    def object_hash_matches(cls, manifest_item, object_hash):
+        """
+        Checks the hash of a stored object against the manifest entry of that object. Objects uploaded in several
+        parts are checked against the ETag recorded when they got uploaded, their MD5 being the one of their content,
+        as are the files hashed with another checksum than MD5.
+        """
+        expected_hash = manifest_item.get('etag') or manifest_item['MD5']
+        return cls.hashes_match(expected_hash, object_hash)
+
+    def reports_md5(self, blob):
+        # Multipart uploads get an ETag which is not the MD5 of the object
+        return not self.is_multipart_etag(blob.hash)
 
     def get_path_prefix(self, path):
         return ""
@@ -132,4 +387,5 @@ class AbstractStorage(abc.ABC):
 
     @retry(stop_max_attempt_number=7, wait_exponential_multiplier=10000, wait_exponential_max=120000)
     def delete_object(self, object):
+        medusa.rate_limiter.get_limiter().request()
         self.driver.delete_object(object)
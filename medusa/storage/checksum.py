@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+import struct
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+DEFAULT_CHECKSUM = 'md5'
+# Checksums needing a package which may not be installed, and the package providing them
+OPTIONAL_CHECKSUMS = {'crc32c': 'crc32c', 'xxhash': 'xxhash>=2.0.0'}
+
+
+class Checksum(object):
+    """
+    Computes the digests which tell whether a file changed since the previous backup. Checksums are registered with
+    register_checksum() and referred to by their name in the configuration and in the manifests, files without a
+    checksum in the manifest having an MD5.
+
+    Only MD5 digests can be checked against the hash storage providers give to objects. Files hashed with other
+    checksums also get their MD5 computed while they are uploaded to check the upload, and later get checked against
+    the hash the provider gave to their object.
+    """
+    name = None
+
+    @property
+    def recorded_name(self):
+        return recorded_name(self.name)
+
+    def new(self):
+        # An object with update(data) and digest() methods, like the ones of hashlib
+        raise NotImplementedError()
+
+    @staticmethod
+    def encode(digest):
+        return base64.b64encode(digest).decode('UTF-8')
+
+    def digest(self, data):
+        checksum = self.new()
+        checksum.update(data)
+        return self.encode(checksum.digest())
+
+
+class Md5Checksum(Checksum):
+    name = 'md5'
+
+    def new(self):
+        return hashlib.md5()
+
+
+class Blake2Checksum(Checksum):
+    name = 'blake2'
+
+    def new(self):
+        # A digest of the size of an MD5 is plenty to detect changes
+        return hashlib.blake2b(digest_size=16)
+
+
+class Crc32cHash(object):
+    """
+    CRC32C with the interface of hashlib. The digest is big-endian, like the CRC32C GCS gives to objects.
+    """
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = crc32c.crc32c(data, self._value)
+
+    def digest(self):
+        return struct.pack('>I', self._value)
+
+
+class Crc32cChecksum(Checksum):
+    name = 'crc32c'
+
+    def new(self):
+        return Crc32cHash()
+
+
+class XxhashChecksum(Checksum):
+    name = 'xxhash'
+
+    def new(self):
+        return xxhash.xxh3_128()
+
+
+CHECKSUMS = {}
+
+
+def recorded_name(name):
+    """
+    The name of a checksum as recorded in the manifests, where files hashed with MD5 have none
+    """
+    return None if name in (None, DEFAULT_CHECKSUM) else name
+
+
+def register_checksum(checksum):
+    CHECKSUMS[checksum.name] = checksum
+
+
+def is_available(name=None):
+    return (name or DEFAULT_CHECKSUM) in CHECKSUMS
+
+
+def get_checksum(name=None):
+    """
+    :param name: The name of the checksum, None for the one of files which have none in the manifest
+    """
+    name = name or DEFAULT_CHECKSUM
+    try:
+        return CHECKSUMS[name]
+    except KeyError:
+        if name in OPTIONAL_CHECKSUMS:
+            raise ValueError('The {} checksum needs the {} package to be installed'.format(
+                name, OPTIONAL_CHECKSUMS[name]))
+        raise ValueError('Unknown checksum {}'.format(name))
+
+
+register_checksum(Md5Checksum())
+if hasattr(hashlib, 'blake2b'):
+    register_checksum(Blake2Checksum())
+if crc32c is not None:
+    register_checksum(Crc32cChecksum())
+if xxhash is not None and hasattr(xxhash, 'xxh3_128'):
+    register_checksum(XxhashChecksum())
@@ -49,6 +49,10 @@ class ClusterBackup(object):
         else:
             return None
 
+    @property
+    def scope(self):
+        return self._first_nodebackup.scope
+
     @property
     def tokenmap(self):
         if self._tokenmap is None:
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import lzma
+import os
+import pathlib
+import zlib
+
+
+class Codec(object):
+    """
+    Compresses the files of backups while they are streamed to the storage. Codecs are registered with
+    register_codec() and referred to by their name in the configuration and in the manifests.
+    """
+    name = None
+
+    def compressor(self):
+        # An object with compress(data) and flush() methods, like the ones of zlib
+        raise NotImplementedError()
+
+    def decompressor(self):
+        # An object with a decompress(data) method, like the ones of zlib
+        raise NotImplementedError()
+
+    def compress(self, chunks):
+        compressor = self.compressor()
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        compressed = compressor.flush()
+        if compressed:
+            yield compressed
+
+    def decompress(self, chunks):
+        decompressor = self.decompressor()
+        for chunk in chunks:
+            decompressed = decompressor.decompress(chunk)
+            if decompressed:
+                yield decompressed
+        if hasattr(decompressor, 'flush'):
+            decompressed = decompressor.flush()
+            if decompressed:
+                yield decompressed
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+
+    def compressor(self):
+        return zlib.compressobj(6)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+
+class LzmaCodec(Codec):
+    name = 'lzma'
+
+    def compressor(self):
+        return lzma.LZMACompressor(preset=1)
+
+    def decompressor(self):
+        return lzma.LZMADecompressor()
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError('Unknown compression codec {}'.format(name))
+
+
+register_codec(ZlibCodec())
+register_codec(LzmaCodec())
+
+
+def is_compressed(src):
+    """
+    Tells whether an SSTable component is already compressed by Cassandra, in which case compressing it again would
+    only cost CPU. The Data.db files of compressed tables come with a CompressionInfo.db file.
+    """
+    src = pathlib.Path(src)
+    if not src.name.endswith('-Data.db'):
+        return False
+    compression_info = src.with_name(src.name[:-len('Data.db')] + 'CompressionInfo.db')
+    return os.path.exists(str(compression_info))
+
+
+def decompress_file(path, codec):
+    """
+    Decompresses a downloaded file in place
+    """
+    path = pathlib.Path(path)
+    tmp_path = path.with_name('{}.decompressing'.format(path.name))
+    with open(str(path), 'rb') as src, open(str(tmp_path), 'wb') as dst:
+        for chunk in codec.decompress(iter(lambda: src.read(1024 * 1024), b'')):
+            dst.write(chunk)
+    os.replace(str(tmp_path), str(path))
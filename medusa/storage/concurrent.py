@@ -13,29 +13,170 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
+import collections
 import concurrent.futures
+import functools
+import hashlib
+import heapq
+import itertools
 import logging
 import multiprocessing
+import operator
 import os
 import pathlib
-import threading
 
 from libcloud.storage.types import ObjectDoesNotExistError
+from retrying import retry
 
 import medusa
+import medusa.page_cache
+import medusa.rate_limiter
+import medusa.storage.compression
+import medusa.storage.packing
+
+
+STREAM_CHUNK_SIZE_BYTES = 1024 * 1024
+QUEUE_DEPTH_PER_WORKER = 4
+
+# S3 limits, which are also the ones used for the other backends
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+MULTIPART_PART_RETRIES = 5
+
+
+def execute_bounded(executor, func, iterables, max_pending, group=None, max_per_group=0):
+    """
+    Submits func(item) to the executor for every item, never having more than max_pending items queued or running.
+
+    :param group: Returns the group of an item, for instance the disk a transfer reads from
+    :param max_per_group: How many items of a group can be queued or running at once, 0 for no limit. Items of the
+                          None group are not limited. Items of a full group are held back, and the following ones
+                          submitted in the meantime.
+    :return: A generator of (item, result) pairs, in the order in which the items complete
+    """
+    items = iter(iterables)
+    pending = {}
+    held = []
+    per_group = collections.Counter()
+    exhausted = False
+
+    def has_room(item_group):
+        return not max_per_group or item_group is None or per_group[item_group] < max_per_group
+
+    def submit(item, item_group):
+        per_group[item_group] += 1
+        pending[executor.submit(func, item)] = item, item_group
+
+    while True:
+        for item, item_group in list(held):
+            if len(pending) >= max_pending:
+                break
+            if has_room(item_group):
+                held.remove((item, item_group))
+                submit(item, item_group)
+        while not exhausted and len(pending) < max_pending:
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            item_group = group(item) if max_per_group else None
+            if has_room(item_group):
+                submit(item, item_group)
+            else:
+                held.append((item, item_group))
+        if not pending:
+            break
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            item, item_group = pending.pop(future)
+            per_group[item_group] -= 1
+            yield item, future.result()
+
+
+def transfer_size(src):
+    """
+    Size of the data to transfer for a local file, or for a CachedObject copied from a previous backup
+    """
+    if isinstance(src, medusa.storage.CachedObject):
+        return int(src.manifest_item['size'])
+    if isinstance(src, medusa.storage.PackedFiles):
+        return sum(transfer_size(packed_src) for packed_src in src.srcs)
+    return os.path.getsize(str(src))
+
+
+def transfer_device(src):
+    """
+    The device a transfer reads from, or None for a CachedObject which gets copied within the storage
+    """
+    if isinstance(src, medusa.storage.CachedObject):
+        return None
+    if isinstance(src, medusa.storage.PackedFiles):
+        return transfer_device(src.srcs[0])
+    return os.stat(str(src)).st_dev
+
+
+def expected_makespan(sizes, workers):
+    """
+    Simulates a queue of transfers of the given sizes feeding workers which each take the next transfer as soon as
+    they are done with the previous one.
+
+    :return: The number of bytes transferred by the busiest worker, which bounds how long the whole job takes
+    """
+    loads = [0] * max(1, workers)
+    for size in sizes:
+        heapq.heappush(loads, heapq.heappop(loads) + size)
+    return max(loads)
+
+
+def schedule_largest_first(items, workers, size=transfer_size, key=lambda item: item, device=transfer_device):
+    """
+    Orders transfers from the largest to the smallest, so a huge Data.db file is not the last to start while every
+    other worker is idle. The small components come last, and fill the workers freed by the large ones.
+
+    Files of each disk make a lane, and the lanes take turns, so the workers read from all the disks of a node with
+    several data directories at once instead of queueing on the one holding the largest files.
+
+    :param items: The transfers to order
+    :param workers: The number of workers sharing the transfers
+    :param size: Returns the size of a file
+    :param key: Returns the file of an item
+    :param device: Returns the disk a file is read from
+    :return: The list of transfers in the order to submit them
+    """
+    lanes = collections.OrderedDict()
+    for item_size, item in sorted(((size(key(item)), item) for item in items), key=lambda sized_item: -sized_item[0]):
+        lanes.setdefault(device(key(item)), []).append((item_size, item))
+    if len(lanes) > 1:
+        logging.info('Reading from {} disks in parallel lanes'.format(len(lanes)))
+    sized_items = [
+        sized_item
+        for turn in itertools.zip_longest(*lanes.values())
+        for sized_item in turn
+        if sized_item is not None
+    ]
+    sizes = [item_size for item_size, _ in sized_items]
+    if sizes:
+        makespan = expected_makespan(sizes, workers)
+        # Nothing can finish before the largest file is transferred, nor before each worker got an even share
+        lower_bound = max(max(sizes), sum(sizes) / max(1, workers))
+        logging.info('Scheduled {} files ({}) on {} workers, the busiest one transferring {} ({:.0%} efficiency)'
+                     .format(len(sizes), medusa.storage.format_bytes_str(sum(sizes)), workers,
+                             medusa.storage.format_bytes_str(makespan), lower_bound / makespan if makespan else 1))
+    return [item for _, item in sized_items]
 
 
 class StorageJob:
     """
-    Manages concurrency and storage connection pools for tasks like uploading or downloading files. The libcloud
-    drivers are not thread safe, so each thread will a separate connection. If the function executed by StorageJob
-    uses any shared state, then it is the responsibility of that function to manage concurrent access to that state.
+    Manages concurrency for tasks like uploading or downloading files. The libcloud drivers are not thread safe, so
+    each thread takes its own connection from the connection pool of the storage, which outlives the job. If the
+    function executed by StorageJob uses any shared state, then it is the responsibility of that function to manage
+    concurrent access to that state.
     """
     def __init__(self, storage, func, max_workers=None):
         self.storage = storage
-        self.lock = threading.Lock()
         self.func = func
-        self.connection_pool = []
         if max_workers is None:
             self.max_workers = multiprocessing.cpu_count()
         else:
@@ -45,20 +186,25 @@ class StorageJob:
         with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
             return list(executor.map(self.with_storage, iterables))
 
+    def execute_as_completed(self, iterables, max_pending=None, group=None, max_per_group=0):
+        """
+        Like execute, but yields (item, result) pairs as soon as each item is processed. The items are pulled lazily
+        from iterables, so callers can keep producing work while the workers are busy. Items of a same group, as
+        returned by group, are not given more than max_per_group workers at once.
+        """
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            for item, result in execute_bounded(executor, self.with_storage, iterables,
+                                                max_pending or self.max_workers * QUEUE_DEPTH_PER_WORKER,
+                                                group, max_per_group):
+                yield item, result
+
     def with_storage(self, iterable):
-        with self.lock:
-            if not self.connection_pool:
-                connection = self.storage.connect_storage()
-            else:
-                connection = self.connection_pool.pop()
-        try:
+        medusa.rate_limiter.get_limiter().request()
+        with self.storage.connection_pool.connection() as connection:
             return self.func(connection, iterable)
-        finally:
-            with self.lock:
-                self.connection_pool.append(connection)
 
 
-def upload_blobs(storage, src, dest, bucket, max_workers=None):
+def upload_blobs(storage, src, dest, bucket, max_workers=None, single_pass=False):
     """
     Uploads a list of files from local storage concurrently to the remote storage.
 
@@ -67,36 +213,478 @@ def upload_blobs(storage, src, dest, bucket, max_workers=None):
     :param dest: The location where to upload the files in the target bucket (doesn't contain the filename)
     :param bucket: The remote bucket in which files will be stored
     :param max_workers: The max number of worker threads to use. Defaults to the number of CPUs.
+    :param single_pass: Compute the MD5 of the files while they are being uploaded instead of reading them twice
     :return: A list of ManifestObject describing all the uploaded files
     """
-    job = StorageJob(storage,
-                     lambda connection, src_file: __upload_file(connection, src_file, dest, bucket),
-                     max_workers)
-    return job.execute(list(src))
+    src = schedule_largest_first(src, max_workers or multiprocessing.cpu_count())
+    if single_pass:
+        job = StorageJob(storage,
+                         lambda connection, src_file: __upload_file_single_pass(storage, connection, src_file, dest,
+                                                                                bucket),
+                         max_workers)
+    else:
+        job = StorageJob(storage,
+                         lambda connection, src_file: __upload_file(storage, connection, src_file, dest, bucket),
+                         max_workers)
+    return job.execute(src)
 
 
-def __upload_file(connection, src, dest, bucket):
+def upload_files(storage, transfers, bucket, max_workers=None, single_pass=False, processes=None):
+    """
+    Uploads files going to different locations through a single pool of workers, which stays busy until the last
+    file is uploaded instead of draining after each location.
+
+    :param storage: An AbstractStorage instance, needed to create a connection pool
+    :param transfers: An iterable of (file, location) pairs. They get uploaded from the largest file to the smallest.
+    :param bucket: The remote bucket in which files will be stored
+    :param max_workers: The max number of worker threads to use. Defaults to the number of CPUs.
+    :param single_pass: Compute the MD5 of the files while they are being uploaded instead of reading them twice
+    :param processes: Upload the files from that many worker processes instead of threads
+    :return: A generator of (location, ManifestObject) pairs, in the order in which the uploads complete
+    """
+    workers = processes or max_workers or multiprocessing.cpu_count()
+    transfers = schedule_largest_first(transfers, workers, key=operator.itemgetter(0))
+    max_per_device = max_workers_per_device(transfers, workers)
+    if processes:
+        yield from __upload_files_in_processes(storage, transfers, processes, single_pass, max_per_device)
+        return
+
+    def upload(connection, transfer):
+        src, dest = transfer
+        if single_pass:
+            return __upload_file_single_pass(storage, connection, src, dest, bucket)
+        return __upload_file(storage, connection, src, dest, bucket)
+
+    job = StorageJob(storage, upload, max_workers)
+    for (src, dest), result in job.execute_as_completed(transfers, group=transfer_device_of,
+                                                        max_per_group=max_per_device):
+        for manifest_object in __manifest_objects(src, result):
+            yield dest, manifest_object
+
+
+def transfer_device_of(transfer):
+    return transfer_device(transfer[0])
+
+
+def max_workers_per_device(transfers, workers):
+    """
+    Splits the workers evenly between the disks the transfers read from, so the large files of a disk can't take up
+    all of them while the other disks wait.
+
+    :return: The number of workers a disk gets, 0 for no limit when there is a single disk
+    """
+    devices = {transfer_device_of(transfer) for transfer in transfers} - {None}
+    if len(devices) < 2:
+        return 0
+    return -(-workers // len(devices))
+
+
+def __upload_files_in_processes(storage, transfers, processes, single_pass, max_per_device=0):
+    """
+    Uploads files from a pool of worker processes, so hashing, compressing, signing and encrypting the requests of
+    each worker is not serialized on the GIL of a single process. Each worker process connects to the storage on its
+    own, the ManifestObjects come back through the result queue of the pool.
+    """
+    logging.info("Uploading files from {} worker processes".format(processes))
+    upload = functools.partial(_upload_in_worker_process, storage.config, processes, single_pass)
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        for (src, dest), result in execute_bounded(executor, upload, transfers, processes * QUEUE_DEPTH_PER_WORKER,
+                                                   transfer_device_of, max_per_device):
+            for manifest_object in __manifest_objects(src, result):
+                yield dest, manifest_object
+
+
+def __manifest_objects(src, result):
+    # PackedFiles give a ManifestObject for each of the files packed
+    return result if isinstance(src, medusa.storage.PackedFiles) else [result]
+
+
+# The storage of a worker process, set up by the first file it uploads
+_worker_storage = None
+
+
+def _upload_in_worker_process(storage_config, processes, single_pass, transfer):
+    """
+    This function is called in the worker processes of __upload_files_in_processes, one file at a time.
+    """
+    global _worker_storage
+    if _worker_storage is None:
+        # The workers share the limits of the backup
+        medusa.rate_limiter.configure(storage_config, 'backup', workers=processes)
+        medusa.page_cache.configure(storage_config)
+        _worker_storage = medusa.storage.Storage(config=storage_config).storage_driver
+
+    src, dest = transfer
+    medusa.rate_limiter.get_limiter().request()
+    with _worker_storage.connection_pool.connection() as connection:
+        if single_pass:
+            return __upload_file_single_pass(_worker_storage, connection, src, dest, _worker_storage.bucket)
+        return __upload_file(_worker_storage, connection, src, dest, _worker_storage.bucket)
+
+
+def __upload_file(storage, connection, src, dest, bucket):
     """
     This function is called by StorageJob. It may be called concurrently by multiple threads.
 
+    :param storage: The AbstractStorage the file is uploaded to
     :param connection: A storage connection which is created and managed by StorageJob
     :param src: The file to upload
     :param dest: The location where to upload the file
     :param bucket: The remote bucket where the file will be stored
-    :return: A ManifestObject describing the uploaded file
+    :return: A ManifestObject describing the uploaded file, or a list of them for PackedFiles
     """
+    if isinstance(src, medusa.storage.CachedObject):
+        return __copy_object(storage, connection, src, dest, bucket)
+    if isinstance(src, medusa.storage.PackedFiles):
+        return __upload_packed_files(storage, connection, src, dest, bucket)
     if not isinstance(src, pathlib.Path):
         src = pathlib.Path(src)
+    codec = storage.codec_for(src)
+    if codec is not None:
+        return __upload_file_compressed(storage, connection, src, dest, bucket, codec)
+    if storage.uses_multipart(src):
+        return __upload_file_multipart(storage, connection, src, dest, bucket)
+    if storage.checksum.recorded_name is not None:
+        # The driver only gives the MD5 of the object, the file gets hashed with the configured checksum on the way
+        return __upload_file_single_pass(storage, connection, src, dest, bucket)
+    if medusa.rate_limiter.get_limiter().bytes_per_second:
+        # The driver sends the whole file at once, at line rate: files sent at a limited bandwidth get streamed
+        # through the limiter a chunk at a time instead
+        return __upload_file_single_pass(storage, connection, src, dest, bucket)
     logging.info("Uploading {}".format(src))
     obj = connection.upload_object(
         os.fspath(src),
         container=bucket,
-        object_name=str("{}/{}".format(dest, src.name))
+        object_name=storage.object_key(dest, src.name)
     )
+    medusa.page_cache.drop_cache(src)
     return medusa.storage.ManifestObject(obj.name, obj.size, obj.hash)
 
 
-def download_blobs(storage, src, dest, bucket_name, max_workers=None):
+def __upload_file_single_pass(storage, connection, src, dest, bucket):
+    """
+    This function is called by StorageJob. It may be called concurrently by multiple threads.
+
+    Streams the file to the remote storage while computing its digest. The MD5 of the file gets checked against the
+    hash reported by the storage provider before handing out the ManifestObject. Files hashed with another checksum
+    get their MD5 computed along with it for that check, and keep the hash of their object to be verified against
+    later.
+
+    :param storage: The AbstractStorage the file is uploaded to
+    :param connection: A storage connection which is created and managed by StorageJob
+    :param src: The file to upload
+    :param dest: The location where to upload the file
+    :param bucket: The remote bucket where the file will be stored
+    :return: A ManifestObject describing the uploaded file, or a list of them for PackedFiles
+    """
+    if isinstance(src, medusa.storage.CachedObject):
+        return __copy_object(storage, connection, src, dest, bucket)
+    if isinstance(src, medusa.storage.PackedFiles):
+        return __upload_packed_files(storage, connection, src, dest, bucket)
+    if not isinstance(src, pathlib.Path):
+        src = pathlib.Path(src)
+    codec = storage.codec_for(src)
+    if codec is not None:
+        return __upload_file_compressed(storage, connection, src, dest, bucket, codec)
+    if storage.uses_multipart(src):
+        # Multipart uploads compute the MD5 of the file while reading its parts already
+        return __upload_file_multipart(storage, connection, src, dest, bucket)
+    logging.info("Uploading {}".format(src))
+    checksum = storage.checksum
+    digest = checksum.new()
+    stored_digest = hashlib.md5() if checksum.recorded_name is not None else digest
+    with medusa.page_cache.SequentialReader(src) as f:
+        chunks = __read_and_digest(f, digest)
+        if stored_digest is not digest:
+            chunks = __digest(chunks, stored_digest)
+        obj = connection.upload_object_via_stream(
+            iterator=medusa.rate_limiter.get_limiter().throttle(chunks),
+            container=bucket,
+            object_name=storage.object_key(dest, src.name)
+        )
+    file_digest = checksum.encode(digest.digest())
+    md5 = base64.b64encode(stored_digest.digest()).decode('UTF-8')
+
+    if not storage.reports_md5(obj):
+        logging.debug("Storage does not report the MD5 of {}, skipping its verification".format(obj.name))
+        if checksum.recorded_name is None:
+            return medusa.storage.ManifestObject(obj.name, obj.size, obj.hash)
+    elif not storage.hashes_match(md5, obj.hash):
+        raise IOError("Checksum mismatch for {}: computed {} while uploading but storage reports {}".format(
+            obj.name, md5, obj.hash))
+
+    if checksum.recorded_name is not None:
+        return medusa.storage.ManifestObject(obj.name, obj.size, file_digest, etag=str(obj.hash),
+                                             checksum=checksum.recorded_name)
+    return medusa.storage.ManifestObject(obj.name, obj.size, md5)
+
+
+def __upload_packed_files(storage, connection, src, dest, bucket):
+    """
+    Uploads small files as a single archive object, the files being stored one after the other in it.
+
+    :param src: The PackedFiles to upload
+    :return: A list of ManifestObjects describing the files, with the archive they are stored in and their offset
+    """
+    logging.info("Uploading {} files packed in {}".format(len(src.srcs), src.name))
+    checksum = storage.checksum
+    content, members = medusa.storage.packing.pack(src.srcs, checksum)
+    medusa.rate_limiter.get_limiter().consume(len(content))
+    obj = connection.upload_object_via_stream(
+        iterator=iter([content]),
+        container=bucket,
+        object_name=storage.object_key(dest, src.name)
+    )
+    if storage.reports_md5(obj) and not storage.hashes_match(hashlib.md5(content).hexdigest(), obj.hash):
+        raise IOError("Checksum mismatch for {}: storage reports {}".format(obj.name, obj.hash))
+    return [
+        medusa.storage.ManifestObject(str("{}/{}".format(dest, packed_src.name)), size, digest, archive=obj.name,
+                                      offset=offset, checksum=checksum.recorded_name)
+        for packed_src, offset, size, digest in members
+    ]
+
+
+def __upload_file_compressed(storage, connection, src, dest, bucket, codec):
+    """
+    Streams the file to the remote storage through a compressor, computing the digest of the file and the MD5 of the
+    compressed object on the way. The latter gets checked against the hash reported by the storage provider.
+
+    :param codec: The medusa.storage.compression.Codec compressing the file
+    :return: A ManifestObject describing the uploaded file, with the codec and the size of the compressed object
+    """
+    logging.info("Uploading {} compressed with {}".format(src, codec.name))
+    checksum = storage.checksum
+    digest = checksum.new()
+    stored_checksum = hashlib.md5()
+    with medusa.page_cache.SequentialReader(src) as f:
+        chunks = codec.compress(__read_and_digest(f, digest))
+        obj = connection.upload_object_via_stream(
+            iterator=medusa.rate_limiter.get_limiter().throttle(__digest(chunks, stored_checksum)),
+            container=bucket,
+            object_name=storage.object_key(dest, src.name)
+        )
+
+    if storage.reports_md5(obj) and not storage.hashes_match(stored_checksum.hexdigest(), obj.hash):
+        raise IOError("Checksum mismatch for {}: computed {} while uploading but storage reports {}".format(
+            obj.name, stored_checksum.hexdigest(), obj.hash))
+
+    return medusa.storage.ManifestObject(obj.name, src.stat().st_size, checksum.encode(digest.digest()),
+                                         etag=str(obj.hash), codec=codec.name, stored_size=obj.size,
+                                         checksum=checksum.recorded_name)
+
+
+def __upload_file_multipart(storage, connection, src, dest, bucket):
+    """
+    Uploads a large file in several parts sent concurrently, each over its own connection, so the transfer is not
+    limited to a single stream and a failure only retries the part it happened on.
+
+    The file is read sequentially, once, to compute both its digest and the MD5 of each part. Only as many parts as
+    there are workers are kept in memory at a time.
+
+    :param storage: The AbstractStorage the file is uploaded to
+    :param connection: The storage connection used to start and complete the upload
+    :param src: The file to upload
+    :param dest: The location where to upload the file
+    :param bucket: The remote bucket where the file will be stored
+    :return: A ManifestObject describing the uploaded file, with the part size and the ETag of the object
+    """
+    object_name = storage.object_key(dest, src.name)
+    part_size = multipart_part_size(src.stat().st_size, storage.multipart_part_size)
+    logging.info("Uploading {} in parts of {} bytes".format(src, part_size))
+    checksum = storage.checksum
+    digest = checksum.new()
+    part_digests = []
+    limiter = medusa.rate_limiter.get_limiter()
+
+    def parts():
+        with medusa.page_cache.SequentialReader(src) as f:
+            part_number = 1
+            while True:
+                data = f.read(part_size)
+                if not data:
+                    break
+                limiter.consume(len(data))
+                digest.update(data)
+                part_digests.append(hashlib.md5(data).digest())
+                yield part_number, (part_number - 1) * part_size, data, part_digests[-1]
+                part_number += 1
+
+    upload_id = storage.initiate_multipart(connection, bucket, object_name)
+    try:
+        job = StorageJob(storage,
+                         lambda part_connection, part: __upload_part(storage, part_connection, bucket, object_name,
+                                                                     upload_id, *part),
+                         storage.multipart_max_workers)
+        part_etags = {part[0]: part_etag for part, part_etag in job.execute_as_completed(parts(), job.max_workers)}
+        obj = storage.complete_multipart(connection, bucket, object_name, upload_id, sorted(part_etags.items()))
+    except Exception:
+        logging.warning("Aborting the multipart upload of {}".format(src))
+        storage.abort_multipart(connection, bucket, object_name, upload_id)
+        raise
+
+    etag = multipart_etag(part_digests)
+    if storage.is_multipart_etag(obj.hash) and str(obj.hash) != etag:
+        raise IOError("Checksum mismatch for {}: computed ETag {} while uploading but storage reports {}".format(
+            obj.name, etag, obj.hash))
+
+    return medusa.storage.ManifestObject(obj.name, obj.size, checksum.encode(digest.digest()), part_size, str(obj.hash),
+                                         checksum=checksum.recorded_name)
+
+
+@retry(stop_max_attempt_number=MULTIPART_PART_RETRIES, wait_exponential_multiplier=1000, wait_exponential_max=30000)
+def __upload_part(storage, connection, bucket, object_name, upload_id, part_number, offset, data, digest):
+    """
+    This function is called by StorageJob. It may be called concurrently by multiple threads.
+
+    :return: The identifier the storage gave to the part, needed to complete the upload
+    """
+    logging.debug("Uploading part {} of {}".format(part_number, object_name))
+    return storage.upload_part(connection, bucket, object_name, upload_id, part_number, offset, data, digest)
+
+
+def __copy_object(storage, connection, src, dest, bucket):
+    """
+    Copies a file of a previous backup within the storage, without its content going through this host. Large objects
+    are copied in parts, in parallel.
+
+    :param storage: The AbstractStorage the file is copied in
+    :param connection: A storage connection which is created and managed by StorageJob
+    :param src: The CachedObject to copy
+    :param dest: The location where to copy the file
+    :param bucket: The remote bucket where the file will be stored
+    :return: A ManifestObject describing the copied file
+    """
+    object_name = storage.object_key(dest, pathlib.PurePath(src.path).name)
+    item = src.manifest_item
+    # The content does not change, neither do the size and digest of the file nor the way it is stored
+    manifest_object = functools.partial(medusa.storage.ManifestObject, size=item['size'], MD5=item['MD5'],
+                                        codec=item.get('codec'), stored_size=item.get('stored_size'),
+                                        checksum=item.get('checksum'))
+    size = item.get('stored_size', item['size'])
+
+    if not storage.uses_multipart_copy(size):
+        logging.info("Copying {} to {}".format(src.path, object_name))
+        obj = storage.copy_object(connection, bucket, src.path, object_name)
+        if storage.is_multipart_etag(obj.hash) or 'codec' in item or 'checksum' in item:
+            return manifest_object(obj.name, part_size=item.get('part_size'), etag=str(obj.hash))
+        return manifest_object(obj.name)
+
+    part_size = multipart_part_size(size, storage.multipart_part_size)
+    logging.info("Copying {} to {} in parts of {} bytes".format(src.path, object_name, part_size))
+    parts = [
+        (part_number, offset, min(part_size, size - offset))
+        for part_number, offset in enumerate(range(0, size, part_size), 1)
+    ]
+    upload_id = storage.initiate_multipart(connection, bucket, object_name)
+    try:
+        job = StorageJob(storage,
+                         lambda part_connection, part: __copy_part(storage, part_connection, bucket, object_name,
+                                                                   upload_id, src.path, *part),
+                         storage.multipart_max_workers)
+        part_etags = {part[0]: part_etag for part, part_etag in job.execute_as_completed(parts)}
+        obj = storage.complete_multipart(connection, bucket, object_name, upload_id, sorted(part_etags.items()))
+    except Exception:
+        logging.warning("Aborting the multipart copy of {}".format(src.path))
+        storage.abort_multipart(connection, bucket, object_name, upload_id)
+        raise
+
+    return manifest_object(obj.name, part_size=part_size, etag=str(obj.hash))
+
+
+@retry(stop_max_attempt_number=MULTIPART_PART_RETRIES, wait_exponential_multiplier=1000, wait_exponential_max=30000)
+def __copy_part(storage, connection, bucket, object_name, upload_id, src_path, part_number, offset, length):
+    """
+    This function is called by StorageJob. It may be called concurrently by multiple threads.
+
+    :return: The identifier the storage gave to the part, needed to complete the copy
+    """
+    logging.debug("Copying part {} of {}".format(part_number, object_name))
+    return storage.upload_part_copy(connection, bucket, object_name, upload_id, part_number, src_path, offset, length)
+
+
+def multipart_part_size(size, part_size):
+    """
+    Returns the size of the parts to upload a file of the given size in, which is at least the configured one but
+    large enough for the file to fit in the maximum number of parts, rounded up to a MB.
+    """
+    min_part_size = -(-size // MULTIPART_MAX_PARTS)
+    min_part_size = -(-min_part_size // (1024 * 1024)) * 1024 * 1024
+    return max(part_size, min_part_size, MULTIPART_MIN_PART_SIZE)
+
+
+def multipart_etag(part_digests):
+    """
+    Computes the ETag S3 gives to objects uploaded in several parts: the MD5 of the concatenated MD5s of the parts,
+    followed by the number of parts.
+
+    :param part_digests: The binary MD5 digests of the parts, in order
+    """
+    return '{}-{}'.format(hashlib.md5(b''.join(part_digests)).hexdigest(), len(part_digests))
+
+
+def __read_and_digest(f, checksum, chunk_size=STREAM_CHUNK_SIZE_BYTES):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        checksum.update(chunk)
+        yield chunk
+
+
+def __digest(chunks, checksum):
+    for chunk in chunks:
+        checksum.update(chunk)
+        yield chunk
+
+
+def upload_contents(storage, blobs, bucket, max_workers=None):
+    """
+    Uploads small objects, like the ones of the backup index, concurrently instead of one round trip after the other
+
+    :param storage: An AbstractStorage instance, needed to create a connection pool
+    :param blobs: A list of (path, content) pairs, the content being a string or the pathlib.Path of a local file
+    :param bucket: The remote bucket in which the objects will be stored
+    :param max_workers: The max number of worker threads to use. Defaults to one per object.
+    :return: A list of ManifestObject describing the uploaded objects, in the order of blobs
+    """
+    blobs = list(blobs)
+    if not blobs:
+        return []
+    job = StorageJob(storage, lambda connection, blob: __upload_content(connection, blob, bucket),
+                     max_workers or len(blobs))
+    return job.execute(blobs)
+
+
+@retry(stop_max_attempt_number=7, wait_exponential_multiplier=10000, wait_exponential_max=120000)
+def __upload_content(connection, blob, bucket):
+    """
+    This function is called by StorageJob. It may be called concurrently by multiple threads.
+    """
+    path, content = blob
+    logging.debug("[Storage] Uploading {}".format(path))
+    if isinstance(content, pathlib.Path):
+        obj = connection.upload_object(os.fspath(content), container=bucket, object_name=str(path))
+    else:
+        obj = connection.upload_object_via_stream(iter([content.encode('utf-8')]), container=bucket,
+                                                  object_name=str(path))
+    return medusa.storage.ManifestObject(obj.name, obj.size, obj.hash)
+
+
+def list_objects(storage, prefixes, max_workers=None):
+    """
+    Lists the objects under several prefixes concurrently
+
+    :param storage: An AbstractStorage instance, needed to create a connection pool
+    :param prefixes: The prefixes to list
+    :param max_workers: The max number of worker threads to use. Defaults to the number of CPUs.
+    :return: A list of the lists of objects under each prefix
+    """
+    job = StorageJob(storage, lambda connection, prefix: storage.list_objects(prefix, connection=connection),
+                     max_workers)
+    return job.execute(prefixes)
+
+
+def download_blobs(storage, src, dest, bucket_name, max_workers=None, codecs=None):
     """
     Download files concurrently to local storage
 
@@ -105,15 +693,47 @@ def download_blobs(storage, src, dest, bucket_name, max_workers=None):
     :param dest: The path to where objects should be downloaded locally
     :param bucket_name: The name of the storage bucket from which files will be downloaded
     :param max_workers: The max number of threads to use. Defaults to the number of CPUS.
+    :param codecs: The names of the codecs the files were compressed with, by file. Files not in it are not compressed.
     :return:
     """
+    codecs = codecs or {}
     job = StorageJob(storage,
-                     lambda connection, src_file: __download_blob(connection, src_file, str(dest), bucket_name),
+                     lambda connection, src_file: __download_blob(connection, src_file, str(dest), bucket_name,
+                                                                  codecs.get(src_file)),
                      max_workers)
     job.execute(list(src))
 
 
-def __download_blob(connection, src, dest, bucket_name):
+def download_blob_ranges(storage, ranges, dest, bucket_name, max_workers=None):
+    """
+    Downloads parts of objects concurrently to local storage, each to a file named after its object
+
+    :param storage: An AbstractStorage instance, needed to create a connection pool
+    :param ranges: A list of (object, start, end) tuples, end being the offset after the last byte to download
+    :param dest: The path to where the parts should be downloaded locally
+    :param bucket_name: The name of the storage bucket from which the parts will be downloaded
+    :param max_workers: The max number of threads to use. Defaults to the number of CPUS.
+    """
+    job = StorageJob(storage,
+                     lambda connection, blob_range: __download_blob_range(connection, *blob_range, str(dest),
+                                                                          bucket_name),
+                     max_workers)
+    job.execute(list(ranges))
+
+
+def __download_blob_range(connection, src, start, end, dest, bucket_name):
+    """
+    This function is called by StorageJob. It may be called concurrently by multiple threads.
+    """
+    logging.debug("[Storage] Getting bytes {} to {} of object {}".format(start, end, src))
+    blob = connection.get_object(bucket_name, str(src))
+    chunks = medusa.rate_limiter.get_limiter().throttle(blob.range_as_stream(start, end))
+    with open(os.path.join(dest, pathlib.PurePath(blob.name).name), 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def __download_blob(connection, src, dest, bucket_name, codec=None):
     """
     This function is called by StorageJob. It may be called concurrently by multiple threads.
 
@@ -121,11 +741,23 @@ def __download_blob(connection, src, dest, bucket_name):
     :param src: The file to download
     :param dest: The path to where the file should be downloaded
     :param bucket_name: The name of the bucket from which the file will be downloaded
+    :param codec: The name of the codec the file was compressed with, if any
     :return:
     """
     try:
         logging.debug("[Storage] Getting object {}".format(src))
         blob = connection.get_object(bucket_name, str(src))
-        blob.download(dest, overwrite_existing=True)
+        limiter = medusa.rate_limiter.get_limiter()
+        if codec is None and not limiter.bytes_per_second:
+            blob.download(dest, overwrite_existing=True)
+            return
+        # Streamed through the limiter a chunk at a time, rather than at line rate. Compressed objects get decompressed
+        # while they stream, and never land on disk.
+        chunks = limiter.throttle(blob.as_stream())
+        if codec is not None:
+            chunks = medusa.storage.compression.get_codec(codec).decompress(chunks)
+        with open(os.path.join(dest, pathlib.PurePath(blob.name).name), 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
     except ObjectDoesNotExistError:
         return None
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import logging
+import multiprocessing
+import threading
+import time
+
+
+DEFAULT_MAX_IDLE_SECONDS = 300
+HEALTH_CHECK_AFTER_SECONDS = 30
+
+
+class ConnectionPool(object):
+    """
+    Keeps the storage connections released by workers so the next ones reuse them, along with their credentials and
+    their already established TLS sessions, instead of connecting again.
+
+    The libcloud drivers are not thread safe, so a connection is only ever handed to one worker at a time. Connections
+    which failed are dropped, the ones idle for longer than max_idle_seconds are evicted and the ones idle for a while
+    get checked before being handed out again.
+    """
+
+    def __init__(self, connect, check=None, max_size=None, max_idle_seconds=DEFAULT_MAX_IDLE_SECONDS,
+                 clock=time.monotonic):
+        self._connect = connect
+        self._check = check
+        self._max_size = max_size or 2 * multiprocessing.cpu_count()
+        self._max_idle_seconds = max_idle_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (connection, release time) pairs, the most recently released last
+        self._idle = []
+        self._created = 0
+
+    @property
+    def created(self):
+        return self._created
+
+    def __len__(self):
+        return len(self._idle)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._evict()
+                if not self._idle:
+                    break
+                connection, released = self._idle.pop()
+            if self._clock() - released < HEALTH_CHECK_AFTER_SECONDS or self._healthy(connection):
+                return connection
+        logging.debug('[Storage] Opening a new connection')
+        connection = self._connect()
+        with self._lock:
+            self._created += 1
+        return connection
+
+    def release(self, connection, healthy=True):
+        with self._lock:
+            if healthy and len(self._idle) < self._max_size:
+                self._idle.append((connection, self._clock()))
+
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except Exception:
+            # The connection might be the reason of the failure, the next attempt gets another one
+            self.release(connection, healthy=False)
+            raise
+        self.release(connection)
+
+    def _evict(self):
+        now = self._clock()
+        self._idle = [(connection, released) for connection, released in self._idle
+                      if now - released < self._max_idle_seconds]
+
+    def _healthy(self, connection):
+        if self._check is None:
+            return True
+        try:
+            return self._check(connection)
+        except Exception as e:
+            logging.debug('[Storage] Dropping unhealthy connection: {}'.format(e))
+            return False
@@ -23,6 +23,8 @@ import tempfile
 import time
 import uuid
 
+import medusa.page_cache
+import medusa.rate_limiter
 import medusa.storage
 
 
@@ -77,10 +79,16 @@ class GSUtil(object):
         # '-o', 'GSUtil:parallel_process_count={}'.format(parallel_process_count),
         # '-o', 'GSUtil:parallel_thread_count={}'.format(parallel_thread_count),
 
-        cmd = ['gsutil',
-               '-m',
-               'cp', '-c',
-               '-L', manifest_log, '-I', str(dst)]
+        cmd = ['gsutil', '-m']
+        multipart_threshold = int(self._config.multipart_threshold or 0)
+        if multipart_threshold > 0:
+            # Large files get uploaded as composite objects, their components being sent in parallel. gsutil checks
+            # them against the CRC32C it computed locally, composite objects having no MD5.
+            cmd += ['-o', 'GSUtil:parallel_composite_upload_threshold={}'.format(multipart_threshold)]
+            if self._config.multipart_part_size:
+                cmd += ['-o', 'GSUtil:parallel_composite_upload_component_size={}'.format(
+                    int(self._config.multipart_part_size))]
+        cmd += ['cp', '-c', '-L', manifest_log, '-I', str(dst)]
 
         logging.debug(' '.join(cmd))
 
@@ -99,10 +107,19 @@ class GSUtil(object):
                                                stdout=output,
                                                stderr=subprocess.STDOUT,
                                                universal_newlines=True)
+                limiter = medusa.rate_limiter.get_limiter()
                 for src in srcs:
+                    # gsutil picks files up as they are written to its input, which paces the transfers
+                    limiter.request()
+                    if os.path.isfile(str(src)):
+                        limiter.consume(os.path.getsize(str(src)))
                     process.stdin.write(str(src) + '\n')
                 process.stdin.close()
                 if process.wait() == 0:
+                    # gsutil read the files through the page cache, drop what it brought in
+                    for src in srcs:
+                        if os.path.isfile(str(src)):
+                            medusa.page_cache.drop_cache(src)
                     with open(manifest_log) as f:
                         manifestobjects = [
                             medusa.storage.ManifestObject(row['Destination'], int(row['Source Size']), row['Md5'])
@@ -13,24 +13,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import concurrent.futures
 import io
+import itertools
 import json
 import logging
 import os
+import threading
+import urllib.parse
 
 from dateutil import parser
+from libcloud.common.types import LibcloudError
 from libcloud.storage.drivers.google_storage import GoogleStorageDriver
 
+import medusa.rate_limiter
+import medusa.storage
+import medusa.storage.compression
+
 from medusa.storage.abstract_storage import AbstractStorage
+from medusa.storage.concurrent import execute_bounded
 from medusa.storage.google_cloud_storage.gsutil import GSUtil
 
 
+# gsutil already parallelizes the transfers of a single invocation, only overlap a few of them
+GSUTIL_MAX_CONCURRENT_BATCHES = 4
+
+
 class GoogleStorage(AbstractStorage):
 
-    def connect_storage(self):
-        with io.open(os.path.expanduser(self.config.key_file), 'r', encoding='utf-8') as json_fi:
-            credentials = json.load(json_fi)
+    def __init__(self, config):
+        self._credentials = None
+        self._gsutil = None
+        self._gsutil_lock = threading.Lock()
+        super().__init__(config)
 
+    def connect_storage(self):
+        credentials = self.credentials
         driver = GoogleStorageDriver(
             key=credentials['client_email'],
             secret=credentials['private_key'],
@@ -39,14 +58,151 @@ class GoogleStorage(AbstractStorage):
 
         return driver
 
+    @property
+    def credentials(self):
+        # Parsed once, every connection of the command uses the same credentials
+        if self._credentials is None:
+            with io.open(os.path.expanduser(self.config.key_file), 'r', encoding='utf-8') as json_fi:
+                self._credentials = json.load(json_fi)
+        return self._credentials
+
+    @property
+    def gsutil(self):
+        """
+        GSUtil with the service account activated, shared by all the transfers of the command
+        """
+        with self._gsutil_lock:
+            if self._gsutil is None:
+                self._gsutil = GSUtil(self.config).__enter__()
+                atexit.register(self._gsutil.__exit__, None, None, None)
+        return self._gsutil
+
+    @property
+    def hashes_while_uploading(self):
+        # gsutil only gives the MD5 of the files, the ones hashed with another checksum get streamed through the driver
+        return self.single_pass_upload or self.checksum.recorded_name is not None
+
     def upload_blobs(self, src, dest):
-        with GSUtil(self.config) as gsutil:
-            return gsutil.cp(srcs=src, dst="gs://{}/{}".format(self.bucket.name, dest))
+        if self.hashed_keys:
+            # Files of the same location go to different shards, which gsutil cannot upload together
+            return [manifest_object for _, manifest_object in self.upload_files((s, dest) for s in src)]
+
+        # Files of previous backups are copied within the bucket by the driver, which keeps the way they are stored
+        # from their manifest item: gsutil would only give the size and MD5 of the stored object. Local files are
+        # streamed through the driver when hashed on the way, and go through gsutil otherwise.
+        src = list(src)
+        driver_srcs = [s for s in src if isinstance(s, medusa.storage.CachedObject) or self.hashes_while_uploading]
+        gsutil_srcs = [s for s in src if not isinstance(s, medusa.storage.CachedObject)
+                       and not self.hashes_while_uploading]
+        manifest_objects = super().upload_blobs(driver_srcs, dest) if driver_srcs else []
+        if gsutil_srcs:
+            manifest_objects += self._with_composite_checksums(
+                self.gsutil.cp(srcs=gsutil_srcs, dst="gs://{}/{}".format(self.bucket.name, dest)))
+        return manifest_objects
+
+    def upload_files(self, transfers):
+        if self.hashed_keys:
+            # gsutil takes a single destination, and the files of a location are spread over all the shards: batching
+            # them would take one gsutil invocation per file. They all go through the driver instead, files of previous
+            # backups being copied within the bucket.
+            yield from super().upload_files(transfers)
+            return
+
+        # Files copied from previous backups go through the driver, which keeps the way they are stored. So do local
+        # files streamed to compute their MD5 on the way, to compress or pack them, the others go through gsutil.
+        gsutil_transfers = []
+
+        def driver_transfers():
+            for transfer in transfers:
+                src = transfer[0]
+                if isinstance(src, (medusa.storage.PackedFiles, medusa.storage.CachedObject)) \
+                        or self.hashes_while_uploading or self.codec_for(src) is not None:
+                    yield transfer
+                else:
+                    gsutil_transfers.append(transfer)
+
+        yield from super().upload_files(driver_transfers())
+        if gsutil_transfers:
+            yield from self._gsutil_upload_files(gsutil_transfers)
+
+    def _gsutil_upload_files(self, transfers):
+        # gsutil takes a single destination, so consecutive files going to the same location are sent together
+        batches = (
+            (dest, [src for src, _ in batch])
+            for dest, batch in itertools.groupby(transfers, key=lambda transfer: transfer[1])
+        )
+        gsutil = self.gsutil
+
+        def upload_batch(batch):
+            dest, srcs = batch
+            return self._with_composite_checksums(gsutil.cp(srcs=srcs,
+                                                            dst="gs://{}/{}".format(self.bucket.name, dest)))
+
+        with concurrent.futures.ThreadPoolExecutor(GSUTIL_MAX_CONCURRENT_BATCHES) as executor:
+            for (dest, _), manifest_objects in execute_bounded(executor, upload_batch, batches,
+                                                               GSUTIL_MAX_CONCURRENT_BATCHES):
+                for manifest_object in manifest_objects:
+                    yield dest, manifest_object
+
+    def _with_composite_checksums(self, manifest_objects):
+        """
+        Files above the multipart threshold get uploaded by gsutil as composite objects, which have no MD5. Their
+        CRC32C, which gsutil checked against the one it computed locally, gets recorded instead, along with the ETag
+        verify checks the object against.
+        """
+        composite_objects = [manifest_object for manifest_object in manifest_objects if not manifest_object.MD5]
+        if not composite_objects:
+            return manifest_objects
+        prefix = 'gs://{}/'.format(self.bucket.name)
+        checksums = {}
+        with self.connection_pool.connection() as connection:
+            for manifest_object in composite_objects:
+                object_name = manifest_object.path[len(prefix):] if manifest_object.path.startswith(prefix) \
+                    else manifest_object.path
+                checksums[manifest_object.path] = self._crc32c_and_etag(connection, object_name)
+        return [
+            manifest_object._replace(MD5=checksums[manifest_object.path][0], etag=checksums[manifest_object.path][1],
+                                     checksum='crc32c')
+            if manifest_object.path in checksums else manifest_object
+            for manifest_object in manifest_objects
+        ]
+
+    def _crc32c_and_etag(self, connection, object_name):
+        medusa.rate_limiter.get_limiter().request()
+        response = connection.connection.request(connection._get_object_path(self.bucket, object_name),
+                                                 method='HEAD')
+        if response.status != 200:
+            raise LibcloudError('Error reading the hashes of {}'.format(object_name), driver=connection)
+        # x-goog-hash holds comma separated algorithm=base64 digest pairs, the CRC32C being big-endian
+        hashes = dict(
+            value.strip().split('=', 1)
+            for value in response.headers.get('x-goog-hash', '').split(',')
+            if '=' in value
+        )
+        if 'crc32c' not in hashes:
+            raise LibcloudError('{} has no CRC32C'.format(object_name), driver=connection)
+        return hashes['crc32c'], response.headers.get('etag', '').replace('"', '')
+
+    def copy_object(self, connection, bucket, src_path, object_name):
+        # The XML API the driver uses copies objects like S3 does, within the bucket
+        src_path = str(src_path)
+        source = src_path[len('gs://'):] if src_path.startswith('gs://') else '{}/{}'.format(bucket.name, src_path)
+        headers = {'x-goog-copy-source': '/{}'.format(urllib.parse.quote(source))}
+        response = connection.connection.request(connection._get_object_path(bucket, object_name), method='PUT',
+                                                 headers=headers)
+        if response.status != 200:
+            raise LibcloudError('Error copying {} to {}'.format(src_path, object_name), driver=connection)
+        return connection.get_object(bucket.name, object_name)
 
-    def download_blobs(self, src, dest):
-        with GSUtil(self.config) as gsutil:
-            src = list(map(lambda name: "gs://{}/{}".format(self.bucket.name, name), src))
-            return gsutil.cp(srcs=src, dst=dest)
+    def download_blobs(self, src, dest, codecs=None):
+        src = list(src)
+        manifest_objects = self.gsutil.cp(srcs=["gs://{}/{}".format(self.bucket.name, name) for name in src], dst=dest)
+        # gsutil writes the objects as they are stored, compressed ones get decompressed once downloaded
+        for name, codec in (codecs or {}).items():
+            if name in src:
+                medusa.storage.compression.decompress_file(os.path.join(str(dest), name.split('/')[-1]),
+                                                           medusa.storage.compression.get_codec(codec))
+        return manifest_objects
 
     def get_object_datetime(self, blob):
         logging.debug("Blob {} last modification time is {}".format(blob.name, blob.extra["last_modified"]))
@@ -14,8 +14,11 @@
 # limitations under the License.
 
 import datetime
+import logging
 import pathlib
 import os
+import shutil
+import uuid
 
 from libcloud.storage.drivers.local import LocalStorageDriver
 
@@ -32,9 +35,9 @@ class LocalStorage(AbstractStorage):
 
         return driver
 
-    def list_objects(self, path=None):
+    def list_objects(self, path=None, connection=None):
         # List objects in the bucket/container that have the corresponding prefix (emtpy means all objects)
-        objects = self.driver.list_container_objects(self.bucket)
+        objects = (connection or self.driver).list_container_objects(self.bucket)
 
         if isinstance(path, pathlib.Path):
             path = os.fspath(path)
@@ -44,6 +47,56 @@ class LocalStorage(AbstractStorage):
 
         return objects
 
+    @property
+    def supports_multipart(self):
+        return True
+
+    def _object_path(self, bucket, object_name):
+        return os.path.join(self.config.base_path, bucket.name, object_name)
+
+    def initiate_multipart(self, connection, bucket, object_name):
+        # Parts are written straight at their position in a temporary file, which replaces the object once complete
+        path = self._object_path(bucket, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        upload_id = '{}.{}.multipart'.format(path, uuid.uuid4())
+        open(upload_id, 'wb').close()
+        return upload_id
+
+    def upload_part(self, connection, bucket, object_name, upload_id, part_number, offset, data, digest):
+        fd = os.open(upload_id, os.O_WRONLY)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.pwrite(fd, view, offset + len(data) - len(view)):]
+        finally:
+            os.close(fd)
+        return digest.hex()
+
+    def complete_multipart(self, connection, bucket, object_name, upload_id, parts):
+        os.replace(upload_id, self._object_path(bucket, object_name))
+        return connection.get_object(bucket.name, object_name)
+
+    def abort_multipart(self, connection, bucket, object_name, upload_id):
+        if os.path.exists(upload_id):
+            os.remove(upload_id)
+
+    def copy_object(self, connection, bucket, src_path, object_name):
+        # Backup files are never modified in place, so the copy can share the data of the original
+        path = self._object_path(bucket, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.copy'.format(path, uuid.uuid4())
+        try:
+            os.link(str(src_path), tmp_path)
+        except OSError as e:
+            logging.debug('Could not hardlink {}, copying it instead: {}'.format(src_path, e))
+            shutil.copy2(str(src_path), tmp_path)
+        os.replace(tmp_path, path)
+        return connection.get_object(bucket.name, object_name)
+
+    def reports_md5(self, blob):
+        # The local driver derives the hash of objects from their modification time
+        return False
+
     def get_object_datetime(self, blob):
         return datetime.datetime.fromtimestamp(int(blob.extra["modify_time"]))
 
@@ -12,10 +12,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
 import logging
 import pathlib
 
+import medusa.manifest
+
+from medusa.backup_scope import BackupScope
+
 
 class NodeBackup(object):
 
@@ -34,7 +37,9 @@ class NodeBackup(object):
                  finished_timestamp=None,
                  finished_blob=None,
                  differential_blob=None,
-                 differential_mode=False):
+                 differential_mode=False,
+                 scope_blob=None,
+                 scope=None):
 
         self._storage = storage
         self._fqdn = fqdn
@@ -61,6 +66,7 @@ class NodeBackup(object):
         self._manifest_path = self._meta_path / 'manifest.json'
         self._incremental_path = self._meta_path / 'incremental'
         self._differential_path = self._meta_path / 'differential'
+        self._scope_path = self._meta_path / 'scope.json'
         self._restore_verify_query_path = self._meta_path / 'restore_verify_query.json'
 
         if preloaded_blobs is None:
@@ -70,7 +76,11 @@ class NodeBackup(object):
 
         self._cached_blobs = {pathlib.Path(blob.name): blob for blob in preloaded_blobs}
 
+        # Metadata written by this instance, kept to spare reading it back from the storage
+        self.cached_tokenmap = None
+        self.cached_schema = None
         self.cached_manifest = None
+        self.cached_manifest_summary = None
         self.cached_manifest_blob = manifest_blob
         self.cached_schema_blob = schema_blob
         self.cached_tokenmap_blob = tokenmap_blob
@@ -78,6 +88,8 @@ class NodeBackup(object):
         self.finished_blob = finished_blob
         self._started = started_timestamp
         self._finished = finished_timestamp
+        self._scope_blob = scope_blob
+        self._scope = scope
 
     def __repr__(self):
         return 'NodeBackup(name={0.name}, fqdn={0.fqdn}, schema_path={0.schema_path})'.format(self)
@@ -116,13 +128,16 @@ class NodeBackup(object):
 
     @property
     def tokenmap(self):
-        if self.cached_tokenmap_blob is None:
-            self.cached_tokenmap_blob = self._blob(self.tokenmap_path)
-        return self._storage.storage_driver.read_blob_as_string(self.cached_tokenmap_blob)
+        if self.cached_tokenmap is None:
+            if self.cached_tokenmap_blob is None:
+                self.cached_tokenmap_blob = self._blob(self.tokenmap_path)
+            self.cached_tokenmap = self._storage.storage_driver.read_blob_as_string(self.cached_tokenmap_blob)
+        return self.cached_tokenmap
 
     @tokenmap.setter
     def tokenmap(self, tokenmap):
         self._storage.storage_driver.upload_blob_from_string(self.tokenmap_path, tokenmap)
+        self.cached_tokenmap = tokenmap
 
     @property
     def schema_path(self):
@@ -130,11 +145,14 @@ class NodeBackup(object):
 
     @property
     def schema(self):
-        return self._storage.storage_driver.get_blob_content_as_string(self.schema_path)
+        if self.cached_schema is None:
+            self.cached_schema = self._storage.storage_driver.get_blob_content_as_string(self.schema_path)
+        return self.cached_schema
 
     @schema.setter
     def schema(self, schema):
         self._storage.storage_driver.upload_blob_from_string(self.schema_path, schema)
+        self.cached_schema = schema
 
     # Should be removed after a while. Here for short term backwards compatibility.
     @property
@@ -153,6 +171,31 @@ class NodeBackup(object):
     def differential(self, differential):
         self._storage.storage_driver.upload_blob_from_string(self.differential_path, differential)
 
+    @property
+    def scope_path(self):
+        return self._scope_path
+
+    @property
+    def scope(self):
+        """
+        The BackupScope of the backup. Backups without a scope blob hold every table.
+        """
+        if self._scope is None:
+            if self._scope_blob is None:
+                self._scope_blob = self._blob(self.scope_path)
+            if self._scope_blob is None:
+                self._scope = BackupScope()
+            else:
+                self._scope = BackupScope.from_json(
+                    self._storage.storage_driver.read_blob_as_string(self._scope_blob))
+        return self._scope
+
+    @scope.setter
+    def scope(self, scope):
+        self._scope = scope
+        if scope.is_partial:
+            self._storage.storage_driver.upload_blob_from_string(self.scope_path, scope.to_json())
+
     @property
     def restore_verify_query_path(self):
         return self._restore_verify_query_path
@@ -216,8 +259,63 @@ class NodeBackup(object):
 
     @manifest.setter
     def manifest(self, manifest):
-        self.cached_manifest = None
+        self._forget_manifest()
         self._storage.storage_driver.upload_blob_from_string(self.manifest_path, manifest)
+        self.cached_manifest = manifest
+
+    def upload_manifest(self, manifest_file, summary=None):
+        """
+        Stores the manifest written by a ManifestWriter, without loading it in memory
+
+        :param summary: The summary returned by the writer, which spares reading it back
+        """
+        self._forget_manifest()
+        self._storage.storage_driver.upload_blob_from_file(self.manifest_path, manifest_file)
+        self.cached_manifest_summary = summary
+
+    def _manifest_key(self):
+        return self._storage.config.bucket_name, str(self.manifest_path)
+
+    def _forget_manifest(self):
+        self.cached_manifest = None
+        self.cached_manifest_summary = None
+        medusa.manifest.forget(self._manifest_key())
+
+    def load_manifest(self):
+        """
+        The parsed Manifest of the backup, shared by everything reading it in this process
+        """
+        def read():
+            if self.cached_manifest is not None:
+                return self.cached_manifest
+            # The parsed manifest replaces its text, which is not kept around
+            return self._storage.storage_driver.get_blob_content_as_string(self.manifest_path)
+
+        return medusa.manifest.load(self._manifest_key(), read)
+
+    def sections(self):
+        """
+        The sections of the manifest, one per table
+        """
+        return self.load_manifest().sections
+
+    def manifest_summary(self):
+        """
+        The number of sections and objects of the manifest, and the size of the backup. Unless the manifest is
+        loaded already, only its first line gets downloaded.
+        """
+        if self.cached_manifest_summary is None:
+            if self.cached_manifest is not None:
+                self.cached_manifest_summary = medusa.manifest.read_summary(self.cached_manifest)
+            else:
+                if self.cached_manifest_blob is None:
+                    self.cached_manifest_blob = self._blob(self._manifest_path)
+                first_line = self._storage.storage_driver.read_blob_first_line(self.cached_manifest_blob)
+                if medusa.manifest.is_summary(first_line):
+                    self.cached_manifest_summary = medusa.manifest.parse_summary(first_line)
+                else:
+                    self.cached_manifest_summary = medusa.manifest.read_summary(self.manifest)
+        return self.cached_manifest_summary
 
     def datapath(self, *, keyspace, columnfamily):
         return self.data_path / keyspace / columnfamily
@@ -230,14 +328,7 @@ class NodeBackup(object):
         return self._blob(self.schema_path) is not None
 
     def size(self):
-        return sum(
-            obj['size']
-            for section in json.loads(self.manifest)
-            for obj in section['objects']
-        )
+        return self.manifest_summary()['size']
 
     def num_objects(self):
-        return sum(
-            len(section['objects'])
-            for section in json.loads(self.manifest)
-        )
+        return self.manifest_summary()['objects']
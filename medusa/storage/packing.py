@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import os
+import pathlib
+
+import medusa.page_cache
+import medusa.storage
+import medusa.storage.checksum
+
+
+ARCHIVE_SUFFIX = '.pack'
+READ_SIZE_BYTES = 1024 * 1024
+
+
+def sstable_generation(name):
+    """
+    Returns the part of the name of an SSTable component shared by all the components of its generation, for
+    instance mc-12-big for mc-12-big-Data.db
+    """
+    return name.rsplit('-', 1)[0]
+
+
+def pack_small_files(srcs, max_size):
+    """
+    Groups the files smaller than max_size by SSTable generation, so the small components of an SSTable get stored
+    as one archive object instead of one object each. Each SSTable comes with up to 8 files of a few KB, which cost
+    a request each to upload, verify, purge and restore.
+
+    :param srcs: The files to upload, CachedObjects are left alone
+    :param max_size: The size under which files get packed
+    :return: The list of files and PackedFiles to upload
+    """
+    transfers = []
+    generations = collections.OrderedDict()
+    for src in srcs:
+        if isinstance(src, pathlib.Path) and src.stat().st_size < max_size:
+            generations.setdefault(sstable_generation(src.name), []).append(src)
+        else:
+            transfers.append(src)
+    for generation, small_srcs in generations.items():
+        if len(small_srcs) > 1:
+            transfers.append(medusa.storage.PackedFiles(generation + ARCHIVE_SUFFIX, small_srcs))
+        else:
+            transfers.extend(small_srcs)
+    return transfers
+
+
+def pack(srcs, checksum=None):
+    """
+    Reads small files into one archive
+
+    :param checksum: The medusa.storage.checksum.Checksum to hash the files with, MD5 by default
+    :return: The content of the archive, and a (file, offset, size, digest) tuple for each of the files in it
+    """
+    checksum = checksum or medusa.storage.checksum.get_checksum()
+    content = bytearray()
+    members = []
+    for src in srcs:
+        with medusa.page_cache.SequentialReader(src) as f:
+            data = f.read()
+        members.append((src, len(content), len(data), checksum.digest(data)))
+        content += data
+    return bytes(content), members
+
+
+def archive_range(manifest_items):
+    """
+    Returns the part of an archive holding the given files packed in it, as a (start, end) pair of offsets, end being
+    the one after the last byte. Restores only download that part of the archive.
+    """
+    return (min(item['offset'] for item in manifest_items),
+            max(item['offset'] + item['size'] for item in manifest_items))
+
+
+def unpack(archive, manifest_items, dst, start=0):
+    """
+    Writes out the files packed in a downloaded archive, reading each of them at the offset given by its manifest item
+
+    :param archive: The path of the downloaded archive
+    :param manifest_items: The manifest items of the files packed in the archive
+    :param dst: The directory to write the files to
+    :param start: The offset in the archive of the first byte downloaded, when only part of it was
+    """
+    with open(str(archive), 'rb') as f:
+        for item in manifest_items:
+            f.seek(item['offset'] - start)
+            remaining = item['size']
+            checksum = medusa.storage.checksum.get_checksum(item.get('checksum'))
+            digest = checksum.new()
+            with open(os.path.join(str(dst), pathlib.PurePath(item['path']).name), 'wb') as out:
+                while remaining > 0:
+                    chunk = f.read(min(remaining, READ_SIZE_BYTES))
+                    if not chunk:
+                        raise IOError('Archive {} is too short to hold {}'.format(archive, item['path']))
+                    digest.update(chunk)
+                    out.write(chunk)
+                    remaining -= len(chunk)
+            if checksum.encode(digest.digest()) != item['MD5']:
+                raise IOError('Checksum mismatch for {} unpacked from {}'.format(item['path'], archive))
+    logging.debug('Unpacked {} files from {}'.format(len(manifest_items), archive))
+    os.remove(str(archive))
@@ -12,17 +12,28 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import base64
 import configparser
 import logging
 import os
 import io
+import urllib.parse
 from dateutil import parser
 
+from libcloud.common.types import LibcloudError
 from libcloud.storage.providers import get_driver
+from libcloud.utils.xml import findtext
+
+import medusa.rate_limiter
+import medusa.storage.compression
 
 from medusa.storage.abstract_storage import AbstractStorage
 
 
+# Larger objects can only be copied in parts
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * 1024 * 1024
+
+
 class S3Storage(AbstractStorage):
     """
     Available storage providers for S3:
@@ -46,24 +57,37 @@ class S3Storage(AbstractStorage):
     S3_RGW = 's3_rgw'
     S3_RGW_OUTSCALE = 's3_rgw_outscale'
     """
+    def __init__(self, config):
+        self._credentials = None
+        super().__init__(config)
+
     def connect_storage(self):
-        aws_config = configparser.ConfigParser(interpolation=None)
-        with io.open(os.path.expanduser(self.config.key_file), 'r', encoding='utf-8') as aws_file:
-            aws_config.read_file(aws_file)
-            aws_profile = self.config.api_profile
-            profile = aws_config[aws_profile]
-            cls = get_driver(self.config.storage_provider)
-            driver = cls(profile['aws_access_key_id'], profile['aws_secret_access_key'])
-            return driver
-
-    def download_blobs(self, src, dest):
+        access_key_id, secret_access_key = self.credentials
+        cls = get_driver(self.config.storage_provider)
+        driver = cls(access_key_id, secret_access_key)
+        return driver
+
+    @property
+    def credentials(self):
+        # Parsed once, every connection of the command uses the same credentials
+        if self._credentials is None:
+            aws_config = configparser.ConfigParser(interpolation=None)
+            with io.open(os.path.expanduser(self.config.key_file), 'r', encoding='utf-8') as aws_file:
+                aws_config.read_file(aws_file)
+                profile = aws_config[self.config.api_profile]
+                self._credentials = (profile['aws_access_key_id'], profile['aws_secret_access_key'])
+        return self._credentials
+
+    def download_blobs(self, src, dest, codecs=None):
         """
         Downloads a list of files from the remote storage system to the local storage
 
         :param src: a list of files to download from the remote storage system
         :param dest: the path where to download the objects locally
+        :param codecs: the codecs compressed files were stored with, by file, as recorded in the manifest
         :return:
         """
+        codecs = codecs or {}
         for src_obj in list(src):
             blob = self.get_blob(src_obj)
             index = src_obj.rfind('/')
@@ -71,7 +95,71 @@ class S3Storage(AbstractStorage):
                 file_name = src_obj[src_obj.rfind('/') + 1:]
             else:
                 file_name = src_obj
-            blob.download(os.path.join(dest, file_name), overwrite_existing=True)
+            # Streamed rather than downloaded at once, so it goes at the pace allowed by the rate limiter
+            chunks = medusa.rate_limiter.get_limiter().throttle(blob.as_stream())
+            if src_obj in codecs:
+                chunks = medusa.storage.compression.get_codec(codecs[src_obj]).decompress(chunks)
+            with open(os.path.join(dest, file_name), 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+
+    @property
+    def supports_multipart(self):
+        return True
+
+    def initiate_multipart(self, connection, bucket, object_name):
+        return connection._initiate_multipart(bucket, object_name)
+
+    def upload_part(self, connection, bucket, object_name, upload_id, part_number, offset, data, digest):
+        # Same request as the driver sends for the chunks of streamed uploads, which it only sends one at a time
+        headers = {
+            'Content-Length': len(data),
+            'Content-MD5': base64.b64encode(digest).decode('UTF-8')
+        }
+        params = {'uploadId': upload_id, 'partNumber': part_number}
+        response = connection.connection.request(connection._get_object_path(bucket, object_name), method='PUT',
+                                                 data=data, headers=headers, params=params)
+        if response.status != 200:
+            raise LibcloudError('Error uploading part {} of {}'.format(part_number, object_name), driver=connection)
+        return response.headers['etag'].replace('"', '')
+
+    def complete_multipart(self, connection, bucket, object_name, upload_id, parts):
+        connection._commit_multipart(bucket, object_name, upload_id, parts)
+        return connection.get_object(bucket.name, object_name)
+
+    def abort_multipart(self, connection, bucket, object_name, upload_id):
+        connection._abort_multipart(bucket, object_name, upload_id)
+
+    @staticmethod
+    def _copy_source(bucket, src_path):
+        return '/{}/{}'.format(bucket.name, urllib.parse.quote(str(src_path)))
+
+    def copy_object(self, connection, bucket, src_path, object_name):
+        headers = {'x-amz-copy-source': self._copy_source(bucket, src_path)}
+        response = connection.connection.request(connection._get_object_path(bucket, object_name), method='PUT',
+                                                 headers=headers)
+        if response.status != 200:
+            raise LibcloudError('Error copying {} to {}'.format(src_path, object_name), driver=connection)
+        return connection.get_object(bucket.name, object_name)
+
+    @property
+    def supports_multipart_copy(self):
+        return True
+
+    def uses_multipart_copy(self, size):
+        return super().uses_multipart_copy(size) or size > MAX_COPY_OBJECT_SIZE
+
+    def upload_part_copy(self, connection, bucket, object_name, upload_id, part_number, src_path, offset, length):
+        headers = {
+            'x-amz-copy-source': self._copy_source(bucket, src_path),
+            'x-amz-copy-source-range': 'bytes={}-{}'.format(offset, offset + length - 1)
+        }
+        params = {'uploadId': upload_id, 'partNumber': part_number}
+        response = connection.connection.request(connection._get_object_path(bucket, object_name), method='PUT',
+                                                 headers=headers, params=params)
+        if response.status != 200:
+            raise LibcloudError('Error copying part {} of {}'.format(part_number, object_name), driver=connection)
+        return findtext(element=response.object, xpath='ETag', namespace=connection.namespace).replace('"', '')
 
     def get_object_datetime(self, blob):
         logging.debug("Blob {} last modification time is {}".format(blob.name, blob.extra["last_modified"]))
@@ -13,10 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
-import json
 import logging
 
+import medusa.manifest
+
+from medusa.manifest import object_key
 from medusa.storage import Storage
 
 
@@ -63,7 +64,7 @@ def validate_manifest(storage, node_backup):
     """
 
     try:
-        manifest = json.loads(node_backup.manifest)
+        manifest = list(node_backup.sections())
     except Exception:
         logging.error('Unable to read manifest from storage')
         return
@@ -72,7 +73,8 @@ def validate_manifest(storage, node_backup):
 
     objects_in_storage = {
         blob.name: blob
-        for blob in storage.storage_driver.list_objects(node_backup.data_path)
+        for blob in storage.storage_driver.list_data_objects(
+            node_backup.data_path, hashed=storage.storage_driver.hashed_keys or medusa.manifest.has_shards(manifest))
     }
 
     objects_in_manifest = [
@@ -83,19 +85,28 @@ def validate_manifest(storage, node_backup):
 
     for object_in_manifest in objects_in_manifest:
 
-        blob = objects_in_storage.get('{}{}'.format(data_path_prefix, object_in_manifest['path']))
+        if 'archive' in object_in_manifest:
+            # Packed files are checked when unpacked, only their archive can be checked against the storage
+            archive = objects_in_storage.get('{}{}'.format(data_path_prefix, object_key(object_in_manifest)))
+            if archive is None:
+                yield "  - [{}] Doesn't exists".format(object_in_manifest['archive'])
+            elif object_in_manifest['offset'] + object_in_manifest['size'] > int(archive.size):
+                yield "  - [{}] Not in archive {}".format(object_in_manifest['path'], object_in_manifest['archive'])
+            continue
+
+        blob = objects_in_storage.get('{}{}'.format(data_path_prefix, object_key(object_in_manifest)))
 
         if blob is None:
             yield("  - [{}] Doesn't exists".format(object_in_manifest['path']))
             continue
 
-        base64_hex = base64.b64decode(object_in_manifest['MD5']).hex()
-        if base64_hex != str(blob.hash) and object_in_manifest['MD5'] != str(blob.hash):
-            logging.error("Expected {} but got {} for {}".format(base64_hex, blob.hash, object_in_manifest['path']))
+        if not storage.storage_driver.object_hash_matches(object_in_manifest, blob.hash):
+            logging.error("Expected {} but got {} for {}".format(
+                object_in_manifest.get('etag') or object_in_manifest['MD5'], blob.hash, object_in_manifest['path']))
             yield("  - [{}] Wrong checksum".format(object_in_manifest['path']))
             continue
 
-        if object_in_manifest['size'] != blob.size:
+        if object_in_manifest.get('stored_size', object_in_manifest['size']) != blob.size:
             yield("  - [{}] Wrong file size".format(object_in_manifest['path']))
             continue
 
@@ -107,7 +118,7 @@ def validate_manifest(storage, node_backup):
         paths_in_storage = set(objects_in_storage.keys())
 
         paths_in_manifest = {
-            "{}{}".format(data_path_prefix, obj['path'])
+            "{}{}".format(data_path_prefix, object_key(obj))
             for obj in objects_in_manifest
         }
 
@@ -55,6 +55,11 @@ setuptools.setup(
         'pycrypto==2.6.1',
         'retrying==1.3.3'
     ],
+    extras_require={
+        # Checksums other than MD5 and BLAKE2, see checksum_algorithm in medusa-example.ini
+        'crc32c': ['crc32c>=2.0'],
+        'xxhash': ['xxhash>=2.0.0'],
+    },
     entry_points={
         'console_scripts': [
             'medusa=medusa.medusacli:cli',
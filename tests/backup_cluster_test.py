@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import subprocess
+import tempfile
+import unittest
+
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from medusa.backup_cluster import BackupJob, hosts_to_start, interleave_racks
+from medusa.orchestration import Remote
+
+
+WRAPPER = Path(__file__).parent.parent / 'bin' / 'medusa-wrapper'
+
+
+PLACEMENT = {
+    'node1': {'datacenter': 'dc1', 'rack': 'r1', 'is_up': True},
+    'node2': {'datacenter': 'dc1', 'rack': 'r1', 'is_up': True},
+    'node3': {'datacenter': 'dc1', 'rack': 'r2', 'is_up': True},
+    'node4': {'datacenter': 'dc1', 'rack': 'r2', 'is_up': True},
+    'node5': {'datacenter': 'dc2', 'rack': 'r1', 'is_up': True},
+}
+
+
+class BackupClusterTest(unittest.TestCase):
+
+    def test_interleave_racks(self):
+        self.assertEqual(['node1', 'node3', 'node5', 'node2', 'node4'], interleave_racks(PLACEMENT))
+
+    def test_hosts_to_start(self):
+        pending = interleave_racks(PLACEMENT)
+        self.assertEqual(pending, hosts_to_start(pending, [], PLACEMENT))
+        self.assertEqual(['node1', 'node3', 'node5'], hosts_to_start(pending, [], PLACEMENT, max_per_rack=1))
+        self.assertEqual(['node1', 'node5'], hosts_to_start(pending, [], PLACEMENT, max_per_dc=1))
+        self.assertEqual(['node1', 'node3', 'node5'],
+                         hosts_to_start(pending, [], PLACEMENT, max_per_rack=1, max_per_dc=2))
+        # node3 uploads already, so dc1 can only start one more node, which can't be in r2
+        self.assertEqual(['node1', 'node5'],
+                         hosts_to_start(['node1', 'node5', 'node2', 'node4'], ['node3'], PLACEMENT,
+                                        max_per_rack=1, max_per_dc=2))
+
+    def test_upload_snapshots(self):
+        job = BackupJob(Mock(), 'backup1', 'differential', Path('/tmp'), PLACEMENT, max_per_rack=1, max_per_dc=2)
+        uploading = set()
+
+        def trigger_backup(host, snapshot_only):
+            uploading.add(host)
+            # no more than two nodes of dc1 and one node of each rack upload at once
+            dc1 = [h for h in uploading if PLACEMENT[h]['datacenter'] == 'dc1']
+            self.assertLessEqual(len(dc1), 2)
+            self.assertEqual(len(dc1), len({PLACEMENT[h]['rack'] for h in dc1}))
+            return host
+
+        polls = {}
+
+        def poll(host):
+            # each upload takes two polls, node4 fails
+            polls[host] = polls.get(host, 0) + 1
+            if polls[host] < 2:
+                return host, None
+            uploading.remove(host)
+            return host, host != 'node4'
+
+        job._trigger_backup = Mock(side_effect=trigger_backup)
+        job._poll = Mock(side_effect=poll)
+        with patch('medusa.backup_cluster.time.sleep'):
+            broken = job._upload_snapshots()
+
+        self.assertEqual(['node4'], broken)
+        self.assertEqual(['node1', 'node3', 'node5', 'node2', 'node4'],
+                         [call[0][0] for call in job._trigger_backup.call_args_list])
+        self.assertEqual(set(), uploading)
+
+    def test_execute_cleans_up_ssh_agent(self):
+        config = Mock()
+        config.storage.rolling_snapshot_tables = None
+        job = BackupJob(config, 'backup1', 'differential', Path('/tmp'), PLACEMENT)
+        job._ssh_agent_started = True
+        job.ssh_cleanup = Mock()
+        job._trigger_backup = Mock()
+        job._wait_for = Mock(return_value=([], ['node1']))
+        with self.assertRaises(Exception):
+            job.execute()
+        job.ssh_cleanup.assert_called_once_with()
+
+    def test_rolling_snapshots_rejected(self):
+        config = Mock()
+        config.storage.rolling_snapshot_tables = '10'
+        job = BackupJob(config, 'backup1', 'differential', Path('/tmp'), PLACEMENT)
+        job._trigger_backup = Mock()
+        with self.assertRaisesRegex(Exception, 'rolling_snapshot_tables'):
+            job.execute()
+        job._trigger_backup.assert_not_called()
+
+    def test_steps_run_in_their_own_directory(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            job = BackupJob(Mock(), 'backup1', 'differential', Path(temp_dir), PLACEMENT)
+            job._connect = Mock(return_value=(Mock(), {'hostname': 'node1'}))
+            job._run = Mock(side_effect=lambda target, client, connect_args, command, work_dir:
+                            Remote(target, connect_args, client, Mock(), Mock(), Mock(), work_dir))
+            snapshot = job._trigger_backup('node1', snapshot_only=True)
+            upload = job._trigger_backup('node1', snapshot_only=False)
+            self.assertNotEqual(snapshot.work_dir, upload.work_dir)
+
+            # medusa-wrapper runs the upload instead of handing out the status the snapshot left behind
+            for i, (remote, step) in enumerate([(snapshot, '--snapshot-only'), (upload, '--resume')]):
+                command = job._run.call_args_list[i][0][3]
+                self.assertIn(step, command)
+                self.assertEqual(str(remote.work_dir), re.search(r'cd (\S+) &&', command).group(1))
+                os.makedirs(str(remote.work_dir))
+                subprocess.check_call(['sh', str(WRAPPER), 'touch', 'ran'], cwd=str(remote.work_dir))
+            self.assertTrue((upload.work_dir / 'ran').exists())
+
+            # a lost connection gets opened again in the directory of the step
+            upload.channel.exit_status_ready = False
+            upload.client.get_transport.return_value.is_alive.return_value = False
+            with patch('medusa.orchestration.paramiko.client.SSHClient'):
+                remote, succeeded = job._poll(upload)
+            self.assertIsNone(succeeded)
+            self.assertEqual('cd {}; medusa-wrapper'.format(upload.work_dir), job._run.call_args[0][3])
+            self.assertEqual(upload.work_dir, remote.work_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from medusa.backup_scope import BackupScope
+
+
+class BackupScopeTest(unittest.TestCase):
+
+    def test_covers(self):
+        everything = BackupScope()
+        self.assertFalse(everything.is_partial)
+        self.assertTrue(everything.covers('ks1', 'table1-1234'))
+
+        scope = BackupScope(['ks1'], ['ks2.hot', 'ks1.table1'])
+        self.assertTrue(scope.is_partial)
+        # the table of ks1 is part of the keyspace already
+        self.assertEqual(['ks2.hot'], scope.tables)
+        self.assertTrue(scope.covers('ks1', 'table1-1234'))
+        self.assertTrue(scope.covers('ks2', 'hot-5678'))
+        self.assertFalse(scope.covers('ks2', 'cold-9abc'))
+
+    def test_covers_scope(self):
+        hot = BackupScope(tables=['ks2.hot'])
+        self.assertTrue(BackupScope().covers_scope(hot))
+        self.assertTrue(BackupScope(['ks2']).covers_scope(hot))
+        self.assertTrue(hot.covers_scope(hot))
+        self.assertFalse(hot.covers_scope(BackupScope()))
+        self.assertFalse(hot.covers_scope(BackupScope(['ks2'])))
+        self.assertFalse(BackupScope(tables=['ks2.cold']).covers_scope(hot))
+
+    def test_json(self):
+        scope = BackupScope(['ks1'], ['ks2.hot'])
+        self.assertEqual(scope, BackupScope.from_json(scope.to_json()))
+        self.assertEqual('ks1, ks2.hot', str(scope))
+
+    def test_invalid_table(self):
+        with self.assertRaises(ValueError):
+            BackupScope(tables=['hot'])
+
+
+if __name__ == '__main__':
+    unittest.main()
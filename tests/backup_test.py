@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import configparser
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import MagicMock, Mock, patch
+
+import medusa.storage.checksum
+import medusa.storage.concurrent
+
+from medusa.backup import NodeBackupCache, backup_rolling_snapshots, backup_snapshots, do_backup, stagger
+from medusa.backup_journal import BackupJournal
+from medusa.backup_scope import BackupScope
+from medusa.cassandra_utils import SnapshotPath
+from medusa.download import download_data
+from medusa.index import clean_latest_backup_from_index, set_backup_finished_in_index, update_backup_index
+from medusa.manifest import object_key
+from medusa.purge import get_file_paths_from_storage
+from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict
+from medusa.storage import ManifestObject, Storage
+from medusa.storage.abstract_storage import key_shard
+from medusa.storage.checksum import get_checksum
+from medusa.verify import validate_manifest
+
+
+class BackupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.medusa_bucket_dir = "/tmp/medusa_backup_test_bucket"
+        if os.path.isdir(self.medusa_bucket_dir):
+            shutil.rmtree(self.medusa_bucket_dir)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp_dir.name)
+
+        config = configparser.ConfigParser(interpolation=None)
+        config['storage'] = {
+            'host_file_separator': ',',
+            'bucket_name': 'medusa_backup_test_bucket',
+            'storage_provider': 'local',
+            'fqdn': '127.0.0.1',
+            'base_path': '/tmp'
+        }
+        self.config = MedusaConfig(
+            storage=_namedtuple_from_dict(StorageConfig, config['storage']),
+            monitoring={},
+            cassandra=None,
+            ssh=None,
+            restore=None
+        )
+        self.storage = Storage(config=self.config.storage)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        shutil.rmtree(self.medusa_bucket_dir, ignore_errors=True)
+
+    def make_snapshot(self, tables):
+        snapshot_paths = []
+        for (keyspace, table), files in tables.items():
+            path = self.root / keyspace / table / 'snapshots' / 'medusa-test'
+            path.mkdir(parents=True)
+            for name, content in files.items():
+                (path / name).write_bytes(content)
+            snapshot_paths.append(SnapshotPath(path, keyspace, table))
+        snapshot = Mock()
+        snapshot.find_dirs.return_value = snapshot_paths
+        return snapshot
+
+    def test_backup_snapshots(self):
+        tables = {
+            ('ks1', 'table1-1234'): {'md-1-big-Data.db': b'data1', 'md-1-big-Index.db': b'index1'},
+            ('ks1', 'table2-5678'): {'md-1-big-Data.db': b'data2'},
+            ('ks2', 'table3-9abc'): {},
+        }
+        snapshot = self.make_snapshot(tables)
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=self.storage.storage_driver,
+                                            storage_provider=self.storage.storage_provider)
+
+        manifest = []
+        num_files = backup_snapshots(self.storage, manifest, node_backup, node_backup_cache, snapshot)
+
+        self.assertEqual(3, num_files)
+        # sections come in the order the tables completed
+        self.assertEqual(
+            [('ks1', 'table1-1234'), ('ks1', 'table2-5678'), ('ks2', 'table3-9abc')],
+            sorted((section['keyspace'], section['columnfamily']) for section in manifest)
+        )
+        for section in manifest:
+            files = tables[(section['keyspace'], section['columnfamily'])]
+            self.assertEqual(
+                sorted('127.0.0.1/data/{}/{}/{}'.format(section['keyspace'], section['columnfamily'], name)
+                       for name in files),
+                sorted(obj['path'] for obj in section['objects'])
+            )
+            for obj in section['objects']:
+                self.assertEqual(len(files[pathlib.PurePath(obj['path']).name]), obj['size'])
+                self.assertIsNotNone(self.storage.storage_driver.get_blob(obj['path']))
+
+    def test_sections_appended_as_tables_complete(self):
+        snapshot = self.make_snapshot({
+            ('ks1', 'table1-1234'): {'md-1-big-Data.db': b'data1', 'md-1-big-Index.db': b'index1'},
+            ('ks1', 'table2-5678'): {'md-1-big-Data.db': b'data2'},
+            ('ks2', 'table3-9abc'): {},
+        })
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=self.storage.storage_driver,
+                                            storage_provider=self.storage.storage_provider)
+        manifest = []
+        upload_files = self.storage.storage_driver.upload_files
+        sections_written = []
+
+        def recording_upload_files(transfers):
+            for result in upload_files(transfers):
+                sections_written.append(len(manifest))
+                yield result
+
+        with patch.object(self.storage.storage_driver, 'upload_files', side_effect=recording_upload_files):
+            backup_snapshots(self.storage, manifest, node_backup, node_backup_cache, snapshot)
+
+        # the table without files is written once the tables are listed, the first one to complete before the
+        # last file of the other is uploaded
+        self.assertEqual(3, len(sections_written))
+        self.assertGreaterEqual(sections_written[0], 1)
+        self.assertEqual(2, sections_written[-1])
+        self.assertEqual(3, len(manifest))
+
+    def test_backup_snapshots_from_several_data_directories(self):
+        snapshot_paths = []
+        for disk, name in [('disk1', 'md-1-big-Data.db'), ('disk2', 'md-2-big-Data.db')]:
+            path = self.root / disk / 'ks1' / 'table1-1234' / 'snapshots' / 'medusa-test'
+            path.mkdir(parents=True)
+            (path / name).write_bytes(name.encode())
+            snapshot_paths.append(SnapshotPath(path, 'ks1', 'table1-1234'))
+        snapshot = Mock()
+        snapshot.find_dirs.return_value = snapshot_paths
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=self.storage.storage_driver,
+                                            storage_provider=self.storage.storage_provider)
+
+        manifest = []
+        num_files = backup_snapshots(self.storage, manifest, node_backup, node_backup_cache, snapshot)
+
+        # the files of both disks make a single section of the manifest
+        self.assertEqual(2, num_files)
+        self.assertEqual(1, len(manifest))
+        self.assertEqual(['md-1-big-Data.db', 'md-2-big-Data.db'],
+                         sorted(pathlib.PurePath(obj['path']).name for obj in manifest[0]['objects']))
+
+    def test_backup_rolling_snapshots(self):
+        tables = {
+            ('ks1', 'table1-1234'): {'md-1-big-Data.db': b'data1'},
+            ('ks1', 'table2-5678'): {'md-1-big-Data.db': b'data2'},
+            ('ks2', 'table3-9abc'): {'md-1-big-Data.db': b'data3'},
+        }
+        snapshots = []
+
+        def create_snapshot(tag, scope):
+            # only the tables of the batch are on disk while it uploads
+            self.assertEqual([], list(self.root.glob('*/*/snapshots/*')))
+            batch = {(keyspace, table): files for (keyspace, table), files in tables.items()
+                     if scope.covers(keyspace, table)}
+            snapshot = self.make_snapshot(batch)
+            snapshot.__enter__ = Mock(return_value=snapshot)
+            snapshot.__exit__ = Mock(side_effect=lambda *args: shutil.rmtree(str(self.root)))
+            snapshots.append((scope, snapshot))
+            return snapshot
+
+        cassandra = MagicMock()
+        cassandra.new_session.return_value.__enter__.return_value.tables.return_value = [
+            'ks1.table1', 'ks1.table2', 'ks2.table3'
+        ]
+        cassandra.create_snapshot.side_effect = create_snapshot
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=self.storage.storage_driver,
+                                            storage_provider=self.storage.storage_provider)
+
+        manifest = []
+        num_files = backup_rolling_snapshots(cassandra, self.storage, manifest, node_backup, node_backup_cache,
+                                             'medusa-backup1', BackupScope(keyspaces=['ks1']), 1)
+
+        # ks2 is out of the scope, each table of ks1 got a snapshot of its own
+        self.assertEqual(2, num_files)
+        self.assertEqual([BackupScope(tables=['ks1.table1']), BackupScope(tables=['ks1.table2'])],
+                         [scope for scope, _ in snapshots])
+        self.assertEqual(['table1-1234', 'table2-5678'], [section['columnfamily'] for section in manifest])
+        for section in manifest:
+            self.assertIsInstance(section['snapshot_time'], int)
+            self.assertEqual(1, len(section['objects']))
+
+    def test_full_backup_copies_unchanged_files(self):
+        tables = {('ks1', 'table1-1234'): {'md-1-big-Data.db': b'data1', 'md-1-big-Index.db': b'index1'}}
+        snapshot = self.make_snapshot(tables)
+        node_backups = []
+        manifests = []
+        for name in ['backup1', 'backup2']:
+            node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name=name, differential_mode=False)
+            node_backup_cache = NodeBackupCache(node_backup=node_backups[-1] if node_backups else None,
+                                                differential_mode=False,
+                                                storage_driver=self.storage.storage_driver,
+                                                storage_provider=self.storage.storage_provider)
+            manifest = []
+            backup_snapshots(self.storage, manifest, node_backup, node_backup_cache, snapshot)
+            node_backup.manifest = json.dumps(manifest)
+            node_backups.append(node_backup)
+            manifests.append(manifest)
+
+        self.assertEqual(2, node_backup_cache.replaced)
+        previous_objects, copied_objects = (sorted(m[0]['objects'], key=lambda obj: obj['path']) for m in manifests)
+        for previous, copied in zip(previous_objects, copied_objects):
+            self.assertEqual(previous['path'].replace('backup1', 'backup2'), copied['path'])
+            self.assertEqual(previous['MD5'], copied['MD5'])
+            # the copy shares the data of the file of the previous backup
+            self.assertTrue(os.path.samefile(
+                self.storage.storage_driver.get_cache_path(previous['path']),
+                self.storage.storage_driver.get_cache_path(copied['path'])
+            ))
+
+    def test_compressed_backup(self):
+        tables = {('ks1', 'table1-1234'): {
+            'md-1-big-Data.db': b'compressed by cassandra',
+            'md-1-big-CompressionInfo.db': b'info' * 1000,
+            'md-2-big-Data.db': b'not compressed' * 1000,
+        }}
+        storage_config = self.config.storage._replace(compression_codec='zlib')
+        storage = Storage(config=storage_config)
+        snapshot = self.make_snapshot(tables)
+        node_backup = storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=storage.storage_driver,
+                                            storage_provider=storage.storage_provider)
+        manifest = []
+        backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot)
+        node_backup.manifest = json.dumps(manifest)
+
+        objects = {pathlib.PurePath(obj['path']).name: obj for obj in manifest[0]['objects']}
+        self.assertNotIn('codec', objects['md-1-big-Data.db'])
+        for name in ['md-1-big-CompressionInfo.db', 'md-2-big-Data.db']:
+            self.assertEqual('zlib', objects[name]['codec'])
+            self.assertEqual(len(tables[('ks1', 'table1-1234')][name]), objects[name]['size'])
+            self.assertLess(objects[name]['stored_size'], objects[name]['size'])
+
+        destination = self.root / 'download'
+        download_data(storage_config, node_backup, {'ks1.table1-1234'}, destination)
+        for name, content in tables[('ks1', 'table1-1234')].items():
+            self.assertEqual(content, (destination / 'ks1' / 'table1-1234' / name).read_bytes())
+
+    def test_packed_backup(self):
+        tables = {('ks1', 'table1-1234'): {
+            'md-1-big-Data.db': b'data' * 1000,
+            'md-1-big-Index.db': b'index1',
+            'md-1-big-TOC.txt': b'toc1',
+            'md-2-big-Data.db': b'data2',
+        }}
+        storage_config = self.config.storage._replace(pack_max_file_size='1024')
+        storage = Storage(config=storage_config)
+        snapshot = self.make_snapshot(tables)
+        node_backup = storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=storage.storage_driver,
+                                            storage_provider=storage.storage_provider)
+        manifest = []
+        backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot)
+        node_backup.manifest = json.dumps(manifest)
+
+        objects = {pathlib.PurePath(obj['path']).name: obj for obj in manifest[0]['objects']}
+        # the large file and the lone small file of md-2 are objects of their own
+        self.assertNotIn('archive', objects['md-1-big-Data.db'])
+        self.assertNotIn('archive', objects['md-2-big-Data.db'])
+        archive = '127.0.0.1/data/ks1/table1-1234/md-1-big.pack'
+        self.assertEqual(archive, objects['md-1-big-Index.db']['archive'])
+        self.assertEqual(archive, objects['md-1-big-TOC.txt']['archive'])
+        self.assertEqual(
+            ['md-1-big-Data.db', 'md-1-big.pack', 'md-2-big-Data.db'],
+            sorted(pathlib.PurePath(obj.name).name for obj in storage.storage_driver.list_objects('127.0.0.1/data'))
+        )
+
+        destination = self.root / 'download'
+        download_data(storage_config, node_backup, {'ks1.table1-1234'}, destination)
+        self.assertEqual(sorted(tables[('ks1', 'table1-1234')]),
+                         sorted(os.listdir(str(destination / 'ks1' / 'table1-1234'))))
+        for name, content in tables[('ks1', 'table1-1234')].items():
+            self.assertEqual(content, (destination / 'ks1' / 'table1-1234' / name).read_bytes())
+
+        # a section needing only some of the files of an archive only downloads the part of it holding them
+        toc = objects['md-1-big-TOC.txt']
+        manifest[0]['objects'] = [toc]
+        node_backup.manifest = json.dumps(manifest)
+        destination = self.root / 'partial_download'
+        with patch('medusa.storage.concurrent.download_blob_ranges',
+                   wraps=medusa.storage.concurrent.download_blob_ranges) as download_blob_ranges:
+            download_data(storage_config, node_backup, {'ks1.table1-1234'}, destination)
+        self.assertEqual([(archive, toc['offset'], toc['offset'] + toc['size'])],
+                         download_blob_ranges.call_args[0][1])
+        self.assertEqual(['md-1-big-TOC.txt'], os.listdir(str(destination / 'ks1' / 'table1-1234')))
+        self.assertEqual(b'toc1', (destination / 'ks1' / 'table1-1234' / 'md-1-big-TOC.txt').read_bytes())
+
+    def test_hashed_key_layout(self):
+        tables = {('ks1', 'table1-1234'): {
+            'md-1-big-Data.db': b'data' * 1000,
+            'md-1-big-Index.db': b'index1',
+            'md-1-big-TOC.txt': b'toc1',
+        }}
+        storage_config = self.config.storage._replace(key_layout='hashed', pack_max_file_size='100')
+        storage = Storage(config=storage_config)
+        snapshot = self.make_snapshot(tables)
+        node_backup = storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=storage.storage_driver,
+                                            storage_provider=storage.storage_provider)
+        manifest = []
+        backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot)
+        node_backup.manifest = json.dumps(manifest)
+
+        # the manifest keeps the paths of the files, their objects are under the shard of their path
+        for obj in manifest[0]['objects']:
+            self.assertTrue(obj['path'].startswith('127.0.0.1/data/ks1/table1-1234/'))
+            self.assertEqual(key_shard(obj.get('archive', obj['path'])), obj['shard'])
+            self.assertIsNone(storage.storage_driver.get_blob(obj.get('archive', obj['path'])))
+            self.assertIsNotNone(storage.storage_driver.get_blob(object_key(obj)))
+        self.assertEqual([], list(validate_manifest(storage, node_backup)))
+        self.assertEqual({object_key(obj) for obj in manifest[0]['objects']},
+                         get_file_paths_from_storage(storage, '127.0.0.1', hashed=True))
+
+        destination = self.root / 'download'
+        download_data(storage_config, node_backup, {'ks1.table1-1234'}, destination)
+        for name, content in tables[('ks1', 'table1-1234')].items():
+            self.assertEqual(content, (destination / 'ks1' / 'table1-1234' / name).read_bytes())
+
+        # files the next backups reference keep the key they got, whatever layout the storage uses by then
+        storage = Storage(config=self.config.storage._replace(pack_max_file_size='100'))
+        node_backup_cache = NodeBackupCache(node_backup=node_backup, differential_mode=True,
+                                            storage_driver=storage.storage_driver,
+                                            storage_provider=storage.storage_provider)
+        next_manifest = []
+        backup_snapshots(storage, next_manifest, storage.get_node_backup(fqdn='127.0.0.1', name='backup2',
+                                                                         differential_mode=True),
+                         node_backup_cache, snapshot)
+        self.assertEqual(3, node_backup_cache.replaced)
+        self.assertEqual(sorted(manifest[0]['objects'], key=lambda obj: obj['path']),
+                         sorted(next_manifest[0]['objects'], key=lambda obj: obj['path']))
+
+    def test_backup_with_another_checksum(self):
+        tables = {('ks1', 'table1-1234'): {
+            'md-1-big-Data.db': b'data' * 1000,
+            'md-1-big-Index.db': b'index1',
+            'md-1-big-TOC.txt': b'toc1',
+        }}
+        storage_config = self.config.storage._replace(checksum_algorithm='blake2', single_pass_upload='True',
+                                                      pack_max_file_size='100')
+        storage = Storage(config=storage_config)
+        snapshot = self.make_snapshot(tables)
+        node_backup = storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=storage.storage_driver, storage_provider='s3')
+        manifest = []
+        backup_snapshots(storage, manifest, node_backup, node_backup_cache, snapshot)
+        node_backup.manifest = json.dumps(manifest)
+
+        for obj in manifest[0]['objects']:
+            content = tables[('ks1', 'table1-1234')][pathlib.PurePath(obj['path']).name]
+            self.assertEqual('blake2', obj['checksum'])
+            self.assertEqual(get_checksum('blake2').digest(content), obj['MD5'])
+            if 'archive' not in obj:
+                # the object gets verified against the hash the storage gave it
+                self.assertIn('etag', obj)
+        self.assertEqual([], list(validate_manifest(storage, node_backup)))
+        destination = self.root / 'download'
+        download_data(storage_config, node_backup, {'ks1.table1-1234'}, destination)
+        for name, content in tables[('ks1', 'table1-1234')].items():
+            self.assertEqual(content, (destination / 'ks1' / 'table1-1234' / name).read_bytes())
+
+        # the next backup finds the files which changed with the checksum of the previous one, whatever the
+        # configured one
+        (snapshot.find_dirs()[0].path / 'md-1-big-Data.db').write_bytes(b'atad' * 1000)
+        storage = Storage(config=self.config.storage)
+        node_backup_cache = NodeBackupCache(node_backup=node_backup, differential_mode=True,
+                                            storage_driver=storage.storage_driver, storage_provider='s3')
+        next_manifest = []
+        backup_snapshots(storage, next_manifest, storage.get_node_backup(fqdn='127.0.0.1', name='backup2',
+                                                                         differential_mode=True),
+                         node_backup_cache, snapshot)
+        self.assertEqual(2, node_backup_cache.replaced)
+        checksums = {pathlib.PurePath(obj['path']).name: obj.get('checksum') for obj in next_manifest[0]['objects']}
+        self.assertEqual({'md-1-big-Data.db': None, 'md-1-big-Index.db': 'blake2', 'md-1-big-TOC.txt': 'blake2'},
+                         checksums)
+
+    def test_unavailable_checksum_counts_as_changed(self):
+        snapshot = self.make_snapshot({('ks1', 'table1-1234'): {'md-1-big-Data.db': b'data1'}})
+        src = snapshot.find_dirs()[0].path / 'md-1-big-Data.db'
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=self.storage.storage_driver, storage_provider='s3')
+        cached_item = {'path': str(src), 'size': 5, 'MD5': 'n03x6A==', 'checksum': 'crc32c'}
+        with patch.dict(medusa.storage.checksum.CHECKSUMS):
+            medusa.storage.checksum.CHECKSUMS.pop('crc32c', None)
+            node_backup_cache.hash_files([(src, 'crc32c')])
+            self.assertTrue(node_backup_cache.files_are_different(src, cached_item))
+
+    def test_stagger(self):
+        tokenmap = {
+            'node1': {'tokens': [-100], 'is_up': True},
+            'node2': {'tokens': [0], 'is_up': True},
+            'node3': {'tokens': [100], 'is_up': True},
+        }
+        self.storage.storage_driver.list_objects = Mock(side_effect=AssertionError('the index got listed'))
+
+        self.assertTrue(stagger('node1', self.storage, tokenmap))
+        self.assertFalse(stagger('node2', self.storage, tokenmap))
+        set_backup_finished_in_index(self.storage, Mock(fqdn='node1', finished=1234))
+        self.assertTrue(stagger('node2', self.storage, tokenmap))
+        # node2 has no backup yet, neither in the new marker nor in the latest backup of previous versions
+        self.assertFalse(stagger('node3', self.storage, tokenmap))
+        self.storage.storage_driver.upload_blob_from_string('index/latest_backup/node2/backup_name.txt', 'backup1')
+        self.assertTrue(stagger('node3', self.storage, tokenmap))
+
+    def test_stagger_waits_for_full_backups(self):
+        tokenmap = {
+            'node1': {'tokens': [-100], 'is_up': True},
+            'node2': {'tokens': [0], 'is_up': True},
+        }
+        for name, scope in [('partial', BackupScope(keyspaces=['ks1'])), ('full', BackupScope())]:
+            node_backup = self.storage.get_node_backup(fqdn='node1', name=name, differential_mode=True)
+            node_backup.schema = 'CREATE KEYSPACE ks1'
+            node_backup.tokenmap = json.dumps(tokenmap)
+            node_backup.scope = scope
+            node_backup.manifest = json.dumps([])
+            update_backup_index(self.storage, node_backup)
+            # a partial backup of the previous node leaves tables to back up
+            self.assertEqual(not scope.is_partial, stagger('node2', self.storage, tokenmap))
+
+        clean_latest_backup_from_index(self.storage, 'node1')
+        self.assertFalse(stagger('node2', self.storage, tokenmap))
+
+    def test_index_written_from_metadata_in_memory(self):
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup.schema = 'CREATE KEYSPACE ks1'
+        node_backup.tokenmap = json.dumps({'127.0.0.1': {'tokens': [0], 'is_up': True}})
+        node_backup.scope = BackupScope()
+        node_backup.manifest = json.dumps([])
+
+        driver = self.storage.storage_driver
+        read_back = AssertionError('metadata got read back from the storage')
+        driver.read_blob_as_string = Mock(side_effect=read_back)
+        driver.get_blob_content_as_string = Mock(side_effect=read_back)
+        update_backup_index(self.storage, node_backup)
+        del driver.read_blob_as_string
+        del driver.get_blob_content_as_string
+
+        self.assertEqual(9, len(driver.list_objects('index/')))
+        self.assertEqual(node_backup.tokenmap,
+                         driver.get_blob_content_as_string('index/latest_backup/127.0.0.1/tokenmap.json'))
+        self.assertEqual('CREATE KEYSPACE ks1',
+                         driver.get_blob_content_as_string('index/backup_index/backup1/schema_127.0.0.1.cql'))
+        self.assertEqual(str(node_backup.finished),
+                         driver.get_blob_content_as_string('index/backup_finished/127.0.0.1.timestamp'))
+
+    def test_failed_backup_clears_its_snapshot(self):
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='failed', differential_mode=True)
+        for keep_snapshot in (False, True):
+            cassandra = Mock(root=self.root / 'data')
+            cassandra.snapshot_exists.return_value = False
+            with patch('medusa.backup.backup_snapshots', side_effect=IOError('interrupted')):
+                with self.assertRaises(IOError):
+                    do_backup(cassandra, node_backup, self.storage, True, '127.0.0.1', keep_snapshot=keep_snapshot)
+            snapshot = cassandra.create_snapshot.return_value
+            self.assertEqual(not keep_snapshot, snapshot.delete.called)
+
+    def test_resumed_backup_skips_journaled_files(self):
+        tables = {('ks1', 'table1-1234'): {'md-1-big-Data.db': b'data1', 'md-2-big-Data.db': b'data2'}}
+        snapshot = self.make_snapshot(tables)
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        dst_path = str(node_backup.datapath(keyspace='ks1', columnfamily='table1-1234'))
+        journal_path = self.root / 'journal.jsonl'
+
+        # the previous run uploaded md-1 before getting interrupted, md-2 changed since it got journaled
+        journal = BackupJournal(journal_path)
+        uploaded = ManifestObject('{}/md-1-big-Data.db'.format(dst_path), 5, 'journaled-md5')
+        journal.add(dst_path, uploaded)
+        journal.add(dst_path, ManifestObject('{}/md-2-big-Data.db'.format(dst_path), 3, 'stale-md5'))
+        journal.close()
+        with open(str(journal_path), 'a') as f:
+            f.write('{"dest": "truncated')
+
+        journal = BackupJournal(journal_path).load()
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=self.storage.storage_driver,
+                                            storage_provider=self.storage.storage_provider)
+        manifest = []
+        num_files = backup_snapshots(self.storage, manifest, node_backup, node_backup_cache, snapshot, journal)
+        journal.close()
+
+        self.assertEqual(2, num_files)
+        objects = {pathlib.PurePath(obj['path']).name: obj for obj in manifest[0]['objects']}
+        self.assertEqual('journaled-md5', objects['md-1-big-Data.db']['MD5'])
+        self.assertIsNone(self.storage.storage_driver.get_blob(objects['md-1-big-Data.db']['path']))
+        self.assertIsNotNone(self.storage.storage_driver.get_blob(objects['md-2-big-Data.db']['path']))
+        # the new upload got journaled as well
+        self.assertEqual(5, BackupJournal(journal_path).load().get(dst_path, 'md-2-big-Data.db', 5).size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -101,6 +101,14 @@ class CassandraUtilsTest(unittest.TestCase):
             token_map
         )
 
+    def test_tables_include_views(self):
+        session = Mock()
+        session.cluster.metadata.keyspaces = {
+            'ks1': Mock(tables={'table1': Mock()}, views={'table1_by_value': Mock()}),
+            'system_traces': Mock(tables={'events': Mock()}, views={}),
+        }
+        self.assertEqual(['ks1.table1', 'ks1.table1_by_value'], CqlSession(session).tables())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from medusa.checksum_cache import ChecksumCache
+
+
+class ChecksumCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp_dir.name)
+        self.table_dir = self.root / 'ks' / 'table-1234'
+        self.snapshot_dir = self.table_dir / 'snapshots' / 'medusa-1'
+        self.snapshot_dir.mkdir(parents=True)
+        self.cache_file = self.root / 'cache.json'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_sstable(self, name, content, snapshot_dir=None):
+        live = self.table_dir / name
+        live.write_bytes(content)
+        snapshot = (snapshot_dir or self.snapshot_dir) / name
+        os.link(str(live), str(snapshot))
+        return snapshot
+
+    def test_live_path(self):
+        self.assertEqual(
+            self.table_dir / 'md-1-big-Data.db',
+            ChecksumCache.live_path(self.snapshot_dir / 'md-1-big-Data.db')
+        )
+        self.assertEqual(
+            self.table_dir / 'md-1-big-Data.db',
+            ChecksumCache.live_path(self.table_dir / 'md-1-big-Data.db')
+        )
+
+    def test_digest_survives_new_snapshot(self):
+        src = self.make_sstable('md-1-big-Data.db', b'data')
+        cache = ChecksumCache(self.cache_file)
+        self.assertIsNone(cache.get(src))
+        cache.put(src, 'digest')
+        cache.save()
+
+        # the next backup sees the same SSTable through another snapshot
+        other_snapshot_dir = self.table_dir / 'snapshots' / 'medusa-2'
+        other_snapshot_dir.mkdir()
+        other_src = other_snapshot_dir / src.name
+        os.link(str(src), str(other_src))
+        cache = ChecksumCache(self.cache_file).load()
+        self.assertEqual('digest', cache.get(other_src))
+        self.assertEqual(1, cache.hits)
+
+    def test_stale_entry_is_invalidated(self):
+        src = self.make_sstable('md-1-big-Data.db', b'data')
+        cache = ChecksumCache(self.cache_file)
+        cache.put(src, 'digest')
+        (self.table_dir / src.name).write_bytes(b'other data')
+        self.assertIsNone(cache.get(src))
+        self.assertEqual(0, len(cache))
+
+    def test_digest_of_another_checksum_is_a_miss(self):
+        src = self.make_sstable('md-1-big-Data.db', b'data')
+        cache = ChecksumCache(self.cache_file)
+        cache.put(src, 'md5 digest')
+        self.assertIsNone(cache.get(src, 'blake2'))
+        cache.put(src, 'blake2 digest', 'blake2')
+        cache.save()
+
+        cache = ChecksumCache(self.cache_file).load()
+        self.assertEqual('blake2 digest', cache.get(src, 'blake2'))
+        self.assertIsNone(cache.get(src))
+
+    def test_deleted_sstables_are_evicted(self):
+        kept = self.make_sstable('md-1-big-Data.db', b'data')
+        deleted = self.make_sstable('md-2-big-Data.db', b'data')
+        cache = ChecksumCache(self.cache_file)
+        cache.put(kept, 'kept')
+        cache.put(deleted, 'deleted')
+        cache.save()
+
+        os.remove(str(self.table_dir / deleted.name))
+        os.remove(str(deleted))
+        cache = ChecksumCache(self.cache_file).load()
+        cache.save()
+        cache = ChecksumCache(self.cache_file).load()
+        self.assertEqual('kept', cache.get(kept))
+        self.assertEqual(1, len(cache))
+
+    def test_cache_is_bounded(self):
+        cache = ChecksumCache(self.cache_file, max_entries=2)
+        srcs = [self.make_sstable('md-{}-big-Data.db'.format(i), b'data') for i in range(3)]
+        for src in srcs:
+            cache.put(src, src.name)
+        # the first entry becomes the most recently used one
+        cache.get(srcs[0])
+        cache.save()
+        cache = ChecksumCache(self.cache_file).load()
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(srcs[1]))
+        self.assertEqual(srcs[0].name, cache.get(srcs[0]))
+
+    def test_unreadable_cache_is_ignored(self):
+        self.cache_file.write_text('not json')
+        cache = ChecksumCache(self.cache_file).load()
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+import medusa.storage.checksum
+
+from medusa.backup import generate_checksum, generate_checksums
+from medusa.storage.checksum import CHECKSUMS, get_checksum
+
+
+THROUGHPUT_DATA_SIZE = 64 * 1024 * 1024
+
+
+class ChecksumTest(unittest.TestCase):
+
+    def test_md5_is_the_default(self):
+        self.assertIs(get_checksum('md5'), get_checksum())
+        self.assertIsNone(get_checksum().recorded_name)
+        self.assertEqual(base64.b64encode(hashlib.md5(b'data').digest()).decode('UTF-8'),
+                         get_checksum().digest(b'data'))
+
+    def test_unknown_checksum(self):
+        with self.assertRaises(ValueError):
+            get_checksum('sha0')
+        for name, package in medusa.storage.checksum.OPTIONAL_CHECKSUMS.items():
+            if name not in CHECKSUMS:
+                with self.assertRaisesRegex(ValueError, package):
+                    get_checksum(name)
+
+    def test_file_digests(self):
+        with tempfile.NamedTemporaryFile() as tf:
+            data = os.urandom(100000)
+            tf.write(data)
+            tf.flush()
+            for name, checksum in CHECKSUMS.items():
+                with self.subTest(checksum=name):
+                    self.assertEqual(checksum.digest(data), generate_checksum(tf.name, name, block_size=4096))
+                    self.assertNotEqual(checksum.digest(data), checksum.digest(data[:-1]))
+            self.assertEqual([CHECKSUMS[name].digest(data) for name in CHECKSUMS],
+                             generate_checksums([tf.name] * len(CHECKSUMS), list(CHECKSUMS), max_workers=2))
+
+    def test_throughput(self):
+        # Timings depend on the host, they are only logged for comparing the checksums
+        data = os.urandom(THROUGHPUT_DATA_SIZE)
+        throughputs = {}
+        for name, checksum in sorted(CHECKSUMS.items()):
+            digest = checksum.new()
+            start = time.perf_counter()
+            for offset in range(0, len(data), 1024 * 1024):
+                digest.update(data[offset:offset + 1024 * 1024])
+            chunked_digest = checksum.encode(digest.digest())
+            throughputs[name] = len(data) / (time.perf_counter() - start) / 1024 / 1024
+            # hashing a file a block at a time gives the digest of its whole content
+            self.assertEqual(checksum.digest(data), chunked_digest, name)
+        logging.info('Checksum throughput: {}'.format(
+            ', '.join('{} {:.0f} MB/s'.format(name, throughput) for name, throughput in throughputs.items())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import unittest
+
+from medusa.storage.connection_pool import ConnectionPool, HEALTH_CHECK_AFTER_SECONDS
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.connections = itertools.count()
+        self.unhealthy = set()
+
+    def make_pool(self, **kwargs):
+        return ConnectionPool(lambda: next(self.connections), check=lambda c: c not in self.unhealthy,
+                              clock=lambda: self.now, **kwargs)
+
+    def test_connections_are_reused(self):
+        pool = self.make_pool()
+        with pool.connection() as first:
+            with pool.connection() as second:
+                self.assertNotEqual(first, second)
+        with pool.connection() as connection:
+            self.assertIn(connection, (first, second))
+        self.assertEqual(2, pool.created)
+
+    def test_pool_size_is_bounded(self):
+        pool = self.make_pool(max_size=1)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        self.assertEqual(1, len(pool))
+
+    def test_failed_connections_are_dropped(self):
+        pool = self.make_pool()
+        with self.assertRaises(IOError):
+            with pool.connection():
+                raise IOError('connection reset')
+        self.assertEqual(0, len(pool))
+
+    def test_idle_connections_are_evicted(self):
+        pool = self.make_pool(max_idle_seconds=60)
+        pool.release(pool.acquire())
+        self.now += 60
+        self.assertEqual(1, pool.acquire())
+
+    def test_idle_connections_are_checked(self):
+        pool = self.make_pool(max_idle_seconds=600)
+        healthy, broken = pool.acquire(), pool.acquire()
+        pool.release(healthy)
+        pool.release(broken)
+        self.unhealthy.add(broken)
+        self.now += HEALTH_CHECK_AFTER_SECONDS
+        self.assertEqual(healthy, pool.acquire())
+        self.assertEqual(0, len(pool))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import configparser
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import Mock
+
+from medusa.backup import NodeBackupCache, backup_snapshots
+from medusa.backup_journal import BackupJournal
+from medusa.cassandra_utils import SnapshotPath
+from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict
+from medusa.continuous import compact_journal, ship_incremental_backups
+from medusa.storage import Storage
+
+
+class ContinuousTest(unittest.TestCase):
+
+    def setUp(self):
+        self.medusa_bucket_dir = "/tmp/medusa_continuous_test_bucket"
+        if os.path.isdir(self.medusa_bucket_dir):
+            shutil.rmtree(self.medusa_bucket_dir)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp_dir.name) / 'data'
+
+        config = configparser.ConfigParser(interpolation=None)
+        config['storage'] = {
+            'host_file_separator': ',',
+            'bucket_name': 'medusa_continuous_test_bucket',
+            'storage_provider': 'local',
+            'fqdn': '127.0.0.1',
+            'base_path': '/tmp'
+        }
+        self.config = MedusaConfig(
+            storage=_namedtuple_from_dict(StorageConfig, config['storage']),
+            monitoring={},
+            cassandra=None,
+            ssh=None,
+            restore=None
+        )
+        self.storage = Storage(config=self.config.storage)
+        self.node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='continuous', differential_mode=True)
+        self.journal = BackupJournal(pathlib.Path(self.tmp_dir.name) / 'journal.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        shutil.rmtree(self.medusa_bucket_dir, ignore_errors=True)
+
+    def flush(self, name, content):
+        # Cassandra hardlinks the flushed SSTables in the backups folder of the table
+        table_dir = self.root / 'ks1' / 'table1-1234'
+        (table_dir / 'backups').mkdir(parents=True, exist_ok=True)
+        (table_dir / name).write_bytes(content)
+        os.link(str(table_dir / name), str(table_dir / 'backups' / name))
+
+    def test_ship_incremental_backups(self):
+        self.flush('md-1-big-Data.db', b'data1')
+        self.flush('md-2-big-Data.db', b'data2')
+
+        self.assertEqual(2, ship_incremental_backups(self.storage, self.node_backup, [self.root], self.journal))
+        self.assertEqual([], os.listdir(str(self.root / 'ks1' / 'table1-1234' / 'backups')))
+        dst_path = str(self.node_backup.datapath(keyspace='ks1', columnfamily='table1-1234'))
+        for name in ['md-1-big-Data.db', 'md-2-big-Data.db']:
+            self.assertIsNotNone(self.storage.storage_driver.get_blob('127.0.0.1/data/ks1/table1-1234/' + name))
+            self.assertIsNotNone(self.journal.get(dst_path, name, 5))
+        self.assertEqual(0, ship_incremental_backups(self.storage, self.node_backup, [self.root], self.journal))
+
+        # compacted away, the file will not be part of any backup
+        (self.root / 'ks1' / 'table1-1234' / 'md-1-big-Data.db').unlink()
+        compact_journal(self.journal, [self.root])
+        self.assertIsNone(self.journal.get(dst_path, 'md-1-big-Data.db', 5))
+        self.assertEqual(1, len(BackupJournal(self.journal.path).load()))
+
+    def test_backup_references_shipped_files(self):
+        self.flush('md-1-big-Data.db', b'data1')
+        ship_incremental_backups(self.storage, self.node_backup, [self.root], self.journal)
+        self.journal.close()
+        # mark the shipped object, so uploading the file again would show
+        shipped_path = pathlib.Path(self.medusa_bucket_dir) / '127.0.0.1/data/ks1/table1-1234/md-1-big-Data.db'
+        shipped_path.write_bytes(b'shipped')
+
+        snapshot_dir = self.root / 'ks1' / 'table1-1234' / 'snapshots' / 'medusa-backup1'
+        snapshot_dir.mkdir(parents=True)
+        (snapshot_dir / 'md-1-big-Data.db').write_bytes(b'data1')
+        snapshot = Mock()
+        snapshot.find_dirs.return_value = [SnapshotPath(snapshot_dir, 'ks1', 'table1-1234')]
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1', differential_mode=True)
+        node_backup_cache = NodeBackupCache(node_backup=None, differential_mode=True,
+                                            storage_driver=self.storage.storage_driver,
+                                            storage_provider=self.storage.storage_provider)
+        manifest = []
+        backup_snapshots(self.storage, manifest, node_backup, node_backup_cache, snapshot,
+                         shipped=BackupJournal(self.journal.path).load())
+
+        self.assertEqual(['127.0.0.1/data/ks1/table1-1234/md-1-big-Data.db'],
+                         [obj['path'] for obj in manifest[0]['objects']])
+        # the backup did not upload the file again
+        self.assertEqual(b'shipped', shipped_path.read_bytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import configparser
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+import medusa.manifest
+
+from medusa.config import StorageConfig, _namedtuple_from_dict
+from medusa.manifest import Manifest, ManifestItem, ManifestWriter
+from medusa.storage import Storage
+
+
+SECTIONS = [
+    {'keyspace': 'ks1', 'columnfamily': 'table1-1234', 'objects': [
+        {'path': '127.0.0.1/data/ks1/table1-1234/md-1-big-Data.db', 'MD5': 'md5-1', 'size': 100},
+        {'path': '127.0.0.1/data/ks1/table1-1234/md-1-big-Index.db', 'MD5': 'md5-2', 'size': 20},
+    ]},
+    {'keyspace': 'ks1', 'columnfamily': 'table2-5678', 'objects': []},
+    {'keyspace': 'ks2', 'columnfamily': 'table3-9abc', 'objects': [
+        {'path': '127.0.0.1/data/ks2/table3-9abc/md-1-big-Data.db', 'MD5': 'md5-3', 'size': 3},
+    ]},
+]
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.medusa_bucket_dir = '/tmp/medusa_manifest_test_bucket'
+        shutil.rmtree(self.medusa_bucket_dir, ignore_errors=True)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config = configparser.ConfigParser(interpolation=None)
+        config['storage'] = {
+            'host_file_separator': ',',
+            'bucket_name': 'medusa_manifest_test_bucket',
+            'storage_provider': 'local',
+            'fqdn': '127.0.0.1',
+            'base_path': '/tmp'
+        }
+        self.storage = Storage(config=_namedtuple_from_dict(StorageConfig, config['storage']))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        shutil.rmtree(self.medusa_bucket_dir, ignore_errors=True)
+
+    def test_writer(self):
+        writer = ManifestWriter(pathlib.Path(self.tmp_dir.name) / 'manifest')
+        for section in SECTIONS:
+            writer.append(section)
+        summary = writer.close()
+
+        self.assertEqual({'format': 'jsonl', 'sections': 3, 'objects': 3, 'size': 123}, summary)
+        with writer.path.open() as f:
+            lines = f.read().splitlines()
+        self.assertEqual(summary, json.loads(lines[0]))
+        self.assertEqual(SECTIONS, [json.loads(line) for line in lines[1:]])
+        self.assertEqual(['manifest'], os.listdir(self.tmp_dir.name))
+        with writer.path.open() as f:
+            self.assertEqual(SECTIONS, list(medusa.manifest.iter_sections(f)))
+
+    def test_read_previous_manifests(self):
+        for manifest in [json.dumps(SECTIONS), json.dumps(SECTIONS, indent=2), medusa.manifest.dumps(SECTIONS)]:
+            self.assertEqual(SECTIONS, list(medusa.manifest.iter_sections(manifest)))
+            self.assertEqual(123, medusa.manifest.read_summary(manifest)['size'])
+
+    def test_manifest(self):
+        manifest = Manifest.parse(medusa.manifest.dumps(SECTIONS))
+
+        self.assertEqual(SECTIONS, [section.to_dict() for section in manifest])
+        item = manifest.get('ks1', 'table1-1234', 'md-1-big-Index.db')
+        self.assertEqual('127.0.0.1/data/ks1/table1-1234/md-1-big-Index.db', item['path'])
+        self.assertEqual(20, item['size'])
+        self.assertNotIn('archive', item)
+        self.assertEqual('127.0.0.1/data/ks1/table1-1234/md-1-big-Index.db', item.get('archive', item['path']))
+        with self.assertRaises(KeyError):
+            item['codec']
+        self.assertIsNone(manifest.get('ks1', 'table2-5678', 'md-1-big-Data.db'))
+        self.assertIsNone(manifest.get('ks3', 'table4-def0', 'md-1-big-Data.db'))
+        self.assertEqual(['md-1-big-Data.db', 'md-1-big-Index.db'],
+                         [manifest.get('ks1', 'table1-1234', name).name for name in ['md-1-big-Data.db',
+                                                                                     'md-1-big-Index.db']])
+
+        packed = ManifestItem(path='data/ks/cf/md-1-big-TOC.txt', MD5='md5', size=4, archive='data/ks/cf/md-1-big.pack',
+                              offset=12)
+        self.assertEqual(12, packed['offset'])
+        self.assertEqual({'path', 'MD5', 'size', 'archive', 'offset'}, set(packed.keys()))
+
+        # files out of the directory of their table keep their path, packed ones their archive
+        section = medusa.manifest.ManifestSection('ks', 'cf', [dict(SECTIONS[0]['objects'][0]), packed.to_dict()])
+        self.assertEqual([SECTIONS[0]['objects'][0], packed.to_dict()], [obj.to_dict() for obj in section.objects])
+        self.assertEqual(packed, section.find('md-1-big-TOC.txt'))
+
+    def test_manifest_loaded_once(self):
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1')
+        node_backup.manifest = medusa.manifest.dumps(SECTIONS)
+        manifest = node_backup.load_manifest()
+        self.assertIs(manifest, self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1').load_manifest())
+
+        # writing the manifest again drops the one loaded
+        node_backup.manifest = medusa.manifest.dumps(SECTIONS[:1])
+        self.assertEqual(1, len(self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1').load_manifest()))
+
+    def test_node_backup_summary(self):
+        writer = ManifestWriter(pathlib.Path(self.tmp_dir.name) / 'manifest')
+        for section in SECTIONS:
+            writer.append(section)
+        writer.close()
+        self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1').upload_manifest(writer.path)
+
+        # the size comes from the first line of the manifest, which is not loaded entirely
+        node_backup = self.storage.get_node_backup(fqdn='127.0.0.1', name='backup1')
+        self.assertEqual(123, node_backup.size())
+        self.assertEqual(3, node_backup.num_objects())
+        self.assertIsNone(node_backup.cached_manifest)
+        self.assertEqual(SECTIONS, [section.to_dict() for section in node_backup.sections()])
+
+        node_backup.manifest = json.dumps(SECTIONS)
+        self.assertEqual(123, node_backup.size())
+
+
+if __name__ == '__main__':
+    unittest.main()
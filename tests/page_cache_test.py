@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import medusa.page_cache
+
+from medusa.config import StorageConfig, _namedtuple_from_dict
+from medusa.page_cache import SequentialReader
+
+
+class PageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_file = tempfile.NamedTemporaryFile()
+        self.content = os.urandom(3 * medusa.page_cache.DIRECT_READ_SIZE + 123)
+        self.tmp_file.write(self.content)
+        self.tmp_file.flush()
+
+    def tearDown(self):
+        self.tmp_file.close()
+
+    def test_read_modes(self):
+        for mode in medusa.page_cache.MODES:
+            with SequentialReader(self.tmp_file.name, mode) as f:
+                self.assertEqual(len(self.content), f.size)
+                self.assertEqual(self.content[:1000], f.read(1000))
+                buffer = bytearray(4096)
+                self.assertEqual(4096, f.readinto(buffer))
+                self.assertEqual(self.content[1000:5096], buffer)
+                self.assertEqual(self.content[5096:], f.read())
+                self.assertEqual(b'', f.read(10))
+
+    def test_read_without_fadvise_constants(self):
+        content = os.urandom(medusa.page_cache.DROP_INTERVAL_BYTES + 123)
+        self.tmp_file.seek(0)
+        self.tmp_file.write(content)
+        self.tmp_file.flush()
+        constants = {name: getattr(os, name) for name in ['POSIX_FADV_SEQUENTIAL', 'POSIX_FADV_DONTNEED']
+                     if hasattr(os, name)}
+        try:
+            for name in constants:
+                delattr(os, name)
+            with SequentialReader(self.tmp_file.name, 'dontneed') as f:
+                self.assertEqual(content, f.read(len(content)))
+        finally:
+            for name, value in constants.items():
+                setattr(os, name, value)
+
+    def test_configure(self):
+        try:
+            config = _namedtuple_from_dict(StorageConfig, {'snapshot_read_mode': 'direct'})
+            self.assertEqual('direct', medusa.page_cache.configure(config))
+            self.assertEqual('direct', SequentialReader(self.tmp_file.name).mode)
+            with self.assertRaises(ValueError):
+                medusa.page_cache.configure(config._replace(snapshot_read_mode='mmap'))
+        finally:
+            medusa.page_cache.configure(_namedtuple_from_dict(StorageConfig, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,16 +15,25 @@
 
 import configparser
 import hashlib
+import json
 import os
+import tempfile
 import unittest
 
 from datetime import datetime, timedelta
 from libcloud.storage.base import Object
 from random import randrange
+from unittest import mock
 
+import medusa.manifest
+
+from medusa.backup_journal import backup_journal, continuous_journal
+from medusa.backup_scope import BackupScope
 from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict
-from medusa.storage import NodeBackup, Storage
-from medusa.purge import backups_to_purge_by_age, backups_to_purge_by_count, filter_differential_backups
+from medusa.storage import ManifestObject, NodeBackup, Storage
+from medusa.purge import backups_to_purge_by_age, backups_to_purge_by_count, filter_differential_backups, \
+    get_file_paths_from_manifests_for_differential_backups, group_backups_by_scope, journaled_paths, \
+    remaining_full_backups
 
 
 class PurgeTest(unittest.TestCase):
@@ -87,6 +96,24 @@ class PurgeTest(unittest.TestCase):
         obsolete_backups = backups_to_purge_by_count(backups, 40)
         assert len(obsolete_backups) == 0
 
+    def test_purge_backups_by_count_per_scope(self):
+        backups = list()
+        # Build a list of 10 hourly backups of a table, and 3 weekly full backups
+        for i in range(10):
+            backup_date = datetime.now() - timedelta(hours=10 - i)
+            backups.append(self.make_backup(self.storage, 'hourly{}'.format(i), backup_date,
+                                            scope=BackupScope(tables=['ks.hot'])))
+        for i in range(3):
+            backup_date = datetime.now() - timedelta(weeks=3 - i)
+            backups.append(self.make_backup(self.storage, 'weekly{}'.format(i), backup_date))
+
+        obsolete_backups = [
+            backup
+            for scope_backups in group_backups_by_scope(backups).values()
+            for backup in backups_to_purge_by_count(scope_backups, 5)
+        ]
+        assert sorted(backup.name for backup in obsolete_backups) == ['hourly{}'.format(i) for i in range(5)]
+
     def test_filter_differential_backups(self):
         backups = list()
         backups.append(self.make_backup(self.storage, "one", datetime.now(), differential=True))
@@ -96,7 +123,65 @@ class PurgeTest(unittest.TestCase):
         backups.append(self.make_backup(self.storage, "five", datetime.now(), differential=False))
         assert 3 == len(filter_differential_backups(backups))
 
-    def make_backup(self, storage, name, backup_date, differential=False):
+    def test_remaining_full_backups(self):
+        full = self.make_backup(self.storage, "full", datetime.now())
+        partial = self.make_backup(self.storage, "partial", datetime.now(), scope=BackupScope(keyspaces=['ks1']))
+        self.assertEqual([full], remaining_full_backups([full, partial], []))
+        self.assertEqual([], remaining_full_backups([full, partial], [full, full]))
+
+    def test_manifests_read_once_for_orphaned_files(self):
+        backups = []
+        for i in range(medusa.manifest.MAX_LOADED_MANIFESTS + 4):
+            backup = self.make_backup(self.storage, "many{}".format(i), datetime.now(), differential=True)
+            obj = {'path': 'localhost/data/k/t/md-{}-big-Data.db'.format(i), 'MD5': 'x', 'size': 1}
+            if i == 3:
+                obj['shard'] = 'ab'
+            backup.cached_manifest = json.dumps([{'keyspace': 'k', 'columnfamily': 't', 'objects': [obj]}])
+            backups.append(backup)
+        try:
+            with mock.patch.object(medusa.manifest.Manifest, 'parse', wraps=medusa.manifest.Manifest.parse) as parse:
+                paths, hashed = get_file_paths_from_manifests_for_differential_backups(backups)
+            self.assertEqual(len(backups), parse.call_count)
+            self.assertEqual(len(backups), len(paths))
+            self.assertIn('ab/localhost/data/k/t/md-3-big-Data.db', paths)
+            self.assertTrue(hashed)
+        finally:
+            for backup in backups:
+                backup._forget_manifest()
+
+    def test_journaled_paths(self):
+        with tempfile.TemporaryDirectory() as journal_dir:
+            storage_config = self.config.storage._replace(backup_journal_dir=journal_dir, fqdn='localhost')
+            config = self.config._replace(storage=storage_config)
+            self.assertEqual(set(), journaled_paths(config))
+
+            shipped = continuous_journal(storage_config, None)
+            shipped.add('localhost/data/k/t', ManifestObject('localhost/data/k/t/md-1-big-Data.db', 1, 'x'))
+            shipped.close()
+            # an interrupted backup uploaded a file and packed the small components of another SSTable
+            interrupted = backup_journal(storage_config, None, 'interrupted')
+            interrupted.add('localhost/data/k/t', ManifestObject('localhost/data/k/t/md-2-big-Data.db', 1, 'x'))
+            interrupted.add('localhost/data/k/t', ManifestObject(
+                'localhost/data/k/t/md-3-big-Summary.db', 1, 'x', archive='localhost/data/k/t/md-3-big.pack'))
+            interrupted.close()
+
+            self.assertEqual({
+                'localhost/data/k/t/md-1-big-Data.db',
+                'localhost/data/k/t/md-2-big-Data.db',
+                'localhost/data/k/t/md-3-big.pack',
+            }, journaled_paths(config))
+
+            # completed backups remove their journal
+            interrupted.remove()
+            self.assertEqual({'localhost/data/k/t/md-1-big-Data.db'}, journaled_paths(config))
+
+            # gsutil gives the URLs of the objects, which get protected by their key
+            shipped.add('localhost/data/k/t', ManifestObject('gs://purge_test/localhost/data/k/t/md-4-big-Data.db',
+                                                             1, 'x'))
+            shipped.close()
+            self.assertIn('localhost/data/k/t/md-4-big-Data.db', journaled_paths(config))
+
+    def make_backup(self, storage, name, backup_date, differential=False, scope=None):
         if differential is True:
             differential_blob = self.make_blob("localhost/{}/meta/differential".format(name), backup_date.timestamp())
         else:
@@ -108,7 +193,8 @@ class PurgeTest(unittest.TestCase):
         return NodeBackup(storage=storage, fqdn="localhost", name=str(name),
                           differential_blob=differential_blob, manifest_blob=manifest_blob,
                           tokenmap_blob=tokenmap_blob, schema_blob=schema_blob,
-                          started_timestamp=backup_date.timestamp(), finished_timestamp=backup_date.timestamp())
+                          started_timestamp=backup_date.timestamp(), finished_timestamp=backup_date.timestamp(),
+                          scope=scope or BackupScope())
 
     def make_blob(self, blob_name, blob_date):
         extra = {
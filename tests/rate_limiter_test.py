@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Spotify AB. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import configparser
+import os
+import tempfile
+import unittest
+
+import medusa.rate_limiter
+
+from medusa.config import StorageConfig, _namedtuple_from_dict
+from medusa.rate_limiter import RateLimiter, TokenBucket
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0, self.clock, self.clock.sleep)
+        self.assertEqual(0, bucket.acquire(10 ** 12))
+        self.assertEqual(0, self.clock.now)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100, self.clock, self.clock.sleep)
+        # a full second of tokens is available right away
+        self.assertEqual(0, bucket.acquire(100))
+        self.assertEqual(0.5, bucket.acquire(50))
+        # going into debt makes the next callers wait for it
+        self.assertEqual(3, bucket.acquire(300))
+        self.assertEqual(3.5, self.clock.now)
+        self.clock.now += 10
+        self.assertEqual(0, bucket.acquire(100))
+
+    def test_control_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            control_file = os.path.join(tmp_dir, 'limits')
+            limiter = RateLimiter(bytes_per_second=100, control_file=control_file, clock=self.clock,
+                                  sleep=self.clock.sleep)
+            limiter.consume(100)
+            self.assertEqual(100, limiter.bytes_per_second)
+
+            with open(control_file, 'w') as f:
+                f.write('bytes_per_second = 1000\nrequests_per_second = 5\n')
+            self.clock.now += medusa.rate_limiter.CONTROL_FILE_CHECK_INTERVAL_SECONDS
+            limiter.request()
+            self.assertEqual(1000, limiter.bytes_per_second)
+            self.assertEqual(5, limiter.requests_per_second)
+
+            # unreadable limits leave the current ones in place
+            with open(control_file, 'w') as f:
+                f.write('bytes_per_second = fast\n')
+            os.utime(control_file, ns=(0, 0))
+            self.clock.now += medusa.rate_limiter.CONTROL_FILE_CHECK_INTERVAL_SECONDS
+            limiter.request()
+            self.assertEqual(1000, limiter.bytes_per_second)
+
+    def test_control_file_shared_by_workers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            control_file = os.path.join(tmp_dir, 'limits')
+            limiter = RateLimiter(bytes_per_second=1000, requests_per_second=10, control_file=control_file,
+                                  clock=self.clock, sleep=self.clock.sleep, workers=4)
+            self.assertEqual((250, 2), (limiter.bytes_per_second, limiter.requests_per_second))
+
+            # each of the 4 worker processes gets a share of the limits of the control file too
+            with open(control_file, 'w') as f:
+                f.write('bytes_per_second = 4000\nrequests_per_second = 40\n')
+            limiter.request()
+            self.assertEqual((1000, 10), (limiter.bytes_per_second, limiter.requests_per_second))
+
+    def test_configure(self):
+        config = configparser.ConfigParser(interpolation=None)
+        config['storage'] = {
+            'backup_max_bandwidth': '1048576',
+            'restore_max_requests': '10',
+        }
+        storage_config = _namedtuple_from_dict(StorageConfig, config['storage'])
+        try:
+            limiter = medusa.rate_limiter.configure(storage_config, 'backup')
+            self.assertIs(limiter, medusa.rate_limiter.get_limiter())
+            self.assertEqual((1048576, 0), (limiter.bytes_per_second, limiter.requests_per_second))
+            limiter = medusa.rate_limiter.configure(storage_config, 'restore')
+            self.assertEqual((0, 10), (limiter.bytes_per_second, limiter.requests_per_second))
+            with self.assertRaises(ValueError):
+                medusa.rate_limiter.configure(storage_config, 'compaction')
+        finally:
+            medusa.rate_limiter.configure(_namedtuple_from_dict(StorageConfig, {}), 'backup')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,8 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import configparser
-import json
+import pathlib
+import tempfile
 import unittest
 
 from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict
@@ -49,6 +51,30 @@ class RestoreNodeTest(unittest.TestCase):
             tokens = restore_node.get_node_tokens('node3.mydomain.net', f)
             self.assertEqual(tokens, ['2', '3'])
 
+    def test_spread_sstables(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            table_dir = pathlib.Path(tmp_dir) / 'ks' / 't-1234'
+            table_dir.mkdir(parents=True)
+            for generation, size in [(1, 300), (2, 200), (3, 150)]:
+                (table_dir / 'md-{}-big-Data.db'.format(generation)).write_bytes(b'x' * size)
+                (table_dir / 'md-{}-big-Index.db'.format(generation)).write_bytes(b'x')
+            (table_dir / 'schema.cql').write_bytes(b'x')
+            disk1, disk2 = pathlib.Path('/disk1'), pathlib.Path('/disk2')
+
+            restored_sizes = collections.Counter()
+            placement = restore_node.spread_sstables(table_dir, [disk1, disk2], restored_sizes)
+            names = {data_dir: sorted(path.name for path in paths) for data_dir, paths in placement.items()}
+
+            # the components of an SSTable stay together, each going to the disk which got the least data so far
+            self.assertEqual(['md-1-big-Data.db', 'md-1-big-Index.db', 'schema.cql'], names[disk1])
+            self.assertEqual(['md-2-big-Data.db', 'md-2-big-Index.db', 'md-3-big-Data.db', 'md-3-big-Index.db'],
+                             names[disk2])
+            self.assertEqual({disk1: 302, disk2: 352}, restored_sizes)
+
+            # the next table starts with the disk which got the least data
+            placement = restore_node.spread_sstables(table_dir, [disk1, disk2], restored_sizes)
+            self.assertIn(table_dir / 'md-1-big-Data.db', placement[disk1])
+
     def test_get_sections_to_restore(self):
 
         # nothing skipped, both tables make it to restore
@@ -58,7 +84,7 @@ class RestoreNodeTest(unittest.TestCase):
             {'keyspace': 'k1', 'columnfamily': 't1', 'objects': []},
             {'keyspace': 'k2', 'columnfamily': 't2', 'objects': []}
         ]
-        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, json.dumps(manifest))
+        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, manifest)
         self.assertEquals({'k1.t1', 'k2.t2'}, to_restore)
 
         # skipping one table (must be specified as a fqtn)
@@ -68,7 +94,7 @@ class RestoreNodeTest(unittest.TestCase):
             {'keyspace': 'k1', 'columnfamily': 't1', 'objects': []},
             {'keyspace': 'k2', 'columnfamily': 't2', 'objects': []}
         ]
-        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, json.dumps(manifest))
+        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, manifest)
         self.assertEquals({'k2.t2'}, to_restore)
 
         # saying only table name doesn't cause a keep
@@ -78,7 +104,7 @@ class RestoreNodeTest(unittest.TestCase):
             {'keyspace': 'k1', 'columnfamily': 't1', 'objects': []},
             {'keyspace': 'k2', 'columnfamily': 't2', 'objects': []}
         ]
-        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, json.dumps(manifest))
+        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, manifest)
         self.assertEquals(set(), to_restore)
 
         # keeping the whole keyspace
@@ -89,7 +115,7 @@ class RestoreNodeTest(unittest.TestCase):
             {'keyspace': 'k2', 'columnfamily': 't2', 'objects': []},
             {'keyspace': 'k2', 'columnfamily': 't3', 'objects': []}
         ]
-        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, json.dumps(manifest))
+        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, manifest)
         self.assertEquals({'k2.t2', 'k2.t3'}, to_restore)
 
     def test_get_sections_to_restore_with_cfids(self):
@@ -101,7 +127,7 @@ class RestoreNodeTest(unittest.TestCase):
             {'keyspace': 'k1', 'columnfamily': 't1-bigBadCfId', 'objects': []},
             {'keyspace': 'k2', 'columnfamily': 't2-81ffe430e50c11e99f91a15641db358f', 'objects': []},
         ]
-        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, json.dumps(manifest))
+        to_restore = restore_node.get_fqtns_to_restore(keep_keyspaces, keep_tables, manifest)
         self.assertEquals({'k2.t2-81ffe430e50c11e99f91a15641db358f'}, to_restore)
 
     def test_keyspace_is_allowed_to_restore(self):
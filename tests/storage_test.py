@@ -14,20 +14,30 @@
 # limitations under the License.
 
 import base64
+import collections
+import concurrent.futures
 import configparser
 import datetime
 import hashlib
 import os
 import shutil
 import tempfile
+import threading
 import unittest
 
+from unittest.mock import Mock, patch
+
+import medusa.rate_limiter
 import medusa.storage.abstract_storage
+import medusa.storage.checksum
+import medusa.storage.concurrent
 
-from medusa.backup import generate_md5_hash
+from medusa.backup import generate_md5_hash, generate_md5_hashes, make_manifest_item
 from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict, CassandraConfig
 from medusa.index import build_indices
-from medusa.storage import Storage
+from medusa.storage import CachedObject, ManifestObject, Storage
+from medusa.storage.connection_pool import ConnectionPool
+from medusa.storage.google_storage import GoogleStorage
 
 
 class RestoreNodeTest(unittest.TestCase):
@@ -176,6 +186,269 @@ class RestoreNodeTest(unittest.TestCase):
             tf.seek(0)
             self.assertNotEqual(digest_full, generate_md5_hash(tf.name, block_size=0))
 
+    def test_generate_md5_hashes(self):
+        files = list()
+        try:
+            for size in [0, 1, 65536, 2 * 1024 * 1024 + 1]:
+                tf = tempfile.NamedTemporaryFile()
+                tf.write(os.urandom(size))
+                tf.flush()
+                files.append(tf)
+            names = [tf.name for tf in files]
+            self.assertEqual(
+                [generate_md5_hash(name) for name in names],
+                generate_md5_hashes(names, block_size=4096, max_workers=3)
+            )
+            self.assertEqual([], generate_md5_hashes([]))
+        finally:
+            for tf in files:
+                tf.close()
+
+    def test_upload_blobs_single_pass(self):
+        with tempfile.NamedTemporaryFile() as tf:
+            tf.write(os.urandom(3 * 1024 * 1024 + 1))
+            tf.flush()
+            manifest_objects = medusa.storage.concurrent.upload_blobs(
+                self.storage.storage_driver, [tf.name], 'single_pass', self.storage.storage_driver.bucket,
+                single_pass=True
+            )
+            blob = self.storage.storage_driver.get_blob('single_pass/{}'.format(os.path.basename(tf.name)))
+            self.assertEqual(1, len(manifest_objects))
+            self.assertEqual(blob.size, manifest_objects[0].size)
+            self.assertEqual(blob.hash, manifest_objects[0].MD5)
+            tf.seek(0)
+            self.assertEqual(tf.read(), self.storage.storage_driver.get_blob_content_as_bytes(blob.name))
+
+    def test_limited_transfers_stream_through_limiter(self):
+        limiter = medusa.rate_limiter.RateLimiter(bytes_per_second=10 ** 12)
+        size = 3 * 1024 * 1024 + 1
+        with tempfile.NamedTemporaryFile() as tf, patch('medusa.rate_limiter._limiter', limiter), \
+                patch.object(limiter, 'consume', wraps=limiter.consume) as consume:
+            tf.write(os.urandom(size))
+            tf.flush()
+            manifest_object, = medusa.storage.concurrent.upload_blobs(
+                self.storage.storage_driver, [tf.name], 'limited', self.storage.storage_driver.bucket)
+            # the file goes through the limiter a chunk at a time rather than at once
+            self.assertGreater(consume.call_count, 1)
+            self.assertLess(max(call[0][0] for call in consume.call_args_list), size)
+            self.assertEqual(size, sum(call[0][0] for call in consume.call_args_list))
+
+            consume.reset_mock()
+            self.storage.storage_driver.download_blobs([manifest_object.path], self.local_storage_dir)
+            self.assertGreater(consume.call_count, 1)
+            self.assertEqual(size, sum(call[0][0] for call in consume.call_args_list))
+            tf.seek(0)
+            with open(os.path.join(self.local_storage_dir, os.path.basename(tf.name)), 'rb') as f:
+                self.assertEqual(tf.read(), f.read())
+
+    def test_upload_blobs_single_pass_verifies_checksum(self):
+        def upload_object_via_stream(iterator, container, object_name):
+            content = b''.join(iterator)
+            return Mock(name=object_name, size=len(content), hash=reported_hash)
+
+        storage = Mock()
+        storage.connect_storage.return_value.upload_object_via_stream.side_effect = upload_object_via_stream
+        storage.reports_md5.return_value = True
+        storage.uses_multipart.return_value = False
+        storage.codec_for.return_value = None
+        storage.object_key.side_effect = '{}/{}'.format
+        storage.checksum = medusa.storage.checksum.get_checksum()
+        storage.connection_pool = ConnectionPool(storage.connect_storage)
+        storage.hashes_match = medusa.storage.abstract_storage.AbstractStorage.hashes_match
+
+        with tempfile.NamedTemporaryFile() as tf:
+            tf.write(b'content of the test file1')
+            tf.flush()
+
+            reported_hash = hashlib.md5(b'some other content').hexdigest()
+            with self.assertRaises(IOError):
+                medusa.storage.concurrent.upload_blobs(storage, [tf.name], 'dest', None, single_pass=True)
+
+            reported_hash = hashlib.md5(b'content of the test file1').hexdigest()
+            manifest_objects = medusa.storage.concurrent.upload_blobs(storage, [tf.name], 'dest', None,
+                                                                      single_pass=True)
+            self.assertEqual(
+                base64.b64encode(hashlib.md5(b'content of the test file1').digest()).decode('UTF-8'),
+                manifest_objects[0].MD5
+            )
+
+            # files hashed with another checksum get their upload checked against their MD5 all the same, whether
+            # single pass uploads are enabled or not
+            storage.checksum = medusa.storage.checksum.get_checksum('blake2')
+            for single_pass in [True, False]:
+                reported_hash = hashlib.md5(b'some other content').hexdigest()
+                with self.assertRaises(IOError):
+                    medusa.storage.concurrent.upload_blobs(storage, [tf.name], 'dest', None, single_pass=single_pass)
+
+                reported_hash = hashlib.md5(b'content of the test file1').hexdigest()
+                manifest_object, = medusa.storage.concurrent.upload_blobs(storage, [tf.name], 'dest', None,
+                                                                          single_pass=single_pass)
+                self.assertEqual(storage.checksum.digest(b'content of the test file1'), manifest_object.MD5)
+                self.assertEqual(('blake2', reported_hash), (manifest_object.checksum, manifest_object.etag))
+
+    def test_upload_blobs_multipart(self):
+        part_size = medusa.storage.concurrent.MULTIPART_MIN_PART_SIZE
+        storage_driver = self.storage.storage_driver
+        storage_driver.config = self.config.storage._replace(multipart_threshold=part_size,
+                                                             multipart_part_size=part_size)
+        with tempfile.NamedTemporaryFile() as tf:
+            content = os.urandom(2 * part_size + 1)
+            tf.write(content)
+            tf.flush()
+            manifest_objects = medusa.storage.concurrent.upload_blobs(storage_driver, [tf.name], 'multipart',
+                                                                      storage_driver.bucket)
+            blob = storage_driver.get_blob('multipart/{}'.format(os.path.basename(tf.name)))
+            self.assertEqual(content, storage_driver.get_blob_content_as_bytes(blob.name))
+            self.assertEqual(1, len(manifest_objects))
+            self.assertEqual(len(content), manifest_objects[0].size)
+            self.assertEqual(generate_md5_hash(tf.name), manifest_objects[0].MD5)
+            self.assertEqual(part_size, manifest_objects[0].part_size)
+            self.assertEqual(blob.hash, manifest_objects[0].etag)
+            # only the object is left in the bucket
+            self.assertEqual([blob.name], [obj.name for obj in storage_driver.list_objects('multipart')])
+
+    def test_upload_files_from_processes(self):
+        storage_driver = self.storage.storage_driver
+        with tempfile.TemporaryDirectory() as src_dir:
+            transfers = []
+            for i in range(4):
+                src = os.path.join(src_dir, 'file{}'.format(i))
+                with open(src, 'wb') as f:
+                    f.write(os.urandom(1024 * (i + 1)))
+                transfers.append((src, 'processes/{}'.format(i % 2)))
+
+            uploaded = list(medusa.storage.concurrent.upload_files(storage_driver, transfers, storage_driver.bucket,
+                                                                   processes=2))
+            self.assertEqual(sorted(dest for _, dest in transfers), sorted(dest for dest, _ in uploaded))
+            for dest, manifest_object in uploaded:
+                src = os.path.join(src_dir, os.path.basename(manifest_object.path))
+                self.assertEqual(os.path.getsize(src), manifest_object.size)
+                self.assertEqual(storage_driver.get_blob(manifest_object.path).hash, manifest_object.MD5)
+                with open(src, 'rb') as f:
+                    self.assertEqual(f.read(), storage_driver.get_blob_content_as_bytes(manifest_object.path))
+
+    def test_schedule_largest_first(self):
+        sizes = {'a': 1, 'b': 300, 'c': 2, 'd': 100, 'e': 100}
+        transfers = [(name, 'dest') for name in sorted(sizes)]
+        scheduled = medusa.storage.concurrent.schedule_largest_first(transfers, 2, size=sizes.get,
+                                                                     key=lambda transfer: transfer[0],
+                                                                     device=lambda src: None)
+        self.assertEqual(['b', 'd', 'e', 'c', 'a'], [name for name, _ in scheduled])
+        # with a and b on another disk, both disks get read from the start
+        scheduled = medusa.storage.concurrent.schedule_largest_first(transfers, 2, size=sizes.get,
+                                                                     key=lambda transfer: transfer[0],
+                                                                     device=lambda src: src in 'ab')
+        self.assertEqual(['b', 'd', 'a', 'e', 'c'], [name for name, _ in scheduled])
+        # the large file goes first, so the others get spread on the second worker
+        self.assertEqual(300, medusa.storage.concurrent.expected_makespan([300, 100, 100, 2, 1], 2))
+        # in glob order, the large file starts after the others and runs alone
+        self.assertEqual(401, medusa.storage.concurrent.expected_makespan([1, 2, 100, 100, 300], 2))
+
+    def test_multipart_etag(self):
+        parts = [b'first part', b'second part']
+        part_digests = [hashlib.md5(part).digest() for part in parts]
+        self.assertEqual(
+            '{}-2'.format(hashlib.md5(b''.join(part_digests)).hexdigest()),
+            medusa.storage.concurrent.multipart_etag(part_digests)
+        )
+        self.assertTrue(medusa.storage.abstract_storage.AbstractStorage.object_hash_matches(
+            {'MD5': base64.b64encode(hashlib.md5(b''.join(parts)).digest()).decode('UTF-8'),
+             'etag': medusa.storage.concurrent.multipart_etag(part_digests)},
+            medusa.storage.concurrent.multipart_etag(part_digests)
+        ))
+
+    def test_multipart_part_size(self):
+        min_part_size = medusa.storage.concurrent.MULTIPART_MIN_PART_SIZE
+        self.assertEqual(min_part_size, medusa.storage.concurrent.multipart_part_size(100 * min_part_size, 1024))
+        self.assertEqual(64 * 1024 * 1024,
+                         medusa.storage.concurrent.multipart_part_size(100 * 1024 * 1024, 64 * 1024 * 1024))
+        # 10000 parts are not enough to upload 1TB in parts of 64MB
+        part_size = medusa.storage.concurrent.multipart_part_size(1024 ** 4, 64 * 1024 * 1024)
+        self.assertEqual(105 * 1024 * 1024, part_size)
+        self.assertLessEqual(1024 ** 4 / part_size, medusa.storage.concurrent.MULTIPART_MAX_PARTS)
+
+    def test_execute_bounded(self):
+        consumed = []
+
+        def items():
+            for i in range(20):
+                consumed.append(i)
+                yield i
+
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            results = medusa.storage.concurrent.execute_bounded(executor, lambda i: i * 2, items(), 3)
+            first_item, first_result = next(results)
+            # only a bounded number of items got pulled from the iterable
+            self.assertLessEqual(len(consumed), 4)
+            self.assertEqual(first_item * 2, first_result)
+            self.assertEqual(sorted([(i, i * 2) for i in range(20) if i != first_item]), sorted(results))
+
+    def test_execute_bounded_per_group(self):
+        # the large files of disk a come first, they must not take all the workers from disk b
+        items = [('a', i) for i in range(6)] + [('b', i) for i in range(6)]
+        lock = threading.Lock()
+        running = collections.Counter()
+        first_running = []
+        all_started = threading.Event()
+
+        def read(item):
+            with lock:
+                running[item[0]] += 1
+                if sum(running.values()) == 4 and not first_running:
+                    first_running.append(dict(running))
+                    all_started.set()
+            all_started.wait(5)
+            with lock:
+                running[item[0]] -= 1
+            return item
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = medusa.storage.concurrent.execute_bounded(executor, read, items, 8,
+                                                                group=lambda item: item[0], max_per_group=2)
+            self.assertEqual(sorted(items), sorted(result for _, result in results))
+        self.assertEqual([{'a': 2, 'b': 2}], first_running)
+
+    def test_gcs_composite_objects_record_crc32c(self):
+        storage = GoogleStorage.__new__(GoogleStorage)
+        storage.bucket = Mock()
+        storage.bucket.name = 'bucket'
+        connection = Mock()
+        connection.connection.request.return_value = Mock(status=200, headers={
+            'x-goog-hash': 'crc32c=n03x6A==', 'etag': '"CJDH3/vE6eMCEAE="'})
+        storage.connection_pool = ConnectionPool(lambda: connection)
+
+        uploaded = [ManifestObject('gs://bucket/node/data/ks/t/md-1-big-Data.db', 10, ''),
+                    ManifestObject('gs://bucket/node/data/ks/t/md-1-big-Index.db', 5, 'md5')]
+        composite, regular = storage._with_composite_checksums(uploaded)
+        self.assertEqual(('n03x6A==', 'CJDH3/vE6eMCEAE=', 'crc32c'),
+                         (composite.MD5, composite.etag, composite.checksum))
+        self.assertEqual(uploaded[1], regular)
+        connection._get_object_path.assert_called_once_with(storage.bucket, 'node/data/ks/t/md-1-big-Data.db')
+        self.assertTrue(storage.object_hash_matches(composite._asdict(), 'CJDH3/vE6eMCEAE='))
+
+    def test_gcs_copies_compressed_files_of_previous_backups(self):
+        storage = GoogleStorage.__new__(GoogleStorage)
+        storage.config = self.config.storage._replace(storage_provider='google_storage', compression_codec='zlib')
+        storage.bucket = Mock()
+        storage.bucket.name = 'bucket'
+        storage.connection_pool = ConnectionPool(Mock)
+        storage._gsutil_lock = threading.Lock()
+        storage._gsutil = Mock()
+        storage._gsutil.cp.side_effect = AssertionError('gsutil got used')
+        storage.copy_object = Mock(return_value=Mock(hash='stored-md5'))
+        storage.copy_object.return_value.name = 'node/backup2/data/ks/t/md-1-big-Data.db'
+
+        # a file compressed by the previous full backup gets copied into the next one
+        item = {'path': 'node/backup1/data/ks/t/md-1-big-Data.db', 'MD5': 'file-md5', 'size': 100,
+                'codec': 'zlib', 'stored_size': 40, 'etag': 'stored-md5'}
+        (dest, copied), = storage.upload_files([(CachedObject('node/backup1/data/ks/t/md-1-big-Data.db', item),
+                                                 'node/backup2/data/ks/t')])
+        self.assertEqual('node/backup2/data/ks/t', dest)
+        self.assertEqual(
+            dict(item, path='node/backup2/data/ks/t/md-1-big-Data.db'),
+            make_manifest_item(copied, 'node')
+        )
+
     def test_get_object_datetime(self):
         file1_content = "content of the test file1"
         self.storage.storage_driver.upload_blob_from_string("test_download_blobs1/file1.txt", file1_content)